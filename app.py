@@ -1,20 +1,11 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context, abort
 from datetime import datetime, date
 import os
 import random
 import sqlite3
-import io
 import csv
 import json
 
-# Optional pandas import with fallback
-try:
-    import pandas as pd
-    PANDAS_AVAILABLE = True
-except ImportError:
-    PANDAS_AVAILABLE = False
-    print("⚠️ Pandas not available - CSV export will use basic CSV module")
-
 app = Flask(__name__)
 
 # Configuration for production and development
@@ -41,24 +32,65 @@ database_path = os.path.join(data_dir, 'pathology.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{database_path}')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-print(f"📁 Database location: {database_path}")
-print(f"📊 Database exists: {os.path.exists(database_path)}")
+# Handle PostgreSQL URL format for DigitalOcean (and name the psycopg2 driver)
+import db_connections
+app.config['SQLALCHEMY_DATABASE_URI'] = db_connections.normalize_url(app.config['SQLALCHEMY_DATABASE_URI'])
+
+# The raw SQL paths open the file a sqlite DATABASE_URL names; on PostgreSQL
+# everything goes through the engine's connection pool
+sqlite_database = db_connections.sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+if sqlite_database:
+    database_path = os.path.abspath(sqlite_database)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_connections.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+if sqlite_database:
+    print(f"📁 Database location: {database_path}")
+    print(f"📊 Database exists: {os.path.exists(database_path)}")
+else:
+    print(f"📁 Database server: {app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]}")
 
 # Database connection helper function
 def get_db_connection():
-    """Get a direct SQLite connection for raw SQL operations"""
-    conn = sqlite3.connect(database_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get a connection for raw SQL operations (close() releases it)
 
-# Handle PostgreSQL URL format for DigitalOcean
-if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
-    app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://', 1)
+    A pooled sqlite3 connection with name-indexed rows, or on PostgreSQL a
+    connection checked out of the SQLAlchemy engine pool.
+    """
+    if sqlite_database:
+        return db_connections.get_pool(database_path).acquire(row_factory=sqlite3.Row)
+    return db.engine.raw_connection()
 
 # Initialize database
 from models import db, Patient, Test, PatientTest, Hospital, SampleCollector, Payment, PatientBill, Doctor, DoctorCommission
+from financials import build_financial_overview
+from pagination import paginate_request, encode_key_cursor, decode_key_cursor
+import patient_search
+import commission_ledger
+import billing
+import dashboard_counters
+import result_entry
+import orders
+import catalog_cache
+import reference_data
+import table_export
+import table_search
+import table_stats
+import read_replica
+from read_replica import use_replica
+import migrate_add_barcode
+import migrate_add_bill_discount
 db.init_app(app)
 
+# Optional read replica (REPLICA_DATABASE_URL) for the report and viewer routes
+read_replica.router.init_app(app)
+read_replica.track_writes(db)
+
+# SQLite performance profile (WAL, synchronous=NORMAL, mmap, cache, busy timeout)
+# for the engine's connections, and periodic PRAGMA optimize
+with app.app_context():
+    if db_connections.configure_engine(db.engine, app.config.get('SQLITE_PRAGMAS')):
+        db_connections.start_optimizer(db.engine)
+
 # Create tables automatically on app startup (for production deployment)
 def init_database():
     """Initialize database tables on startup"""
@@ -67,6 +99,10 @@ def init_database():
         db.create_all()
         print("✅ Database tables created successfully!")
 
+        # create_all() skips existing tables - add columns newer than the database
+        migrate_add_barcode.add_barcode_column(db.engine)
+        migrate_add_bill_discount.add_discount_columns(db.engine)
+
         # Check if tables exist
         from sqlalchemy import inspect
         inspector = inspect(db.engine)
@@ -80,6 +116,17 @@ def init_database():
         else:
             print(f"📊 Found {patient_count} patients in database")
 
+        # Trigram search index for patient names and phone numbers
+        patient_search.ensure_search_index()
+
+        # Database viewer search indexes are built on demand with
+        # `python table_search.py build <table> [columns]` - unindexed tables use LIKE
+
+        # Backfill the doctor commission ledger for databases created before it existed
+        if DoctorCommission.query.count() == 0 and PatientTest.query.count() > 0:
+            result = commission_ledger.rebuild()
+            print(f"💰 Commission ledger backfilled with {result['inserted']} entries")
+
     except Exception as e:
         print(f"❌ Error creating tables: {e}")
         # Don't fail the app startup, just log the error
@@ -186,10 +233,11 @@ def login_required(f):
 @app.route('/')
 @login_required
 def index():
-    total_patients = Patient.query.count()
-    total_tests = Test.query.count()
-    pending_tests = PatientTest.query.filter_by(status='Pending').count()
-    completed_tests = PatientTest.query.filter_by(status='Completed').count()
+    counters = dashboard_counters.get_counters()
+    total_patients = counters['total_patients']
+    total_tests = counters['total_tests']
+    pending_tests = counters['pending_tests']
+    completed_tests = counters['completed_tests']
     recent_patients = Patient.query.order_by(Patient.date_registered.desc()).limit(5).all()
 
     # Use joinedload to avoid lazy loading issues
@@ -212,28 +260,65 @@ def index():
 @login_required
 def patients():
     search = request.args.get('search', '')
+    query = Patient.query
     if search:
-        patients = Patient.query.filter(
-            (Patient.first_name.contains(search)) |
-            (Patient.last_name.contains(search)) |
-            (Patient.phone.contains(search))
-        ).order_by(Patient.date_registered.desc()).all()
-    else:
-        patients = Patient.query.order_by(Patient.date_registered.desc()).all()
-    return render_template('patients.html', patients=patients, search=search)
+        query = patient_search.filter_query(query, search)
+    page = paginate_request(query, Patient.date_registered, Patient.id)
+    return render_template('patients.html', patients=page.items, page=page, search=search)
+
+@app.route('/api/patients/search')
+@login_required
+def api_search_patients():
+    """Type-ahead patient lookup by name, phone (exact or last digits) or patient ID"""
+    search = request.args.get('q', '').strip()
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        limit = 10
+
+    results = patient_search.search_patients(search, limit)
+    return jsonify({
+        'query': search,
+        'results': [{
+            'id': patient.id,
+            'name': patient.full_name,
+            'phone': patient.phone,
+            'age': patient.age,
+            'gender': patient.gender,
+            'match': match_type
+        } for patient, match_type in results]
+    })
+
+@app.route('/api/patients/picker')
+@login_required
+def api_patient_picker():
+    """Paged patient lookup for the patient picker: ?q= name, phone or ID, newest first, ?after= cursor"""
+    search = request.args.get('q', '').strip()
+    exact, query = patient_search.picker_query(search)
+    page = paginate_request(query, Patient.date_registered, Patient.id, default_per_page=20)
+    patients = page.items
+    if exact is not None and not page.has_prev:
+        patients = [exact] + patients
+    return jsonify({
+        'query': search,
+        'results': [{
+            'id': patient.id,
+            'name': patient.full_name,
+            'phone': patient.phone,
+            'age': patient.age,
+            'gender': patient.gender
+        } for patient in patients],
+        'next_cursor': page.next_cursor,
+        'next_url': page.next_url
+    })
 
 @app.route('/register_patient', methods=['GET', 'POST'])
 def register_patient():
     form = PatientForm()
-    # Populate hospital dropdown
-    hospitals = Hospital.query.all()
-    form.hospital_name.choices = [('', 'Select Hospital')] + [(h.name, h.name) for h in hospitals]
-    # Populate collected_by dropdown
-    collectors = SampleCollector.query.all()
-    form.collected_by.choices = [('', 'Select Collector')] + [(c.name, c.name) for c in collectors]
-    # Populate referring doctor dropdown
-    doctors = Doctor.query.filter_by(is_active=True).all()
-    form.referring_doctor.choices = [('', 'Select Referring Doctor')] + [(str(d.id), f"{d.name} - {d.specialization or 'General'}") for d in doctors]
+    # Populate hospital, collected_by and referring doctor dropdowns (cached)
+    form.hospital_name.choices = reference_data.hospital_choices()
+    form.collected_by.choices = reference_data.collector_choices()
+    form.referring_doctor.choices = reference_data.doctor_choices()
 
     if request.method == 'POST':
         try:
@@ -278,15 +363,10 @@ def register_patient():
 def edit_patient(id):
     patient = Patient.query.get_or_404(id)
     form = PatientForm(obj=patient)
-    # Populate hospital dropdown
-    hospitals = Hospital.query.all()
-    form.hospital_name.choices = [('', 'Select Hospital')] + [(h.name, h.name) for h in hospitals]
-    # Populate collected_by dropdown
-    collectors = SampleCollector.query.all()
-    form.collected_by.choices = [('', 'Select Collector')] + [(c.name, c.name) for c in collectors]
-    # Populate referring doctor dropdown
-    doctors = Doctor.query.filter_by(is_active=True).all()
-    form.referring_doctor.choices = [('', 'Select Referring Doctor')] + [(str(d.id), f"{d.name} - {d.specialization or 'General'}") for d in doctors]
+    # Populate hospital, collected_by and referring doctor dropdowns (cached)
+    form.hospital_name.choices = reference_data.hospital_choices()
+    form.collected_by.choices = reference_data.collector_choices()
+    form.referring_doctor.choices = reference_data.doctor_choices()
 
     # Set current referring doctor if exists
     if patient.referring_doctor_id:
@@ -329,31 +409,13 @@ def patient_detail(id):
     ).filter_by(patient_id=id).order_by(PatientTest.date_ordered.desc()).all()
 
     # Get all available tests for assignment
-    all_tests = Test.query.all()
+    all_tests = catalog_cache.get_catalog().tests
 
     # Get sample collectors for dropdown
-    collectors = SampleCollector.query.all()
-
-    # Get or create patient bill
-    patient_bill = PatientBill.query.filter_by(patient_id=id).first()
-    if not patient_bill:
-        patient_bill = PatientBill(
-            patient_id=id,
-            total_amount=0.0,
-            paid_amount=0.0,
-            remaining_amount=0.0
-        )
-        db.session.add(patient_bill)
-        db.session.commit()
+    collectors = reference_data.sample_collectors()
 
-    # Calculate total test cost
-    total_test_cost = sum(pt.test.cost for pt in patient_tests)
-
-    # Update bill if needed
-    if patient_bill.total_amount != total_test_cost:
-        patient_bill.total_amount = total_test_cost
-        patient_bill.remaining_amount = total_test_cost - patient_bill.paid_amount
-        db.session.commit()
+    # Bill totals are kept up to date when tests change - read only here
+    patient_bill = billing.bill_for_display(id)
 
     return render_template('patient_detail.html',
                          patient=patient,
@@ -377,52 +439,60 @@ def update_patient_tests(patient_id):
         results = request.form.getlist('results[]')
         notes = request.form.getlist('notes[]')
 
-        # Update each test
+        # Load this patient's tests being edited in one query
+        current = result_entry.load_for_update(
+            (int(test_id) for test_id in test_ids if test_id), patient_id=patient_id
+        )
+        now = datetime.now()
+        changes = []
+
         for i, test_id in enumerate(test_ids):
-            if test_id:  # Only process if test_id exists
-                patient_test = PatientTest.query.filter_by(
-                    patient_id=patient_id,
-                    id=int(test_id)
-                ).first()
+            patient_test = current.get(int(test_id)) if test_id else None
+            if not patient_test:
+                continue
+            change = {'id': patient_test.id}
+
+            # Update status
+            if i < len(statuses):
+                change['status'] = statuses[i]
 
-                if patient_test:
-                    # Update status
-                    if i < len(statuses):
-                        old_status = patient_test.status
-                        patient_test.status = statuses[i]
+                # Set completion date if status changed to Completed
+                if patient_test.status != 'Completed' and statuses[i] == 'Completed':
+                    change['date_completed'] = now
 
-                        # Set completion date if status changed to Completed
-                        if old_status != 'Completed' and statuses[i] == 'Completed':
-                            patient_test.date_completed = datetime.now()
+            # Update results
+            if i < len(results):
+                change['results'] = results[i] if results[i] else None
 
-                    # Update results
-                    if i < len(results):
-                        patient_test.results = results[i] if results[i] else None
+            # Update notes
+            if i < len(notes):
+                change['notes'] = notes[i] if notes[i] else None
 
-                    # Update notes
-                    if i < len(notes):
-                        patient_test.notes = notes[i] if notes[i] else None
+            changes.append(change)
+
+        result_entry.apply_changes(current, changes)
 
         # Handle new test assignments
-        new_test_ids = request.form.getlist('new_test_ids[]')
+        new_test_ids = [int(test_id) for test_id in request.form.getlist('new_test_ids[]') if test_id]
         new_tests_total_cost = 0
 
         if new_test_ids:
             sample_collector = request.form.get('sample_collector', '')
+            catalog = catalog_cache.get_catalog()
             for new_test_id in new_test_ids:
-                if new_test_id:
-                    test = Test.query.get(int(new_test_id))
-                    if test:
-                        new_tests_total_cost += test.cost
+                test = catalog.get(new_test_id)
+                if not test:
+                    continue
+                new_tests_total_cost += test.cost or 0
 
-                    new_patient_test = PatientTest(
-                        patient_id=patient_id,
-                        test_id=int(new_test_id),
-                        date_ordered=datetime.now(),
-                        status='Pending',
-                        sample_collector=sample_collector if sample_collector else None
-                    )
-                    db.session.add(new_patient_test)
+                new_patient_test = PatientTest(
+                    patient_id=patient_id,
+                    test_id=new_test_id,
+                    date_ordered=datetime.now(),
+                    status='Pending',
+                    sample_collector=sample_collector if sample_collector else None
+                )
+                db.session.add(new_patient_test)
 
         # Handle payment for new tests
         if new_test_ids and new_tests_total_cost > 0:
@@ -449,20 +519,8 @@ def update_patient_tests(patient_id):
             payment_method = request.form.get('new_tests_payment_method')
             payment_reference = request.form.get('new_tests_payment_reference', '')
 
-            # Create or update patient bill
-            patient_bill = PatientBill.query.filter_by(patient_id=patient_id).first()
-            if not patient_bill:
-                patient_bill = PatientBill(
-                    patient_id=patient_id,
-                    total_amount=new_tests_total_cost,
-                    paid_amount=0,
-                    remaining_amount=new_tests_total_cost,
-                    bill_status='pending'
-                )
-                db.session.add(patient_bill)
-            else:
-                patient_bill.total_amount += new_tests_total_cost
-                patient_bill.remaining_amount += new_tests_total_cost
+            # Bill total is repriced from the new tests when they are flushed
+            patient_bill = billing.get_or_create_bill(patient_id)
 
             # Handle payment if collected
             if collect_payment and advance_amount > 0:
@@ -483,13 +541,7 @@ def update_patient_tests(patient_id):
                 db.session.add(payment)
 
                 # Update patient bill
-                patient_bill.paid_amount += advance_amount
-                patient_bill.remaining_amount = max(0, patient_bill.total_amount - patient_bill.paid_amount)
-
-                if patient_bill.remaining_amount <= 0:
-                    patient_bill.bill_status = 'paid'
-                else:
-                    patient_bill.bill_status = 'partial'
+                patient_bill = billing.record_payment(patient_id, advance_amount)
 
         # Handle payment from modal
         payment_option = request.form.get('payment_option')
@@ -521,23 +573,8 @@ def update_patient_tests(patient_id):
                 )
                 db.session.add(payment)
 
-                # Update patient bill if exists
-                if not patient_bill and new_tests_total_cost > 0:
-                    patient_bill = PatientBill(
-                        patient_id=patient_id,
-                        total_amount=new_tests_total_cost,
-                        paid_amount=payment_amount,
-                        remaining_amount=max(0, new_tests_total_cost - payment_amount),
-                        bill_status='partial' if payment_amount < new_tests_total_cost else 'paid'
-                    )
-                    db.session.add(patient_bill)
-                elif patient_bill:
-                    patient_bill.paid_amount += payment_amount
-                    patient_bill.remaining_amount = max(0, patient_bill.total_amount - patient_bill.paid_amount)
-                    if patient_bill.remaining_amount <= 0:
-                        patient_bill.bill_status = 'paid'
-                    else:
-                        patient_bill.bill_status = 'partial'
+                # Update patient bill
+                patient_bill = billing.record_payment(patient_id, payment_amount)
 
         db.session.commit()
 
@@ -629,23 +666,8 @@ def quick_update_test(test_id):
     """Quick update test results and collect payment from dashboard"""
     patient_test = PatientTest.query.get_or_404(test_id)
 
-    # Get or create patient bill
-    patient_bill = PatientBill.query.filter_by(patient_id=patient_test.patient_id).first()
-    if not patient_bill:
-        # Calculate total from all patient tests
-        from sqlalchemy.orm import joinedload
-        all_patient_tests = PatientTest.query.filter_by(patient_id=patient_test.patient_id).all()
-        total_amount = sum([pt.test.cost for pt in all_patient_tests])
-
-        patient_bill = PatientBill(
-            patient_id=patient_test.patient_id,
-            total_amount=total_amount,
-            paid_amount=0,
-            remaining_amount=total_amount,
-            bill_status='pending'
-        )
-        db.session.add(patient_bill)
-        db.session.commit()
+    # Get patient bill (read only until a payment is recorded)
+    patient_bill = billing.bill_for_display(patient_test.patient_id)
 
     if request.method == 'POST':
         try:
@@ -696,13 +718,7 @@ def quick_update_test(test_id):
                     db.session.add(payment)
 
                     # Update patient bill
-                    patient_bill.paid_amount += payment_amount
-                    patient_bill.remaining_amount -= payment_amount
-
-                    if patient_bill.remaining_amount <= 0:
-                        patient_bill.bill_status = 'paid'
-                    else:
-                        patient_bill.bill_status = 'partial'
+                    patient_bill = billing.record_payment(patient_test.patient_id, payment_amount)
 
             db.session.commit()
 
@@ -728,16 +744,16 @@ def quick_update_test(test_id):
     return render_template('quick_update_test.html', patient_test=patient_test, patient_bill=patient_bill)
 
 @app.route('/payment_overview')
+@use_replica
 def payment_overview():
     """Payment overview dashboard showing pending, paid, and remaining amounts with financial data and doctor commissions"""
     from sqlalchemy.orm import joinedload
     from sqlalchemy import func
 
     try:
-        # Get all patient bills with payment statistics
-        patient_bills = PatientBill.query.options(
-            joinedload(PatientBill.patient)
-        ).all()
+        # Shared set-based aggregation (bills, per-patient totals, doctor commissions)
+        overview = build_financial_overview()
+        patient_bills = overview.bills
 
         # Calculate summary statistics
         total_amount = sum([bill.total_amount for bill in patient_bills])
@@ -753,79 +769,9 @@ def payment_overview():
             joinedload(Payment.patient)
         ).order_by(Payment.payment_date.desc()).limit(10).all()
 
-        # FINANCIAL OVERVIEW DATA - Doctor Commissions
-        patients = Patient.query.all()
-        total_revenue = 0
-        total_collected = 0
-        total_pending = 0
-        total_doctor_commissions = 0
-        doctor_commission_summary = {}
-
-        # Process each patient for financial data
-        patient_financial_data = []
-        for patient in patients:
-            patient_tests = PatientTest.query.filter_by(patient_id=patient.id).all()
-            patient_bill = PatientBill.query.filter_by(patient_id=patient.id).first()
-
-            # Calculate patient totals
-            patient_total = sum(pt.test.cost for pt in patient_tests)
-            patient_paid = patient_bill.paid_amount if patient_bill else 0
-            patient_pending = patient_total - patient_paid
-
-            # Calculate doctor commissions for this patient
-            patient_doctor_commission = 0
-            if patient.referring_doctor_id:
-                doctor = Doctor.query.get(patient.referring_doctor_id)
-                if doctor and doctor.is_active:
-                    for pt in patient_tests:
-                        commission = doctor.calculate_commission(pt.test.cost)
-                        patient_doctor_commission += commission
-
-                        # Add to doctor summary
-                        if doctor.name not in doctor_commission_summary:
-                            doctor_commission_summary[doctor.name] = {
-                                'doctor': doctor,
-                                'total_commission': 0,
-                                'pending_commission': 0,
-                                'paid_commission': 0,
-                                'patient_count': 0
-                            }
-                        doctor_commission_summary[doctor.name]['total_commission'] += commission
-                        doctor_commission_summary[doctor.name]['pending_commission'] += commission
-                        doctor_commission_summary[doctor.name]['patient_count'] += 1
-
-            patient_financial_data.append({
-                'patient': patient,
-                'total_amount': patient_total,
-                'paid_amount': patient_paid,
-                'pending_amount': patient_pending,
-                'doctor_commission': patient_doctor_commission,
-                'test_count': len(patient_tests),
-                'bill': patient_bill
-            })
-
-            # Add to totals
-            total_revenue += patient_total
-            total_collected += patient_paid
-            total_pending += patient_pending
-            total_doctor_commissions += patient_doctor_commission
-
-        # Calculate net revenue (after doctor commissions)
-        net_revenue = total_revenue - total_doctor_commissions
-        net_collected = total_collected - total_doctor_commissions
-
-        # Summary statistics
-        financial_summary = {
-            'total_revenue': total_revenue,
-            'total_collected': total_collected,
-            'total_pending': total_pending,
-            'total_doctor_commissions': total_doctor_commissions,
-            'net_revenue': net_revenue,
-            'net_collected': net_collected,
-            'collection_percentage': (total_collected / total_revenue * 100) if total_revenue > 0 else 0,
-            'total_patients': len(patients),
-            'patients_with_pending': len([p for p in patient_financial_data if p['pending_amount'] > 0])
-        }
+        patient_financial_data = overview.patient_financial_data
+        doctor_commission_summary = overview.doctor_commission_summary
+        financial_summary = overview.summary_stats
 
         return render_template('payment_overview.html',
                              patient_bills=patient_bills,
@@ -849,15 +795,33 @@ def payment_overview():
 @app.route('/payments')
 def payments():
     from sqlalchemy.orm import joinedload
-    payments = Payment.query.options(
-        joinedload(Payment.patient)
-    ).order_by(Payment.payment_date.desc()).all()
-    return render_template('payments.html', payments=payments)
+    from sqlalchemy import func
+    page = paginate_request(
+        Payment.query.options(joinedload(Payment.patient)),
+        Payment.payment_date, Payment.id
+    )
+
+    # Statistics cover all payments, not just the current page
+    by_method = db.session.query(
+        Payment.payment_method, func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0.0)
+    ).group_by(Payment.payment_method).all()
+    by_type = db.session.query(
+        Payment.payment_type, func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0.0)
+    ).group_by(Payment.payment_type).all()
+
+    payment_stats = {
+        'count': sum(count for _, count, _ in by_method),
+        'total': sum(amount for _, _, amount in by_method),
+        'advance_count': sum(count for payment_type, count, _ in by_type if payment_type == 'advance'),
+        'cash_total': sum(amount for method, _, amount in by_method if method == 'cash'),
+        'by_method': by_method,
+        'by_type': by_type
+    }
+    return render_template('payments.html', payments=page.items, page=page, payment_stats=payment_stats)
 
 @app.route('/add_payment', methods=['GET', 'POST'])
 def add_payment():
     form = PaymentForm()
-    form.patient_id.choices = [(p.id, p.full_name) for p in Patient.query.all()]
 
     # Pre-fill form from URL parameters
     if request.method == 'GET':
@@ -887,30 +851,7 @@ def add_payment():
             db.session.add(payment)
 
             # Update or create patient bill
-            patient_bill = PatientBill.query.filter_by(patient_id=form.patient_id.data).first()
-            if not patient_bill:
-                # Calculate total from assigned tests
-                patient_tests = PatientTest.query.filter_by(patient_id=form.patient_id.data).all()
-                total_amount = sum([pt.test.cost for pt in patient_tests])
-
-                patient_bill = PatientBill(
-                    patient_id=form.patient_id.data,
-                    total_amount=total_amount,
-                    paid_amount=form.amount.data,
-                    remaining_amount=max(0, total_amount - form.amount.data)
-                )
-                db.session.add(patient_bill)
-            else:
-                patient_bill.paid_amount += form.amount.data
-                patient_bill.remaining_amount = max(0, patient_bill.final_amount - patient_bill.paid_amount)
-
-            # Update bill status
-            if patient_bill.paid_amount >= patient_bill.final_amount:
-                patient_bill.bill_status = 'paid'
-            elif patient_bill.paid_amount > 0:
-                patient_bill.bill_status = 'partial'
-            else:
-                patient_bill.bill_status = 'pending'
+            billing.record_payment(form.patient_id.data, form.amount.data)
 
             db.session.commit()
             flash(f'Payment of ₹{form.amount.data:.2f} recorded successfully!', 'success')
@@ -952,21 +893,8 @@ def get_patient_bill(patient_id):
 def patient_billing(patient_id):
     patient = Patient.query.get_or_404(patient_id)
 
-    # Get or create patient bill
-    patient_bill = PatientBill.query.filter_by(patient_id=patient_id).first()
-    if not patient_bill:
-        # Calculate total from assigned tests
-        patient_tests = PatientTest.query.filter_by(patient_id=patient_id).all()
-        total_amount = sum([pt.test.cost for pt in patient_tests])
-
-        patient_bill = PatientBill(
-            patient_id=patient_id,
-            total_amount=total_amount,
-            paid_amount=0,
-            remaining_amount=total_amount
-        )
-        db.session.add(patient_bill)
-        db.session.commit()
+    # Get patient bill (read only - totals are kept up to date when tests change)
+    patient_bill = billing.bill_for_display(patient_id)
 
     # Get payment history
     payments = Payment.query.filter_by(patient_id=patient_id).order_by(Payment.payment_date.desc()).all()
@@ -985,28 +913,14 @@ def patient_billing(patient_id):
 
 @app.route('/update_bill/<int:patient_id>', methods=['POST'])
 def update_bill(patient_id):
-    patient_bill = PatientBill.query.filter_by(patient_id=patient_id).first_or_404()
+    PatientBill.query.filter_by(patient_id=patient_id).first_or_404()
 
     try:
         discount_percentage = float(request.form.get('discount_percentage', 0))
         discount_amount = float(request.form.get('discount_amount', 0))
 
-        # Apply discount
-        if discount_percentage > 0:
-            patient_bill.discount_percentage = discount_percentage
-            patient_bill.discount_amount = (patient_bill.total_amount * discount_percentage) / 100
-        else:
-            patient_bill.discount_amount = discount_amount
-            patient_bill.discount_percentage = (discount_amount / patient_bill.total_amount) * 100 if patient_bill.total_amount > 0 else 0
-
-        # Recalculate remaining amount
-        patient_bill.remaining_amount = max(0, patient_bill.final_amount - patient_bill.paid_amount)
-
-        # Update status
-        if patient_bill.paid_amount >= patient_bill.final_amount:
-            patient_bill.bill_status = 'paid'
-        elif patient_bill.paid_amount > 0:
-            patient_bill.bill_status = 'partial'
+        # Apply discount and recalculate the remaining amount
+        billing.apply_discount(patient_id, discount_percentage, discount_amount)
 
         db.session.commit()
         flash('Bill updated successfully!', 'success')
@@ -1057,15 +971,12 @@ def collect_final_payment(test_id):
         db.session.add(payment)
 
         # Update patient bill
-        patient_bill.paid_amount += payment_amount
-        patient_bill.remaining_amount = max(0, patient_bill.final_amount - patient_bill.paid_amount)
+        patient_bill = billing.record_payment(patient_id, payment_amount)
 
         # Update bill status
         if patient_bill.remaining_amount <= 0:
-            patient_bill.bill_status = 'paid'
             flash(f'Final payment of ${payment_amount:.2f} collected successfully! Test report is now ready for printing.', 'success')
         else:
-            patient_bill.bill_status = 'partial'
             flash(f'Payment of ${payment_amount:.2f} collected successfully! Remaining balance: ${patient_bill.remaining_amount:.2f}', 'success')
 
         db.session.commit()
@@ -1078,6 +989,7 @@ def collect_final_payment(test_id):
     return redirect(url_for('edit_patient_test', id=test_id))
 
 @app.route('/print_test_report/<int:test_id>')
+@use_replica
 def print_test_report(test_id):
     """Print individual test report for a completed and paid test"""
     patient_test = PatientTest.query.get_or_404(test_id)
@@ -1114,6 +1026,7 @@ def print_test_report(test_id):
                          current_time=datetime.now())
 
 @app.route('/print_simple_test_report/<int:test_id>')
+@use_replica
 def print_simple_test_report(test_id):
     """Print simplified test report with only essential information"""
     patient_test = PatientTest.query.get_or_404(test_id)
@@ -1140,6 +1053,7 @@ def print_simple_test_report(test_id):
                          current_time=datetime.now())
 
 @app.route('/print_bill/<int:patient_id>')
+@use_replica
 def print_bill(patient_id):
     """Print bill receipt for a patient"""
     patient = Patient.query.get_or_404(patient_id)
@@ -1163,6 +1077,7 @@ def print_bill(patient_id):
                          payments=payments)
 
 @app.route('/print_patient_report/<int:patient_id>')
+@use_replica
 def print_patient_report(patient_id):
     """Print report for tests that have results/values"""
     patient = Patient.query.get_or_404(patient_id)
@@ -1219,15 +1134,16 @@ def bulk_update_tests():
         date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
         query = query.filter(PatientTest.date_ordered <= date_to_obj)
 
-    patient_tests = query.order_by(PatientTest.date_ordered.desc()).all()
+    page = paginate_request(query, PatientTest.date_ordered, PatientTest.id)
 
-    # Get all patients and collectors for dropdowns
-    patients = Patient.query.all()
-    collectors = SampleCollector.query.all()
+    # The filtered patient (others come from the patient picker) and collectors for dropdowns
+    filter_patient = db.session.get(Patient, int(patient_filter)) if patient_filter else None
+    collectors = reference_data.sample_collectors()
 
     return render_template('bulk_update_tests.html',
-                         patient_tests=patient_tests,
-                         patients=patients,
+                         patient_tests=page.items,
+                         page=page,
+                         filter_patient=filter_patient,
                          collectors=collectors,
                          status_filter=status_filter,
                          patient_filter=patient_filter,
@@ -1253,42 +1169,43 @@ def process_bulk_update():
         results = request.form.getlist('results[]')
         notes = request.form.getlist('notes[]')
 
-        updated_count = 0
+        # Load every selected test in one query
+        current = result_entry.load_for_update(int(test_id) for test_id in selected_tests)
+        now = datetime.now()
+        changes = []
 
-        # Update each selected test
         for i, test_id in enumerate(selected_tests):
-            patient_test = PatientTest.query.get(int(test_id))
-            if patient_test:
-                # Update status (bulk or individual)
-                if bulk_status:
-                    old_status = patient_test.status
-                    patient_test.status = bulk_status
-                    if old_status != 'Completed' and bulk_status == 'Completed':
-                        patient_test.date_completed = datetime.now()
-                elif i < len(statuses) and statuses[i]:
-                    old_status = patient_test.status
-                    patient_test.status = statuses[i]
-                    if old_status != 'Completed' and statuses[i] == 'Completed':
-                        patient_test.date_completed = datetime.now()
-
-                # Update sample collector
-                if bulk_sample_collector:
-                    patient_test.sample_collector = bulk_sample_collector
-
-                # Update results
-                if i < len(results) and results[i]:
-                    patient_test.results = results[i]
-
-                # Update notes (append bulk notes if provided)
-                if i < len(notes) and notes[i]:
-                    patient_test.notes = notes[i]
-                if bulk_notes:
-                    if patient_test.notes:
-                        patient_test.notes += f"\n{bulk_notes}"
-                    else:
-                        patient_test.notes = bulk_notes
-
-                updated_count += 1
+            patient_test = current.get(int(test_id))
+            if not patient_test:
+                continue
+            change = {'id': patient_test.id}
+
+            # Update status (bulk or individual)
+            new_status = bulk_status or (statuses[i] if i < len(statuses) and statuses[i] else None)
+            if new_status:
+                change['status'] = new_status
+                if patient_test.status != 'Completed' and new_status == 'Completed':
+                    change['date_completed'] = now
+
+            # Update sample collector
+            if bulk_sample_collector:
+                change['sample_collector'] = bulk_sample_collector
+
+            # Update results
+            if i < len(results) and results[i]:
+                change['results'] = results[i]
+
+            # Update notes (append bulk notes if provided)
+            test_notes = notes[i] if i < len(notes) and notes[i] else patient_test.notes
+            if bulk_notes:
+                test_notes = f"{test_notes}\n{bulk_notes}" if test_notes else bulk_notes
+            if test_notes != patient_test.notes:
+                change['notes'] = test_notes
+
+            changes.append(change)
+
+        result_entry.apply_changes(current, changes)
+        updated_count = len(changes)
 
         db.session.commit()
         flash(f'Successfully updated {updated_count} test orders!', 'success')
@@ -1363,11 +1280,9 @@ def register_patient_step3():
         return redirect(url_for('register_patient_step1'))
 
     form = PatientStep3Form()
-    # Populate dropdowns
-    hospitals = Hospital.query.all()
-    form.hospital_name.choices = [('', 'Select Hospital')] + [(h.name, h.name) for h in hospitals]
-    collectors = SampleCollector.query.all()
-    form.collected_by.choices = [('', 'Select Collector')] + [(c.name, c.name) for c in collectors]
+    # Populate dropdowns (cached)
+    form.hospital_name.choices = reference_data.hospital_choices()
+    form.collected_by.choices = reference_data.collector_choices()
 
     # Pre-populate form with session data if available
     if request.method == 'GET' and 'patient_step3' in session:
@@ -1429,8 +1344,8 @@ def register_patient_step3():
 # Test Management Routes
 @app.route('/tests')
 def tests():
-    tests = Test.query.all()
-    return render_template('tests.html', tests=tests)
+    page = paginate_request(Test.query, Test.name, Test.id, descending=False)
+    return render_template('tests.html', tests=page.items, page=page)
 
 @app.route('/add_test', methods=['GET', 'POST'])
 def add_test():
@@ -1438,7 +1353,7 @@ def add_test():
     if form.validate_on_submit():
         try:
             # Check for duplicate test name
-            existing_test = Test.query.filter_by(name=form.name.data.strip()).first()
+            existing_test = catalog_cache.get_catalog().find(form.name.data.strip())
             if existing_test:
                 flash('A test with this name already exists.', 'error')
                 return render_template('add_test.html', form=form)
@@ -1503,14 +1418,17 @@ def patient_tests():
         date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
         query = query.filter(PatientTest.date_ordered <= date_to_obj)
 
-    patient_tests = query.order_by(PatientTest.date_ordered.desc()).all()
+    page = paginate_request(query, PatientTest.date_ordered, PatientTest.id)
 
-    # Get all patients for filter dropdown
-    patients = Patient.query.all()
+    # The filtered patient (others come from the patient picker) and recent patients for reports
+    filter_patient = db.session.get(Patient, int(patient_filter)) if patient_filter else None
+    recent_patients = Patient.query.order_by(Patient.date_registered.desc()).limit(5).all()
 
     return render_template('patient_tests.html',
-                         patient_tests=patient_tests,
-                         patients=patients,
+                         patient_tests=page.items,
+                         page=page,
+                         filter_patient=filter_patient,
+                         recent_patients=recent_patients,
                          status_filter=status_filter,
                          patient_filter=patient_filter,
                          date_from=date_from,
@@ -1519,16 +1437,14 @@ def patient_tests():
 @app.route('/assign_test', methods=['GET', 'POST'])
 def assign_test():
     form = PatientTestForm()
-    form.patient_id.choices = [(p.id, p.full_name) for p in Patient.query.all()]
-    form.test_id.choices = [(t.id, t.name) for t in Test.query.all()]
-    # Populate sample collector dropdown
-    collectors = SampleCollector.query.all()
-    form.sample_collector.choices = [('', 'Select Sample Collector')] + [(c.name, c.name) for c in collectors]
+    form.test_id.choices = catalog_cache.get_catalog().choices()
+    # Populate sample collector dropdown (cached)
+    form.sample_collector.choices = reference_data.collector_choices('Select Sample Collector')
 
     if form.validate_on_submit():
         try:
             # Get test cost for billing
-            test = Test.query.get(form.test_id.data)
+            test = catalog_cache.get_catalog().get(form.test_id.data)
             test_cost = test.cost
 
             patient_test = PatientTest(
@@ -1560,22 +1476,8 @@ def assign_test():
                     )
                     db.session.add(payment)
 
-            # Create or update patient bill
-            patient_bill = PatientBill.query.filter_by(patient_id=form.patient_id.data).first()
-            if not patient_bill:
-                patient_bill = PatientBill(
-                    patient_id=form.patient_id.data,
-                    total_amount=test_cost,
-                    paid_amount=advance_amount,
-                    remaining_amount=max(0, test_cost - advance_amount),
-                    bill_status='paid' if advance_amount >= test_cost else 'partial' if advance_amount > 0 else 'pending'
-                )
-                db.session.add(patient_bill)
-            else:
-                patient_bill.total_amount += test_cost
-                patient_bill.paid_amount += advance_amount
-                patient_bill.remaining_amount = max(0, patient_bill.final_amount - patient_bill.paid_amount)
-                patient_bill.bill_status = 'paid' if patient_bill.paid_amount >= patient_bill.final_amount else 'partial' if patient_bill.paid_amount > 0 else 'pending'
+            # Bill total follows the new test; record the advance against it
+            billing.record_payment(form.patient_id.data, advance_amount)
 
             db.session.commit()
 
@@ -1592,18 +1494,16 @@ def assign_test():
             app.logger.error(f'Error assigning test: {str(e)}')
 
     # Get all tests for JavaScript
-    tests = Test.query.all()
+    tests = catalog_cache.get_catalog().tests
     return render_template('assign_test.html', form=form, tests=tests)
 
 @app.route('/edit_patient_test/<int:id>', methods=['GET', 'POST'])
 def edit_patient_test(id):
     patient_test = PatientTest.query.get_or_404(id)
     form = PatientTestForm(obj=patient_test)
-    form.patient_id.choices = [(p.id, p.full_name) for p in Patient.query.all()]
-    form.test_id.choices = [(t.id, t.name) for t in Test.query.all()]
-    # Populate sample collector dropdown
-    collectors = SampleCollector.query.all()
-    form.sample_collector.choices = [('', 'Select Sample Collector')] + [(c.name, c.name) for c in collectors]
+    form.test_id.choices = catalog_cache.get_catalog().choices()
+    # Populate sample collector dropdown (cached)
+    form.sample_collector.choices = reference_data.collector_choices('Select Sample Collector')
 
     # Get patient billing information
     patient_bill = PatientBill.query.filter_by(patient_id=patient_test.patient_id).first()
@@ -1632,10 +1532,8 @@ def edit_patient_test(id):
 @app.route('/assign_multiple_tests', methods=['GET', 'POST'])
 def assign_multiple_tests():
     form = MultipleTestAssignmentForm()
-    form.patient_id.choices = [(p.id, p.full_name) for p in Patient.query.all()]
-    # Populate sample collector dropdown
-    collectors = SampleCollector.query.all()
-    form.sample_collector.choices = [('', 'Select Sample Collector')] + [(c.name, c.name) for c in collectors]
+    # Populate sample collector dropdown (cached)
+    form.sample_collector.choices = reference_data.collector_choices('Select Sample Collector')
 
     # Set default date to today
     if request.method == 'GET':
@@ -1649,21 +1547,15 @@ def assign_multiple_tests():
                 flash('Please select at least one test.', 'error')
                 return redirect(url_for('assign_multiple_tests'))
 
-            # Create test assignments for each selected test and calculate total cost
-            total_cost = 0
-            for test_id in test_ids:
-                test = Test.query.get(int(test_id))
-                total_cost += test.cost
-
-                patient_test = PatientTest(
-                    patient_id=form.patient_id.data,
-                    test_id=int(test_id),
-                    date_ordered=form.date_ordered.data or datetime.utcnow(),
-                    status='Pending',
-                    notes=form.notes.data,
-                    sample_collector=form.sample_collector.data if form.sample_collector.data else None
-                )
-                db.session.add(patient_test)
+            # Create test assignments for all selected tests and calculate total cost
+            order = orders.create_order(
+                form.patient_id.data,
+                test_ids,
+                date_ordered=form.date_ordered.data or datetime.utcnow(),
+                sample_collector=form.sample_collector.data,
+                notes=form.notes.data
+            )
+            total_cost = order.total_cost
 
             # Handle payment collection if requested
             collect_payment = request.form.get('collect_payment')
@@ -1683,22 +1575,8 @@ def assign_multiple_tests():
                     )
                     db.session.add(payment)
 
-            # Create or update patient bill
-            patient_bill = PatientBill.query.filter_by(patient_id=form.patient_id.data).first()
-            if not patient_bill:
-                patient_bill = PatientBill(
-                    patient_id=form.patient_id.data,
-                    total_amount=total_cost,
-                    paid_amount=advance_amount,
-                    remaining_amount=max(0, total_cost - advance_amount),
-                    bill_status='paid' if advance_amount >= total_cost else 'partial' if advance_amount > 0 else 'pending'
-                )
-                db.session.add(patient_bill)
-            else:
-                patient_bill.total_amount += total_cost
-                patient_bill.paid_amount += advance_amount
-                patient_bill.remaining_amount = max(0, patient_bill.final_amount - patient_bill.paid_amount)
-                patient_bill.bill_status = 'paid' if patient_bill.paid_amount >= patient_bill.final_amount else 'partial' if patient_bill.paid_amount > 0 else 'pending'
+            # Bill total follows the new tests; record the advance against it
+            billing.record_payment(form.patient_id.data, advance_amount)
 
             db.session.commit()
 
@@ -1715,7 +1593,7 @@ def assign_multiple_tests():
             app.logger.error(f'Error assigning multiple tests: {str(e)}')
 
     # Get all tests for the grid
-    tests = Test.query.all()
+    tests = catalog_cache.get_catalog().tests
     return render_template('assign_multiple_tests.html', form=form, tests=tests)
 
 @app.route('/assign_tests_integrated', methods=['GET', 'POST'])
@@ -1742,38 +1620,17 @@ def assign_tests_integrated():
                 flash('Please select a patient and at least one test.', 'error')
                 return redirect(url_for('assign_tests_integrated'))
 
-            # Calculate total cost
-            total_cost = 0
-            for test_id in test_ids:
-                test = Test.query.get(test_id)
-                if test:
-                    total_cost += test.cost
-
-            # Create patient tests
-            for test_id in test_ids:
-                patient_test = PatientTest(
-                    patient_id=int(patient_id),
-                    test_id=int(test_id),
-                    date_ordered=datetime.strptime(date_ordered, '%Y-%m-%d').date() if date_ordered else datetime.utcnow().date(),
-                    status='Pending',
-                    sample_collector=sample_collector if sample_collector else None
-                )
-                db.session.add(patient_test)
+            # Create patient tests and calculate total cost
+            order = orders.create_order(
+                int(patient_id),
+                test_ids,
+                date_ordered=datetime.strptime(date_ordered, '%Y-%m-%d') if date_ordered else datetime.utcnow(),
+                sample_collector=sample_collector
+            )
+            total_cost = order.total_cost
 
-            # Create or update patient bill
-            patient_bill = PatientBill.query.filter_by(patient_id=patient_id).first()
-            if not patient_bill:
-                patient_bill = PatientBill(
-                    patient_id=int(patient_id),
-                    total_amount=total_cost,
-                    paid_amount=0,
-                    remaining_amount=total_cost,
-                    bill_status='pending'
-                )
-                db.session.add(patient_bill)
-            else:
-                patient_bill.total_amount += total_cost
-                patient_bill.remaining_amount += total_cost
+            # Bill total was repriced with the order
+            patient_bill = billing.get_or_create_bill(int(patient_id))
 
             # Handle payment if collected
             if collect_payment and advance_amount > 0:
@@ -1789,13 +1646,7 @@ def assign_tests_integrated():
                 db.session.add(payment)
 
                 # Update patient bill
-                patient_bill.paid_amount += advance_amount
-                patient_bill.remaining_amount = max(0, patient_bill.total_amount - patient_bill.paid_amount)
-
-                if patient_bill.remaining_amount <= 0:
-                    patient_bill.bill_status = 'paid'
-                else:
-                    patient_bill.bill_status = 'partial'
+                patient_bill = billing.record_payment(int(patient_id), advance_amount)
 
             db.session.commit()
 
@@ -1812,19 +1663,17 @@ def assign_tests_integrated():
             flash('An error occurred while assigning tests. Please try again.', 'error')
             app.logger.error(f'Error in assign_tests_integrated: {str(e)}')
 
-    # Get all tests and patients for the form
-    tests = Test.query.all()
-    patients = Patient.query.all()
-
-    # Populate patient choices
-    form.patient_id.choices = [(0, 'Select Patient')] + [(p.id, f"{p.full_name} (ID: {p.id})") for p in patients]
+    # Get all tests for the form; patients come from the patient picker
+    tests = catalog_cache.get_catalog().tests
 
     return render_template('assign_tests_integrated.html', form=form, tests=tests)
 
 # API route to get test details
 @app.route('/api/test/<int:test_id>')
 def get_test_details(test_id):
-    test = Test.query.get_or_404(test_id)
+    test = catalog_cache.get_catalog().get(test_id)
+    if test is None:
+        abort(404)
     return jsonify({
         'id': test.id,
         'name': test.name,
@@ -1836,6 +1685,7 @@ def get_test_details(test_id):
 
 # Report Generation Routes
 @app.route('/reports/patient_tests')
+@use_replica
 def patient_tests_report():
     # Get same filters as main view
     status_filter = request.args.get('status', '')
@@ -1886,6 +1736,7 @@ def patient_tests_report():
                          current_time=datetime.now())
 
 @app.route('/reports/patient/<int:patient_id>')
+@use_replica
 def patient_report(patient_id):
     """Print clean pathology report for tests with results"""
     from sqlalchemy.orm import joinedload
@@ -1983,35 +1834,45 @@ def add_sample_collector():
 def doctors():
     doctors = Doctor.query.all()
 
-    # Calculate commission amounts for each doctor
+    # Pre-summed commissions from the ledger plus referral counts in one grouped query
+    from sqlalchemy import func
+    ledger_totals = commission_ledger.doctor_totals()
+    referral_counts = dict(
+        db.session.query(Patient.referring_doctor_id, func.count(Patient.id))
+        .filter(Patient.referring_doctor_id.isnot(None))
+        .group_by(Patient.referring_doctor_id)
+    )
+
     doctor_commissions = {}
     for doctor in doctors:
-        # Get all patients referred by this doctor
-        referred_patients = Patient.query.filter_by(referring_doctor_id=doctor.id).all()
-
-        total_commission = 0.0
-        total_patients = len(referred_patients)
-        total_tests = 0
-
-        for patient in referred_patients:
-            # Get all tests for this patient
-            patient_tests = PatientTest.query.filter_by(patient_id=patient.id).all()
-            total_tests += len(patient_tests)
-
-            for patient_test in patient_tests:
-                # Calculate commission for each test
-                test_amount = patient_test.test.cost
-                commission = doctor.calculate_commission(test_amount)
-                total_commission += commission
-
+        totals = ledger_totals.get(doctor.id, {'pending': 0.0, 'paid': 0.0, 'tests': 0})
         doctor_commissions[doctor.id] = {
-            'total_commission': total_commission,
-            'total_patients': total_patients,
-            'total_tests': total_tests
+            'total_commission': totals['pending'] + totals['paid'],
+            'pending_commission': totals['pending'],
+            'paid_commission': totals['paid'],
+            'total_patients': referral_counts.get(doctor.id, 0),
+            'total_tests': totals['tests']
         }
 
     return render_template('doctors.html', doctors=doctors, doctor_commissions=doctor_commissions)
 
+@app.route('/pay_doctor_commission/<int:id>', methods=['POST'])
+def pay_doctor_commission(id):
+    """Settle all pending commissions for a doctor"""
+    doctor = Doctor.query.get_or_404(id)
+    try:
+        amount = commission_ledger.mark_paid(doctor.id, notes=request.form.get('payment_notes') or None)
+        db.session.commit()
+        if amount > 0:
+            flash(f'Marked ₹{amount:.2f} commission as paid for {doctor.name}.', 'success')
+        else:
+            flash(f'No pending commission for {doctor.name}.', 'info')
+    except Exception as e:
+        db.session.rollback()
+        flash('An error occurred while recording the commission payment. Please try again.', 'error')
+        app.logger.error(f'Error paying doctor commission: {str(e)}')
+    return redirect(url_for('doctors'))
+
 @app.route('/add_doctor', methods=['GET', 'POST'])
 def add_doctor():
     form = DoctorForm()
@@ -2065,92 +1926,23 @@ def edit_doctor(id):
 # Financial Overview Route
 @app.route('/financial_overview')
 @login_required
+@use_replica
 def financial_overview():
     """Comprehensive payment overview with financial data and doctor commissions"""
-    try:
-        # Get all patients with their bills and payments
-        patients = Patient.query.all()
-
-        # Calculate total amounts
-        total_revenue = 0
-        total_collected = 0
-        total_pending = 0
-        total_doctor_commissions = 0
-
-        # Doctor commission summary
-        doctor_commission_summary = {}
-
-        # Process each patient
-        patient_financial_data = []
-        for patient in patients:
-            patient_tests = PatientTest.query.filter_by(patient_id=patient.id).all()
-            patient_bill = PatientBill.query.filter_by(patient_id=patient.id).first()
-
-            # Calculate patient totals
-            patient_total = sum(pt.test.cost for pt in patient_tests)
-            patient_paid = patient_bill.paid_amount if patient_bill else 0
-            patient_pending = patient_total - patient_paid
-
-            # Calculate doctor commissions for this patient
-            patient_doctor_commission = 0
-            if patient.referring_doctor_id:
-                doctor = Doctor.query.get(patient.referring_doctor_id)
-                if doctor and doctor.is_active:
-                    # Add to doctor summary (initialize if needed)
-                    if doctor.name not in doctor_commission_summary:
-                        doctor_commission_summary[doctor.name] = {
-                            'doctor': doctor,
-                            'total_commission': 0,
-                            'pending_commission': 0,
-                            'paid_commission': 0,
-                            'patient_count': 0
-                        }
-
-                    # Increment patient count once per patient
-                    doctor_commission_summary[doctor.name]['patient_count'] += 1
-
-                    # Calculate commission for each test
-                    for pt in patient_tests:
-                        commission = doctor.calculate_commission(pt.test.cost)
-                        patient_doctor_commission += commission
-                        doctor_commission_summary[doctor.name]['total_commission'] += commission
-                        doctor_commission_summary[doctor.name]['pending_commission'] += commission  # All pending for now
-
-            patient_financial_data.append({
-                'patient': patient,
-                'total_amount': patient_total,
-                'paid_amount': patient_paid,
-                'pending_amount': patient_pending,
-                'doctor_commission': patient_doctor_commission,
-                'test_count': len(patient_tests),
-                'bill': patient_bill
-            })
-
-            # Add to totals
-            total_revenue += patient_total
-            total_collected += patient_paid
-            total_pending += patient_pending
-            total_doctor_commissions += patient_doctor_commission
+    from sqlalchemy.orm import joinedload
 
-        # Calculate net revenue (after doctor commissions)
-        net_revenue = total_revenue - total_doctor_commissions
-        net_collected = total_collected - total_doctor_commissions  # Assuming commissions paid when collected
+    try:
+        # Shared set-based aggregation (per-patient totals, doctor commissions)
+        overview = build_financial_overview()
 
         # Recent payments
-        recent_payments = Payment.query.order_by(Payment.payment_date.desc()).limit(10).all()
-
-        # Summary statistics
-        summary_stats = {
-            'total_revenue': total_revenue,
-            'total_collected': total_collected,
-            'total_pending': total_pending,
-            'total_doctor_commissions': total_doctor_commissions,
-            'net_revenue': net_revenue,
-            'net_collected': net_collected,
-            'collection_percentage': (total_collected / total_revenue * 100) if total_revenue > 0 else 0,
-            'total_patients': len(patients),
-            'patients_with_pending': len([p for p in patient_financial_data if p['pending_amount'] > 0])
-        }
+        recent_payments = Payment.query.options(
+            joinedload(Payment.patient)
+        ).order_by(Payment.payment_date.desc()).limit(10).all()
+
+        patient_financial_data = overview.patient_financial_data
+        doctor_commission_summary = overview.doctor_commission_summary
+        summary_stats = overview.summary_stats
 
         return render_template('financial_overview.html',
                              patient_financial_data=patient_financial_data,
@@ -2208,67 +2000,92 @@ class DatabaseViewer:
 
     def __init__(self):
         self.db_path = database_path
+        self.dialect = 'sqlite' if sqlite_database else 'postgresql'
 
     def get_connection(self):
-        """Get database connection"""
-        if os.path.exists(self.db_path):
-            conn = sqlite3.connect(self.db_path, timeout=30.0)
-            conn.execute('PRAGMA journal_mode=WAL;')
-            return conn
-        return None
-
-    def get_database_info(self):
-        """Get database information"""
-        try:
-            print(f"🔍 DatabaseViewer: Checking database at {self.db_path}")
+        """Get a pooled database connection (close() releases it)
 
-            if not os.path.exists(self.db_path):
-                print(f"❌ Database file not found: {self.db_path}")
-                return {"error": f"Database file not found: {self.db_path}"}
+        The read replica's when the request may read from it.
+        """
+        replica = read_replica.router.read_engine()
+        if replica is not None:
+            return replica.raw_connection()
+        return self.primary_connection()
+
+    def primary_connection(self):
+        """Get a pooled connection to the primary database"""
+        if self.dialect == 'sqlite':
+            return db_connections.connect(self.db_path)
+        # Also called from the statistics refresh thread, outside any request
+        with app.app_context():
+            return db.engine.raw_connection()
+
+    def table_stats(self):
+        """Cached row counts for this database (always counted on the primary)"""
+        if self.dialect == 'sqlite':
+            return table_stats.for_database(self.primary_connection, self.db_path)
+        return table_stats.for_database(self.primary_connection, dialect=self.dialect)
+
+    def _database_file_info(self):
+        """(name, full path, size in bytes, last modified) of the database, or an error dict"""
+        if self.dialect == 'postgresql':
+            conn = self.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT current_database(), pg_database_size(current_database());")
+                name, size = cursor.fetchone()
+            finally:
+                conn.close()
+            # The server does not track a last write time per database
+            return name, name, size, None
 
-            print(f"✅ Database file exists: {self.db_path}")
+        print(f"🔍 DatabaseViewer: Checking database at {self.db_path}")
 
-            conn = self.get_connection()
-            if not conn:
-                print(f"❌ Database connection failed")
-                return {"error": "Database connection failed"}
+        if not os.path.exists(self.db_path):
+            print(f"❌ Database file not found: {self.db_path}")
+            return {"error": f"Database file not found: {self.db_path}"}
 
-            print(f"✅ Database connection successful")
-            cursor = conn.cursor()
+        print(f"✅ Database file exists: {self.db_path}")
 
-            # Get file info
-            file_size = os.path.getsize(self.db_path)
-            file_time = datetime.fromtimestamp(os.path.getmtime(self.db_path))
+        conn = self.get_connection()
+        if not conn:
+            print(f"❌ Database connection failed")
+            return {"error": "Database connection failed"}
 
-            print(f"📊 Database size: {file_size} bytes")
+        print(f"✅ Database connection successful")
+        conn.close()
 
-            # Get tables
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name;")
-            tables = cursor.fetchall()
+        # Get file info
+        file_time = datetime.fromtimestamp(os.path.getmtime(self.db_path))
+        return os.path.basename(self.db_path), self.db_path, os.path.getsize(self.db_path), file_time
 
-            print(f"📋 Found {len(tables)} tables: {[t[0] for t in tables]}")
+    def get_database_info(self):
+        """Get database information"""
+        try:
+            file_info = self._database_file_info()
+            if isinstance(file_info, dict):
+                return file_info
+            name, full_path, file_size, file_time = file_info
 
-            table_info = {}
-            for table in tables:
-                table_name = table[0]
-                try:
-                    cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-                    count = cursor.fetchone()[0]
-                    table_info[table_name] = count
-                    print(f"📊 Table {table_name}: {count} records")
-                except Exception as e:
-                    table_info[table_name] = f"Error: {str(e)}"
-                    print(f"❌ Error counting {table_name}: {str(e)}")
+            print(f"📊 Database size: {file_size} bytes")
 
-            conn.close()
+            # Row counts come from the statistics cache (exact for small tables,
+            # estimated for large ones, refreshed in the background after writes)
+            stats = self.table_stats().snapshot()
+            table_info = {name: entry['count'] for name, entry in stats['tables'].items()}
+            print(f"📋 Found {len(table_info)} tables: {list(table_info)}")
 
             result = {
-                "path": os.path.basename(self.db_path),
-                "full_path": self.db_path,
+                "path": name,
+                "full_path": full_path,
+                "dialect": self.dialect,
                 "size_mb": round(file_size / (1024 * 1024), 2),
-                "last_modified": file_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "last_modified": file_time.strftime('%Y-%m-%d %H:%M:%S') if file_time else None,
                 "tables": table_info,
-                "total_tables": len(tables),
+                "estimated_tables": [name for name, entry in stats['tables'].items() if not entry['exact']],
+                "counts_as_of": table_stats.format_timestamp(stats['as_of']),
+                "stale_since": table_stats.format_timestamp(stats['stale_since']),
+                "total_tables": len(table_info),
                 "server_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
 
@@ -2280,56 +2097,81 @@ class DatabaseViewer:
             print(f"❌ {error_msg}")
             return {"error": error_msg}
 
-    def get_table_data(self, table_name, limit=100, offset=0):
-        """Get data from specific table"""
+    def get_table_data(self, table_name, limit=100, after=None, before=None, last=False):
+        """Get one page of a table in primary key order
+
+        Pages are addressed by cursors (the key of the row a page continues
+        from, with its type - text keys compare as text), so a deep page
+        costs the same index seek as the first one.
+        Values are returned column by column with their stored types.
+        """
         try:
             conn = self.get_connection()
             if not conn:
                 return {"error": "Database connection failed"}
 
-            cursor = conn.cursor()
-
-            # Validate table name (security)
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (table_name,))
-            if not cursor.fetchone():
-                return {"error": "Table not found"}
-
-            # Get column info
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns_info = cursor.fetchall()
-            columns = [col[1] for col in columns_info]
-
-            # Get total count
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-            total_count = cursor.fetchone()[0]
-
-            # Get data with pagination
-            cursor.execute(f"SELECT * FROM {table_name} LIMIT ? OFFSET ?;", (limit, offset))
-            rows = cursor.fetchall()
-
-            # Format data
-            formatted_rows = []
-            for row in rows:
-                formatted_row = {}
-                for i, col in enumerate(columns):
-                    value = row[i]
-                    if value is None:
-                        formatted_row[col] = ""
-                    else:
-                        formatted_row[col] = str(value)
-                formatted_rows.append(formatted_row)
-
-            conn.close()
+            try:
+                # Validates the table name (security)
+                schema = table_export.table_schema(conn, table_name)
+                columns = [name for name, kind in schema]
+                key = db_connections.row_key(conn, table_name)
+
+                after_key = decode_key_cursor(after)
+                before_key = decode_key_cursor(before)
+                backwards = before_key is not None or last
+
+                column_list = ', '.join(f'"{name}"' for name in columns)
+                query = f"SELECT {key}, {column_list} FROM {table_name}"
+                params = []
+                if before_key is not None:
+                    query += f" WHERE {key} < ?"
+                    params.append(before_key)
+                elif after_key is not None:
+                    query += f" WHERE {key} > ?"
+                    params.append(after_key)
+                query += f" ORDER BY {key} {'DESC' if backwards else 'ASC'} LIMIT ?;"
+                params.append(limit + 1)
+
+                cursor = conn.cursor()
+                cursor.execute(db_connections.sql(conn, query), params)
+                rows = cursor.fetchall()
+            finally:
+                conn.close()
+
+            more = len(rows) > limit
+            rows = rows[:limit]
+            if backwards:
+                rows.reverse()
+                has_prev, has_next = more, before_key is not None
+            else:
+                has_prev, has_next = after_key is not None, more
+
+            # Columnar: one array per column instead of a dict per row
+            values = list(zip(*rows)) or [()] * (len(columns) + 1)
+            keys = values[0]
+            data = {}
+            for (name, kind), column_values in zip(schema, values[1:]):
+                if kind == 'bool':
+                    column_values = [None if value is None else bool(value) for value in column_values]
+                elif kind in ('datetime', 'date'):
+                    # PostgreSQL returns date objects - send the same ISO text SQLite stores
+                    column_values = [None if value is None else str(value) for value in column_values]
+                data[name] = list(column_values)
+
+            # Total from the statistics cache rather than a COUNT(*) per page
+            total_count, count_exact = self.table_stats().count(table_name)
 
             return {
                 "table_name": table_name,
                 "columns": columns,
-                "data": formatted_rows,
+                "types": [kind for name, kind in schema],
+                "data": data,
+                "row_count": len(rows),
                 "total_count": total_count,
-                "current_page": (offset // limit) + 1,
-                "total_pages": (total_count + limit - 1) // limit,
+                "count_exact": count_exact,
                 "limit": limit,
-                "offset": offset
+                "next_cursor": encode_key_cursor(keys[-1]) if rows and has_next else None,
+                "prev_cursor": encode_key_cursor(keys[0]) if rows and has_prev else None
             }
         except Exception as e:
             return {"error": str(e)}
@@ -2344,42 +2186,20 @@ class DatabaseViewer:
             cursor = conn.cursor()
             stats = {}
 
-            # Safe queries with error handling
-            try:
-                cursor.execute("SELECT COUNT(*) FROM patient;")
-                stats['total_patients'] = cursor.fetchone()[0]
-            except:
-                stats['total_patients'] = 0
-
-            try:
-                cursor.execute("SELECT COUNT(*) FROM patient WHERE date_registered >= date('now', '-7 days');")
-                stats['new_patients_week'] = cursor.fetchone()[0]
-            except:
-                stats['new_patients_week'] = 0
-
-            try:
-                cursor.execute("SELECT COUNT(*) FROM patient_test;")
-                stats['total_tests'] = cursor.fetchone()[0]
-            except:
-                stats['total_tests'] = 0
-
-            try:
-                cursor.execute("SELECT COUNT(*) FROM patient_test WHERE status = 'Pending';")
-                stats['pending_tests'] = cursor.fetchone()[0]
-            except:
-                stats['pending_tests'] = 0
-
-            try:
-                cursor.execute("SELECT COALESCE(SUM(amount), 0) FROM payment;")
-                stats['total_revenue'] = cursor.fetchone()[0]
-            except:
-                stats['total_revenue'] = 0
-
+            # Totals come from the dashboard counter cache
             try:
-                cursor.execute("SELECT COALESCE(SUM(remaining_amount), 0) FROM patient_bill WHERE remaining_amount > 0;")
-                stats['pending_payments'] = cursor.fetchone()[0]
-            except:
-                stats['pending_payments'] = 0
+                counters = dashboard_counters.get_counters()
+                stats['total_patients'] = counters['total_patients']
+                stats['new_patients_week'] = counters['new_patients_week']
+                stats['total_tests'] = counters['total_patient_tests']
+                stats['pending_tests'] = counters['pending_tests']
+                stats['total_revenue'] = counters['total_revenue']
+                stats['pending_payments'] = counters['pending_payments']
+            except Exception as e:
+                app.logger.error(f"Error loading dashboard counters: {e}")
+                for key in ('total_patients', 'new_patients_week', 'total_tests',
+                            'pending_tests', 'total_revenue', 'pending_payments'):
+                    stats[key] = 0
 
             # Recent activity
             try:
@@ -2394,7 +2214,7 @@ class DatabaseViewer:
                     recent_activity.append({
                         "activity": row[0],
                         "details": row[1],
-                        "timestamp": row[2]
+                        "timestamp": None if row[2] is None else str(row[2])
                     })
                 stats['recent_activity'] = recent_activity
             except:
@@ -2411,17 +2231,37 @@ class DatabaseViewer:
 # Initialize database viewer
 db_viewer = DatabaseViewer()
 
+@app.route('/admin/database-settings', methods=['GET', 'POST'])
+@login_required
+def database_settings():
+    """Active database engine settings; POST action=optimize|analyze refreshes planner statistics"""
+    try:
+        if request.method == 'POST':
+            action = request.form.get('action') or (request.get_json(silent=True) or {}).get('action')
+            if action not in ('optimize', 'analyze'):
+                return jsonify({"error": "action must be optimize or analyze"}), 400
+            if db.engine.dialect.name == 'sqlite':
+                db_connections.optimize(db.engine, full=action == 'analyze')
+        settings = db_connections.engine_settings(db.engine)
+        settings['replica'] = read_replica.router.status()
+        return jsonify(settings)
+    except Exception as e:
+        app.logger.error(f"Error reading database settings: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/db-viewer/')
 def database_viewer():
     """Database viewer main page"""
     return render_template('database_viewer.html')
 
 @app.route('/db-viewer/api/database-info')
+@use_replica
 def api_database_info():
     """API endpoint for database information"""
     try:
-        print(f"🔍 Database info request - Database path: {database_path}")
-        print(f"📊 Database exists: {os.path.exists(database_path)}")
+        if sqlite_database:
+            print(f"🔍 Database info request - Database path: {database_path}")
+            print(f"📊 Database exists: {os.path.exists(database_path)}")
 
         result = db_viewer.get_database_info()
         print(f"✅ Database info result: {result}")
@@ -2431,139 +2271,110 @@ def api_database_info():
         return jsonify({"error": f"Database info failed: {str(e)}"})
 
 @app.route('/db-viewer/api/table-data/<table_name>')
+@use_replica
 def api_table_data(table_name):
-    """API endpoint for table data"""
-    limit = min(int(request.args.get('limit', 100)), 1000)  # Max 1000 records
-    offset = int(request.args.get('offset', 0))
-    return jsonify(db_viewer.get_table_data(table_name, limit, offset))
+    """API endpoint for table data
+
+    Page with the cursors of the previous response: after=<next_cursor>,
+    before=<prev_cursor>, or last=1 for the final page.
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))  # Max 1000 records
+    except ValueError:
+        return jsonify({"error": "limit must be a number"})
+    return jsonify(db_viewer.get_table_data(
+        table_name, limit,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        last=request.args.get('last') in ('1', 'true')
+    ))
 
 @app.route('/db-viewer/api/real-time-stats')
+@use_replica
 def api_real_time_stats():
     """API endpoint for real-time database statistics"""
     return jsonify(db_viewer.get_real_time_stats())
 
 @app.route('/db-viewer/api/search/<table_name>')
+@use_replica
 def api_search_table(table_name):
-    """API endpoint for searching table"""
-    search_term = request.args.get('q', '')
-    limit = min(int(request.args.get('limit', 100)), 1000)
+    """API endpoint for searching table
+
+    q=<text> searches the table's text columns through its search index
+    (search_columns=a,b narrows it), <column>=<value> and <column>.<op>=<value>
+    (op: eq, ne, gt, gte, lt, lte, like, null) filter on typed columns, and
+    page / per_page select the page of results.
+    """
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', request.args.get('limit', table_search.DEFAULT_PAGE_SIZE)))
+    except ValueError:
+        return jsonify({"error": "page and per_page must be numbers"})
 
     try:
         conn = db_viewer.get_connection()
         if not conn:
             return jsonify({"error": "Database connection failed"})
 
-        cursor = conn.cursor()
-
-        # Validate table name
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (table_name,))
-        if not cursor.fetchone():
-            return jsonify({"error": "Table not found"})
-
-        # Get column info
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns_info = cursor.fetchall()
-        columns = [col[1] for col in columns_info]
-
-        # Build search query
-        search_conditions = []
-        for col in columns:
-            search_conditions.append(f"{col} LIKE ?")
-
-        search_query = f"SELECT * FROM {table_name} WHERE {' OR '.join(search_conditions)} LIMIT ?;"
-        search_params = [f"%{search_term}%"] * len(columns) + [limit]
-
-        cursor.execute(search_query, search_params)
-        rows = cursor.fetchall()
-
-        # Format data
-        formatted_rows = []
-        for row in rows:
-            formatted_row = {}
-            for i, col in enumerate(columns):
-                value = row[i]
-                if value is None:
-                    formatted_row[col] = ""
-                else:
-                    formatted_row[col] = str(value)
-            formatted_rows.append(formatted_row)
-
-        conn.close()
-
-        return jsonify({
-            "table_name": table_name,
-            "columns": columns,
-            "data": formatted_rows,
-            "search_term": search_term,
-            "result_count": len(formatted_rows)
-        })
+        try:
+            schema = table_export.table_schema(conn, table_name)
+            filters = table_search.parse_filters(request.args.items(multi=True), schema)
+            result = table_search.search_table(
+                conn, table_name,
+                q=request.args.get('q', ''),
+                filters=filters,
+                search_columns=request.args.get('search_columns'),
+                page=page,
+                per_page=per_page
+            )
+        finally:
+            conn.close()
+        return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)})
 
 @app.route('/db-viewer/api/export/<table_name>')
+@use_replica
 def api_export_table(table_name):
-    """API endpoint for exporting table data"""
+    """API endpoint for exporting table data
+
+    Streams the export in chunks. Optional arguments:
+      format=csv|jsonl|parquet|arrow  (parquet/arrow need pyarrow)
+      columns=a,b,c                   export a subset of columns
+      since=<ISO date>                only rows whose date columns changed after it
+      since_column=<name>             key the incremental export on one date column
+      gzip=1                          compressed download
+    The X-Export-Watermark header is the `since` to pass for the next incremental export.
+    """
     try:
+        export_format = request.args.get('format', 'csv').lower()
+        mimetype, extension = table_export.check_format(export_format)
+
         conn = db_viewer.get_connection()
         if not conn:
             return jsonify({"error": "Database connection failed"})
 
-        # Validate table name
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (table_name,))
-        if not cursor.fetchone():
-            return jsonify({"error": "Table not found"})
-
-        if PANDAS_AVAILABLE:
-            # Use pandas for better CSV export
-            df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
-            conn.close()
-
-            # Create CSV with pandas
-            output = io.StringIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-
-            csv_data = io.BytesIO()
-            csv_data.write(output.getvalue().encode('utf-8'))
-            csv_data.seek(0)
-        else:
-            # Fallback: Use basic CSV module
-            # Get column names
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns_info = cursor.fetchall()
-            columns = [col[1] for col in columns_info]
-
-            # Get all data
-            cursor.execute(f"SELECT * FROM {table_name};")
-            rows = cursor.fetchall()
+        # Validate the request before the response starts streaming
+        try:
+            schema = table_export.table_schema(conn, table_name)
+            columns = table_export.select_columns([name for name, kind in schema], request.args.get('columns'))
+            where, params, watermark = table_export.since_filter(
+                conn, table_name, schema, request.args.get('since'), request.args.get('since_column'))
+        finally:
             conn.close()
 
-            # Create CSV manually
-            output = io.StringIO()
-            writer = csv.writer(output)
-
-            # Write header
-            writer.writerow(columns)
-
-            # Write data rows
-            for row in rows:
-                # Convert None to empty string and ensure all values are strings
-                clean_row = [str(value) if value is not None else '' for value in row]
-                writer.writerow(clean_row)
-
-            output.seek(0)
-
-            csv_data = io.BytesIO()
-            csv_data.write(output.getvalue().encode('utf-8'))
-            csv_data.seek(0)
-
-        return send_file(
-            csv_data,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'{table_name}_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        )
+        chunks = table_export.export_chunks(export_format, db_viewer.get_connection,
+                                            table_name, schema, columns, where, params)
+        filename = f'{table_name}_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+        if request.args.get('gzip') in ('1', 'true'):
+            chunks = table_export.gzip_chunks(chunks)
+            filename += '.gz'
+            mimetype = 'application/gzip'
+
+        headers = {'Content-Disposition': f'attachment; filename={filename}'}
+        if watermark:
+            headers['X-Export-Watermark'] = str(watermark)
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
     except Exception as e:
         return jsonify({"error": str(e)})
 
@@ -2601,6 +2412,9 @@ def api_export_table_compat(table_name):
 # MULTI-STEP REGISTRATION ROUTES
 # ================================
 
+# Tests offered as quick-add buttons on the registration page (matched by name in the catalog)
+QUICK_ADD_TESTS = ('Complete Blood Count', 'Blood Sugar', 'Lipid Profile', 'Thyroid', 'Urine', 'X-Ray')
+
 @app.route('/multi-step-registration', methods=['GET', 'POST'])
 def multi_step_registration():
     """Multi-step patient registration with test assignment and billing"""
@@ -2631,9 +2445,22 @@ def multi_step_registration():
                 'other_collector': request.form.get('other_collector')
             }
 
-            # Get test and billing data
+            # Get test and billing data - prices come from the catalog, not the page
             selected_tests = json.loads(request.form.get('selected_tests', '[]'))
-            total_amount = float(request.form.get('total_amount', 0))
+            try:
+                tests = orders.resolve_selection(selected_tests)
+            except orders.OrderError as e:
+                return jsonify({'success': False, 'error': str(e)})
+            if not tests:
+                return jsonify({'success': False, 'error': 'Please select at least one test'})
+
+            subtotal_amount = sum(test.cost or 0 for test in tests)
+            try:
+                discount_value = float(request.form.get('discount_value') or 0)
+            except ValueError:
+                discount_value = 0
+            discount_amount = billing.calculate_discount(subtotal_amount, request.form.get('discount_type'), discount_value)
+            total_amount = subtotal_amount - discount_amount
             payment_option = request.form.get('payment_option')
             payment_method = request.form.get('payment_method')
 
@@ -2684,45 +2511,21 @@ def multi_step_registration():
                 patient_id = new_patient.id
 
                 # 2. Handle tests
-                test_ids = []
-                for test in selected_tests:
-                    # Check if test exists, if not create it
-                    existing_test = Test.query.filter_by(name=test['name']).first()
-
-                    if existing_test:
-                        test_obj = existing_test
-                    else:
-                        # Create new test
-                        test_obj = Test(
-                            name=test['name'],
-                            description=f"Test: {test['name']}",
-                            cost=test['price'],
-                            category='General'
-                        )
-                        db.session.add(test_obj)
-                        db.session.flush()  # Get the test ID
-
-                    # Create patient-test relationship
-                    patient_test = PatientTest(
-                        patient_id=patient_id,
-                        test_id=test_obj.id,
-                        status='Pending',
-                        date_ordered=datetime.now()
-                    )
-                    db.session.add(patient_test)
-                    test_ids.append(test_obj.id)
+                orders.create_order(
+                    patient_id,
+                    [test.id for test in tests],
+                    date_ordered=datetime.now(),
+                    barcode=(patient_data.get('barcode') or '').strip()
+                )
 
                 # 3. Create bill
-                patient_bill = PatientBill(
-                    patient_id=patient_id,
-                    total_amount=total_amount,
-                    paid_amount=amount_paid,
-                    remaining_amount=remaining_amount,
-                    bill_date=datetime.now(),
-                    bill_status='paid' if remaining_amount == 0 else 'partial'
-                )
-                db.session.add(patient_bill)
-                db.session.flush()  # Get the bill ID
+                if discount_amount > 0:
+                    # Kept as entered, so a percentage follows later changes to the tests
+                    if request.form.get('discount_type') == 'percentage':
+                        billing.apply_discount(patient_id, discount_percentage=discount_value)
+                    else:
+                        billing.apply_discount(patient_id, discount_amount=discount_value)
+                patient_bill = billing.record_payment(patient_id, amount_paid)
                 bill_id = patient_bill.id
 
                 # 4. Record payment if amount paid > 0
@@ -2783,8 +2586,58 @@ def multi_step_registration():
 
     # GET request - show the form
     # Get doctors for autocomplete
-    doctors = Doctor.query.filter_by(is_active=True).all()
-    return render_template('multi_step_registration.html', doctors=doctors)
+    doctors = reference_data.active_doctors()
+    # Quick-add buttons for common tests, priced from the catalog
+    catalog = catalog_cache.get_catalog()
+    quick_tests = []
+    for name in QUICK_ADD_TESTS:
+        matches = catalog.search(name, limit=1)
+        if matches and matches[0] not in quick_tests:
+            quick_tests.append(matches[0])
+    return render_template('multi_step_registration.html', doctors=doctors,
+                         categories=catalog.categories(),
+                         quick_tests=[catalog_test_json(test) for test in quick_tests])
+
+@app.route('/api/tests/catalog')
+def api_test_catalog():
+    """Test catalog for the registration page: ?q= name search (prefix, then fuzzy), ?category=
+
+    The ETag is the catalog version, so an unchanged catalog is answered with
+    304 Not Modified and the browser keeps its copy.
+    """
+    catalog = catalog_cache.get_catalog()
+    etag = f'catalog-{catalog.version}'
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        try:
+            limit = int(request.args.get('limit', 20))
+        except ValueError:
+            limit = 20
+        query = request.args.get('q', '')
+        category = request.args.get('category', '')
+        if query or category:
+            tests = catalog.search(query, category, max(1, min(limit, 200)))
+        else:
+            tests = catalog.tests
+        response = jsonify({
+            'version': catalog.version,
+            'categories': catalog.categories(),
+            'tests': [catalog_test_json(test) for test in tests]
+        })
+    response.set_etag(etag)
+    # Revalidate on every use - cheap while the catalog is unchanged
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def catalog_test_json(test):
+    return {
+        'id': test.id,
+        'name': test.name,
+        'price': test.cost,
+        'category': test.category or '',
+        'unit': test.unit or ''
+    }
 
 # ================================
 # TEST RESULTS MANAGEMENT ROUTES
@@ -2792,84 +2645,108 @@ def multi_step_registration():
 
 @app.route('/test-results-management')
 def test_results_management():
-    """Display all assigned tests for updating status and results"""
-    try:
-        # Get all assigned tests with patient information
-        query = """
-        SELECT
-            pt.id as patient_test_id,
-            p.first_name,
-            p.last_name,
-            p.phone,
-            t.name as test_name,
-            t.normal_range_min,
-            t.normal_range_max,
-            t.unit,
-            pt.results,
-            pt.status,
-            pt.date_ordered,
-            pt.date_completed,
-            pt.notes
-        FROM patient_test pt
-        JOIN patient p ON pt.patient_id = p.id
-        JOIN test t ON pt.test_id = t.id
-        ORDER BY pt.date_ordered DESC, p.last_name, p.first_name
-        """
-
-        cursor = db.cursor()
-        cursor.execute(query)
-        assigned_tests = cursor.fetchall()
-
-        # Convert to list of dictionaries for easier template handling
-        tests_data = []
-        for test in assigned_tests:
-            tests_data.append({
-                'patient_test_id': test[0],
-                'patient_name': f"{test[1]} {test[2]}",
-                'phone': test[3],
-                'test_name': test[4],
-                'normal_range_min': test[5] or 0,
-                'normal_range_max': test[6] or 100,
-                'unit': test[7] or '',
-                'results': test[8] or '',
-                'status': test[9],
-                'date_ordered': test[10],
-                'date_completed': test[11],
-                'notes': test[12] or ''
-            })
-
-        return render_template('test_results_management.html', tests=tests_data)
+    """Result entry worklist - one page of assigned tests, filtered on the server"""
+    filters = _test_result_filters()
+    page = paginate_request(result_entry.worklist_query(**filters), PatientTest.date_ordered, PatientTest.id)
+    test_options = sorted(catalog_cache.get_catalog().choices(), key=lambda option: option[1])
+
+    return render_template('test_results_management.html',
+                         tests=[result_entry.to_dict(row) for row in page.items],
+                         page=page,
+                         test_options=test_options,
+                         statuses=result_entry.RESULT_STATUSES,
+                         search=request.args.get('q', ''),
+                         status_filter=request.args.get('status', ''),
+                         test_filter=filters['test_id'] or '',
+                         date_from=request.args.get('date_from', ''),
+                         date_to=request.args.get('date_to', ''))
+
+@app.route('/api/test-results')
+def api_test_results():
+    """Next page of the result worklist for incremental loading (same filters, after=cursor)"""
+    page = paginate_request(result_entry.worklist_query(**_test_result_filters()),
+                            PatientTest.date_ordered, PatientTest.id)
+    return jsonify({
+        'items': [result_entry.to_dict(row) for row in page.items],
+        'next_cursor': page.next_cursor,
+        'next_url': page.next_url
+    })
 
-    except Exception as e:
-        print(f"Error in test results management: {str(e)}")
-        return f"Error loading test results: {str(e)}", 500
+def _test_result_filters():
+    """Worklist filters from the query string"""
+    return {
+        'status': request.args.get('status') or None,
+        'patient_id': request.args.get('patient_id', type=int),
+        'test_id': request.args.get('test_id', type=int),
+        'date_from': result_entry.parse_date(request.args.get('date_from')),
+        'date_to': result_entry.parse_date(request.args.get('date_to')),
+        'search': request.args.get('q', '').strip() or None,
+    }
 
 @app.route('/update-test-result', methods=['POST'])
 def update_test_result():
     """Update test result and status"""
+    data = request.get_json(silent=True) or {}
     try:
-        data = request.get_json()
-        patient_test_id = data.get('patient_test_id')
-        result_value = data.get('result_value')
-        status = data.get('status', 'Completed')
-        notes = data.get('notes', '')
+        patient_test_id = int(data.get('patient_test_id'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Missing test id'}), 400
 
-        # Update the test result
-        cursor = db.cursor()
-        cursor.execute("""
-            UPDATE patient_test
-            SET results = ?, status = ?, notes = ?, date_completed = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (result_value, status, notes, patient_test_id))
+    try:
+        result_entry.update_result(
+            patient_test_id,
+            data.get('result_value'),
+            status=data.get('status', 'Completed'),
+            notes=data.get('notes')
+        )
+        db.session.commit()
+    except result_entry.ResultError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), e.http_status
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error updating test result {patient_test_id}: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
-        db.commit()
+    row = result_entry.worklist_query().filter(PatientTest.id == patient_test_id).first()
+    return jsonify({
+        'success': True,
+        'message': 'Test result updated successfully',
+        'test': result_entry.to_dict(row)
+    })
 
-        return jsonify({'success': True, 'message': 'Test result updated successfully'})
+@app.route('/api/test-results/batch', methods=['POST'])
+@login_required
+def api_test_results_batch():
+    """Analyzer result upload: a JSON list, CSV body or CSV file of
+    (patient_test_id or barcode, value, unit, status) rows. ?dry_run=1 only validates."""
+    try:
+        upload = request.files.get('file')
+        if upload:
+            rows = result_entry.parse_batch(csv_text=upload.read().decode('utf-8-sig'))
+        elif request.mimetype in ('text/csv', 'text/plain'):
+            rows = result_entry.parse_batch(csv_text=request.get_data(as_text=True))
+        else:
+            rows = result_entry.parse_batch(request.get_json(silent=True))
+    except (result_entry.ResultError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'message': str(e)}), getattr(e, 'http_status', 400)
 
+    dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+    try:
+        report = result_entry.apply_batch(rows, dry_run=dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
     except Exception as e:
-        print(f"Error updating test result: {str(e)}")
+        db.session.rollback()
+        app.logger.error(f"Error applying result batch of {len(rows)} rows: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
+    app.logger.info(f"Result batch: {report['applied']} applied, {report['failed']} failed"
+                    f"{' (dry run)' if dry_run else ''}")
+    return jsonify(dict(report, success=True))
+
 if __name__ == '__main__':
     create_tables()
 
@@ -2880,6 +2757,6 @@ if __name__ == '__main__':
     print(f"🌐 Starting Pathology Lab Management System...")
     print(f"📊 Main Application: http://localhost:{port}")
     print(f"🔍 Database Viewer: http://localhost:{port}/db-viewer/")
-    print(f"📁 Database: {database_path}")
+    print(f"📁 Database: {database_path if sqlite_database else app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]}")
 
     app.run(host='0.0.0.0', port=port, debug=debug)
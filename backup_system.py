@@ -2,34 +2,58 @@
 """
 Pathology Lab Database Backup System
 Automatically creates backups of SQLite database
+(or of the PostgreSQL database in DATABASE_URL, with pg_dump / pg_restore)
 """
 
 import os
 import shutil
 import datetime
 import sqlite3
+import subprocess
 import zipfile
 from pathlib import Path
+import db_connections
+import table_stats
 
 class DatabaseBackup:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, database_url=None):
         """Initialize backup system"""
+        # A PostgreSQL DATABASE_URL is backed up with pg_dump; sqlite URLs name the file
+        database_url = database_url or (os.environ.get('DATABASE_URL') if db_path is None else None)
+        self.database_url = None
+        if database_url:
+            sqlite_database = db_connections.sqlite_path(database_url)
+            if sqlite_database:
+                db_path = sqlite_database
+            else:
+                self.database_url = _libpq_url(database_url)
+
         if db_path is None:
             # Default to data directory
             self.data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-            self.db_path = os.path.join(self.data_dir, 'pathology.db')
+            self.db_path = None if self.database_url else os.path.join(self.data_dir, 'pathology.db')
         else:
             self.db_path = db_path
-            self.data_dir = os.path.dirname(db_path)
+            self.data_dir = os.path.dirname(os.path.abspath(db_path))
         
         # Create backup directory
         self.backup_dir = os.path.join(self.data_dir, 'backups')
         if not os.path.exists(self.backup_dir):
             os.makedirs(self.backup_dir)
     
+    def _dump_postgres(self, backup_path):
+        """pg_dump in custom format (compressed, restorable table by table)"""
+        subprocess.run(
+            ['pg_dump', '--format=custom', '--no-owner', '--file', backup_path, self.database_url],
+            check=True
+        )
+
     def create_backup(self, backup_type='manual'):
         """Create a backup of the database"""
         try:
+            if self.database_url:
+                return self._create_postgres_backup(backup_type)
+
             if not os.path.exists(self.db_path):
                 print(f"❌ Database file not found: {self.db_path}")
                 return False
@@ -75,6 +99,33 @@ class DatabaseBackup:
             print(f"❌ Backup failed: {str(e)}")
             return False
     
+    def _create_postgres_backup(self, backup_type):
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_filename = f"pathology_backup_{backup_type}_{timestamp}.dump"
+        backup_path = os.path.join(self.backup_dir, backup_filename)
+        self._dump_postgres(backup_path)
+
+        # Same zip layout as the SQLite backups, so list/cleanup/restore treat them alike
+        zip_path = os.path.join(self.backup_dir, f"pathology_backup_{backup_type}_{timestamp}.zip")
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zipf:
+            zipf.write(backup_path, backup_filename)
+        os.remove(backup_path)
+
+        size_mb = os.path.getsize(zip_path) / (1024 * 1024)
+        print(f"✅ Backup created successfully!")
+        print(f"📁 Location: {zip_path}")
+        print(f"📊 Size: {size_mb:.2f} MB")
+        print(f"🕒 Timestamp: {timestamp}")
+        return zip_path
+
+    def _restore_postgres(self, dump_path):
+        """pg_restore over the current database, replacing the tables in the dump"""
+        subprocess.run(
+            ['pg_restore', '--clean', '--if-exists', '--no-owner', '--single-transaction',
+             '--dbname', self.database_url, dump_path],
+            check=True
+        )
+
     def restore_backup(self, backup_path):
         """Restore database from backup"""
         try:
@@ -97,8 +148,9 @@ class DatabaseBackup:
                     
                     zipf.extractall(temp_dir)
                     
-                    # Find the .db file
-                    db_files = [f for f in os.listdir(temp_dir) if f.endswith('.db')]
+                    # Find the .db file (.dump for PostgreSQL)
+                    db_files = [f for f in os.listdir(temp_dir)
+                                if f.endswith('.dump' if self.database_url else '.db')]
                     if not db_files:
                         print("❌ No database file found in backup")
                         return False
@@ -108,7 +160,10 @@ class DatabaseBackup:
                 extracted_db = backup_path
             
             # Replace current database
-            shutil.copy2(extracted_db, self.db_path)
+            if self.database_url:
+                self._restore_postgres(extracted_db)
+            else:
+                shutil.copy2(extracted_db, self.db_path)
             
             # Clean up temporary files
             if backup_path.endswith('.zip'):
@@ -178,9 +233,41 @@ class DatabaseBackup:
             print(f"❌ Cleanup failed: {str(e)}")
             return 0
     
+    def _postgres_info(self):
+        """(size in bytes, row counts) of the PostgreSQL database"""
+        from sqlalchemy import create_engine
+        engine = create_engine(db_connections.normalize_url(self.database_url))
+        conn = engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_database_size(current_database());")
+            size = cursor.fetchone()[0]
+            return size, table_stats.collect_counts(conn, 'postgresql')
+        finally:
+            conn.close()
+            engine.dispose()
+
     def get_database_info(self):
         """Get information about the current database"""
         try:
+            if self.database_url:
+                file_size, counts = self._postgres_info()
+                location = self.database_url.split('@')[-1]
+                print(f"\n📊 Database Information:")
+                print("-" * 50)
+                print(f"📁 Location: {location}")
+                print(f"📊 Size: {file_size / (1024 * 1024):.2f} MB")
+                print(f"\n📋 Tables and Record Counts:")
+                for table, entry in counts.items():
+                    approximate = '' if entry['exact'] else '~'
+                    print(f"  • {table}: {approximate}{entry['count']} records")
+                return {
+                    'path': location,
+                    'size_mb': file_size / (1024 * 1024),
+                    'last_modified': None,
+                    'tables': {name: entry['count'] for name, entry in counts.items()}
+                }
+
             if not os.path.exists(self.db_path):
                 print("❌ Database file not found")
                 return None
@@ -191,18 +278,10 @@ class DatabaseBackup:
             
             # Get database info
             conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
             
-            # Get table info
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-            
-            table_info = {}
-            for table in tables:
-                table_name = table[0]
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-                count = cursor.fetchone()[0]
-                table_info[table_name] = count
+            # Get table info - large tables are estimated instead of scanned
+            counts = table_stats.collect_counts(conn)
+            table_info = {name: entry['count'] for name, entry in counts.items()}
             
             conn.close()
             
@@ -212,8 +291,9 @@ class DatabaseBackup:
             print(f"📊 Size: {file_size / (1024 * 1024):.2f} MB")
             print(f"🕒 Last Modified: {file_time.strftime('%Y-%m-%d %H:%M:%S')}")
             print(f"\n📋 Tables and Record Counts:")
-            for table, count in table_info.items():
-                print(f"  • {table}: {count} records")
+            for table, entry in counts.items():
+                approximate = '' if entry['exact'] else '~'
+                print(f"  • {table}: {approximate}{entry['count']} records")
             
             return {
                 'path': self.db_path,
@@ -226,6 +306,12 @@ class DatabaseBackup:
             print(f"❌ Error getting database info: {str(e)}")
             return None
 
+def _libpq_url(database_url):
+    """A SQLAlchemy PostgreSQL URL as pg_dump/pg_restore accept it (no +driver suffix)"""
+    from sqlalchemy.engine import make_url
+    url = make_url(database_url.replace('postgres://', 'postgresql://', 1))
+    return url.set(drivername='postgresql').render_as_string(hide_password=False)
+
 def main():
     """Command line interface for backup system"""
     import sys
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Patient billing service
+One bill per patient (unique on patient_id), created with an upsert and changed
+only through UPDATE statements computed from the row's current values so that
+concurrent workers cannot create duplicate bills or lose each other's payments.
+Bill totals are kept equal to the cost of the patient's non-cancelled tests
+whenever tests are written, with the discount re-applied as it was entered, so
+pages that show a bill never have to fix it up.
+"""
+
+from datetime import datetime
+from sqlalchemy import event, select, update, func, case, cast, and_, or_, literal, Integer
+from sqlalchemy.orm.attributes import get_history
+from models import db, Patient, Test, PatientTest, PatientBill
+import dashboard_counters
+
+bill_table = PatientBill.__table__
+pt_table = PatientTest.__table__
+test_table = Test.__table__
+patient_table = Patient.__table__
+
+
+def _insert_statement():
+    """INSERT ... ON CONFLICT (patient_id) DO NOTHING for the current database"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(bill_table)
+
+
+def _billable(patient_id):
+    """Scalar subquery: cost of the non-cancelled tests of `patient_id` (a value or column)"""
+    return select(func.coalesce(func.sum(test_table.c.cost), 0.0)).select_from(
+        pt_table.join(test_table, pt_table.c.test_id == test_table.c.id)
+    ).where(
+        pt_table.c.patient_id == patient_id,
+        or_(pt_table.c.status.is_(None), pt_table.c.status != 'Cancelled')
+    ).scalar_subquery()
+
+
+def billable_total(patient_id):
+    """Total cost of the patient's tests that are not cancelled"""
+    return db.session.execute(select(_billable(patient_id))).scalar()
+
+
+def _new_bill_values(total_amount):
+    return dict(
+        total_amount=total_amount,
+        paid_amount=0.0,
+        remaining_amount=total_amount,
+        discount_amount=0.0,
+        discount_percentage=0.0,
+        bill_date=datetime.utcnow(),
+        bill_status='pending'
+    )
+
+
+def _outstanding(connection, patient_ids):
+    """Sum of the positive balances of these patients' bills, locking the rows (PostgreSQL)"""
+    c = bill_table.c
+    balances = connection.execute(
+        select(c.remaining_amount).where(c.patient_id.in_(patient_ids)).with_for_update()
+    ).scalars()
+    return sum(balance for balance in balances if balance > 0)
+
+
+def _write_bills(connection, patient_ids, *statements):
+    """Run bill writes and pass the change in outstanding balance to the dashboard
+
+    The bills are read before and after in the same transaction, with their
+    rows locked, so the change is exactly what this transaction wrote.
+    """
+    before = _outstanding(connection, patient_ids)
+    for statement in statements:
+        connection.execute(statement)
+    dashboard_counters.pending_payments_changed(_outstanding(connection, patient_ids) - before)
+
+
+def _ensure_statement(patient_id):
+    """INSERT of the patient's bill, priced from their tests, unless it already exists"""
+    return _insert_statement().values(
+        patient_id=patient_id, **_new_bill_values(_billable(patient_id))
+    ).on_conflict_do_nothing(index_elements=['patient_id'])
+
+
+def _load_bill(patient_id):
+    # Re-read so the session sees the values written by the UPDATE statements
+    return PatientBill.query.filter_by(patient_id=patient_id).populate_existing().one()
+
+
+def get_bill(patient_id):
+    """The patient's bill, or None if nothing has been billed yet"""
+    return PatientBill.query.filter_by(patient_id=patient_id).first()
+
+
+def get_or_create_bill(patient_id):
+    """The patient's bill, created from the patient's current tests if missing"""
+    bill = get_bill(patient_id)
+    if bill:
+        return bill
+    _write_bills(db.session.connection(), [patient_id], _ensure_statement(patient_id))
+    return _load_bill(patient_id)
+
+
+def bill_for_display(patient_id):
+    """The patient's bill for read-only pages - an unsaved preview when none exists yet"""
+    bill = get_bill(patient_id)
+    if bill:
+        return bill
+    return PatientBill(patient_id=patient_id, **_new_bill_values(billable_total(patient_id)))
+
+
+def _balance_values(total_amount, discount_amount, paid_amount):
+    """remaining_amount / bill_status expressions for the given column expressions"""
+    final_amount = total_amount - discount_amount
+    remaining = final_amount - paid_amount
+    return {
+        'remaining_amount': case((remaining > 0, remaining), else_=0.0),
+        'bill_status': case(
+            (and_(paid_amount >= final_amount, or_(final_amount > 0, paid_amount > 0)), 'paid'),
+            (paid_amount > 0, 'partial'),
+            else_='pending'
+        )
+    }
+
+
+def calculate_discount(subtotal, discount_type, value):
+    """Discount on `subtotal`: a percentage (capped at 100) or a fixed amount (capped at the subtotal)"""
+    if not value or value <= 0:
+        return 0.0
+    if discount_type == 'percentage':
+        # Rounded half up, as the registration page shows it
+        return float(int(subtotal * min(value, 100) / 100 + 0.5))
+    return float(min(value, subtotal))
+
+
+def _round_half_up(amount):
+    """A non-negative SQL amount rounded to a whole number the way calculate_discount() rounds"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.floor(amount + 0.5)
+    # SQLite's CAST truncates (PostgreSQL's would round half to even)
+    return cast(amount + 0.5, Integer)
+
+
+def _at_most(amount, limit):
+    return case((amount > limit, limit), else_=amount)
+
+
+def _discount_values(total_amount, discount_type, discount_value):
+    """discount_amount / discount_percentage expressions for the entered discount on `total_amount`
+
+    The same rules as calculate_discount(). Bills from before the discount
+    type was stored keep their discount amount, capped at the total.
+    """
+    percentage = _at_most(discount_value, 100.0)
+    amount = _at_most(case(
+        (discount_type == 'percentage', _round_half_up(total_amount * percentage / 100.0)),
+        (discount_type == 'amount', discount_value),
+        else_=bill_table.c.discount_amount
+    ), total_amount)
+    return {
+        'discount_amount': amount,
+        'discount_percentage': case(
+            (discount_type == 'percentage', percentage),
+            (total_amount > 0, amount * 100.0 / total_amount),
+            else_=0.0
+        )
+    }
+
+
+def record_payment(patient_id, amount):
+    """Add a collected payment to the patient's bill in one atomic UPDATE
+
+    The new balance and status are computed by the database from the row's
+    current values, so parallel payments for the same patient all count.
+    """
+    c = bill_table.c
+    paid_amount = c.paid_amount + amount
+    _write_bills(
+        db.session.connection(), [patient_id],
+        _ensure_statement(patient_id),
+        update(bill_table)
+        .where(c.patient_id == patient_id)
+        .values(paid_amount=paid_amount,
+                **_balance_values(c.total_amount, c.discount_amount, paid_amount))
+    )
+    return _load_bill(patient_id)
+
+
+def apply_discount(patient_id, discount_percentage=0.0, discount_amount=0.0):
+    """Set the bill discount (a percentage wins over a fixed amount) atomically
+
+    The discount is kept as entered and re-applied whenever the bill is
+    repriced; it never exceeds the bill total.
+    """
+    c = bill_table.c
+    if discount_percentage > 0:
+        discount_type, value = 'percentage', discount_percentage
+    else:
+        discount_type, value = 'amount', max(discount_amount, 0.0)
+    bill = c.patient_id == patient_id
+    _write_bills(
+        db.session.connection(), [patient_id],
+        update(bill_table).where(bill)
+        .values(discount_type=discount_type, discount_value=value,
+                **_discount_values(c.total_amount, literal(discount_type), literal(value))),
+        update(bill_table).where(bill)
+        .values(**_balance_values(c.total_amount, c.discount_amount, c.paid_amount))
+    )
+    return _load_bill(patient_id)
+
+
+def refresh_totals(connection, patient_ids):
+    """Reprice the bills of `patient_ids` from their tests, creating missing bills"""
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return
+    billable = _billable(patient_table.c.id)
+    c = bill_table.c
+    bills = c.patient_id.in_(patient_ids)
+    # One step per statement: each reads the columns the previous one wrote
+    _write_bills(
+        connection, patient_ids,
+        _insert_statement().from_select(
+            ['patient_id', 'total_amount', 'paid_amount', 'remaining_amount', 'discount_amount',
+             'discount_percentage', 'bill_date', 'bill_status'],
+            select(patient_table.c.id, billable, literal(0.0), billable, literal(0.0),
+                   literal(0.0), literal(datetime.utcnow()), literal('pending'))
+            .where(patient_table.c.id.in_(patient_ids))
+        ).on_conflict_do_nothing(index_elements=['patient_id']),
+        update(bill_table).where(bills)
+        .values(total_amount=_billable(c.patient_id)),
+        update(bill_table).where(bills)
+        .values(**_discount_values(c.total_amount, c.discount_type, c.discount_value)),
+        update(bill_table).where(bills)
+        .values(**_balance_values(c.total_amount, c.discount_amount, c.paid_amount))
+    )
+
+
+def _changed(obj, *attributes):
+    return any(get_history(obj, attribute).has_changes() for attribute in attributes)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_bill_changes(session, flush_context):
+    """Reprice bills for tests assigned, cancelled, moved or repriced in this flush"""
+    patient_ids, test_ids = set(), set()
+
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, PatientTest):
+            patient_ids.add(obj.patient_id)
+
+    for obj in session.dirty:
+        if isinstance(obj, PatientTest):
+            status = get_history(obj, 'status')
+            if 'Cancelled' in (status.added or []) + (status.deleted or []) or _changed(obj, 'test_id', 'patient_id'):
+                patient_ids.add(obj.patient_id)
+                patient_ids.update(get_history(obj, 'patient_id').deleted or [])
+        elif isinstance(obj, Test) and _changed(obj, 'cost'):
+            test_ids.add(obj.id)
+
+    if test_ids:
+        patient_ids.update(session.connection().execute(
+            select(pt_table.c.patient_id).where(pt_table.c.test_id.in_(test_ids)).distinct()
+        ).scalars())
+
+    patient_ids.discard(None)
+    if patient_ids:
+        refresh_totals(session.connection(), patient_ids)
+
+
+def find_drifted_bills(connection):
+    """Patient ids whose bill disagrees with their tests or who have tests but no bill"""
+    billable = select(
+        pt_table.c.patient_id,
+        func.sum(test_table.c.cost).label('billable')
+    ).select_from(
+        pt_table.join(test_table, pt_table.c.test_id == test_table.c.id)
+    ).where(
+        or_(pt_table.c.status.is_(None), pt_table.c.status != 'Cancelled')
+    ).group_by(pt_table.c.patient_id).subquery()
+
+    c = bill_table.c
+    expected_total = func.coalesce(billable.c.billable, 0.0)
+    expected_discount = _discount_values(expected_total, c.discount_type, c.discount_value)['discount_amount']
+    expected = _balance_values(expected_total, expected_discount, c.paid_amount)
+    drifted = connection.execute(
+        select(c.patient_id).select_from(
+            bill_table.outerjoin(billable, billable.c.patient_id == c.patient_id)
+        ).where(or_(
+            func.abs(c.total_amount - expected_total) > 0.005,
+            func.abs(c.discount_amount - expected_discount) > 0.005,
+            func.abs(c.remaining_amount - expected['remaining_amount']) > 0.005,
+            c.bill_status != expected['bill_status']
+        ))
+    ).scalars().all()
+
+    unbilled = connection.execute(
+        select(billable.c.patient_id).select_from(
+            billable.outerjoin(bill_table, billable.c.patient_id == c.patient_id)
+        ).where(c.id.is_(None), billable.c.billable > 0)
+    ).scalars().all()
+    return sorted(set(drifted) | set(unbilled))
+
+
+def reconcile_bills(fix=True, batch_size=500):
+    """Find drifted bills in bulk and reprice them; returns the patient ids found"""
+    connection = db.session.connection()
+    patient_ids = find_drifted_bills(connection)
+    if fix:
+        for start in range(0, len(patient_ids), batch_size):
+            refresh_totals(connection, patient_ids[start:start + batch_size])
+        db.session.commit()
+    return patient_ids
+
+
+def main():
+    """Command line interface for bill reconciliation (suitable for cron)"""
+    import sys
+    from app import app
+
+    if len(sys.argv) < 2:
+        print("🔧 Patient Bill Reconciliation")
+        print("\nUsage:")
+        print("  python billing.py check       - List bills that disagree with the patient's tests")
+        print("  python billing.py reconcile   - Reprice drifted bills and create missing ones")
+        return
+
+    command = sys.argv[1].lower()
+
+    with app.app_context():
+        if command == 'check':
+            patient_ids = reconcile_bills(fix=False)
+            if patient_ids:
+                print(f"❌ {len(patient_ids)} bills out of step: patients {patient_ids[:20]}")
+                print("💡 Run 'python billing.py reconcile' to repair")
+                sys.exit(1)
+            print("✅ All bills match the patients' tests")
+        elif command == 'reconcile':
+            patient_ids = reconcile_bills()
+            print(f"✅ Reconciled {len(patient_ids)} bills")
+        else:
+            print("❌ Invalid command")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Test catalog cache
+The test catalog (names, prices, normal ranges, units) is read on almost every
+form page and priced in every order, but changes rarely. Each process keeps
+one copy in memory, tagged with the catalog version from the cache_version
+table. Every write to the test table bumps that version in the same
+transaction, so each worker notices a change made by any other one with a
+single read of the version table per request and reloads the catalog. The
+reference-data lists (reference_data.py) are versioned in the same table.
+
+Searches for the registration page run against the cached copy: prefix,
+word-prefix and substring matches on the name, then close matches for typos.
+"""
+
+import difflib
+import re
+import threading
+from datetime import datetime
+from flask import g, has_request_context
+from sqlalchemy import event, select, update
+from models import db, Test, CacheVersion
+import read_replica
+
+CATALOG = 'test_catalog'
+
+# Smallest similarity for a typo match ("hemoglobn" -> "Hemoglobin")
+FUZZY_CUTOFF = 0.75
+
+version_table = CacheVersion.__table__
+test_columns = [column.key for column in Test.__table__.columns]
+
+
+class CatalogTest:
+    """A test of the cached catalog, with the columns of Test (read-only)"""
+
+    __slots__ = test_columns
+
+    def __init__(self, row):
+        for name in test_columns:
+            setattr(self, name, getattr(row, name))
+
+    def __repr__(self):
+        return f'<CatalogTest {self.name}>'
+
+
+class TestCatalog:
+    """All tests of one catalog version, ordered by id, with lookups by id and name"""
+
+    def __init__(self, version, tests):
+        self.version = version
+        self.tests = tests
+        self.by_id = {test.id: test for test in tests}
+        self.by_name = {test.name: test for test in tests}
+        self._names = [(test, test.name.lower(), re.findall(r'[a-z0-9]+', test.name.lower())) for test in tests]
+
+    def get(self, test_id):
+        try:
+            return self.by_id.get(int(test_id))
+        except (TypeError, ValueError):
+            return None
+
+    def find(self, name):
+        return self.by_name.get(name)
+
+    def cost(self, test_id):
+        test = self.get(test_id)
+        return test.cost if test else None
+
+    def choices(self):
+        """(id, name) pairs for a SelectField"""
+        return [(test.id, test.name) for test in self.tests]
+
+    def categories(self):
+        return sorted({test.category for test in self.tests if test.category})
+
+    def search(self, query=None, category=None, limit=20):
+        """Tests matching `query` in their name, best matches first, optionally in one category
+
+        Order: name starts with the query, a word starts with it, the name
+        contains it, then names with a word close to it (typos).
+        """
+        query = (query or '').strip().lower()
+        category = (category or '').strip().lower()
+        ranked = []
+        for test, name, words in self._names:
+            if category and (test.category or '').lower() != category:
+                continue
+            if not query or name.startswith(query):
+                ranked.append((0, 0, name, test))
+            elif any(word.startswith(query) for word in words):
+                ranked.append((1, 0, name, test))
+            elif query in name:
+                ranked.append((2, 0, name, test))
+            else:
+                score = max((difflib.SequenceMatcher(None, query, word).ratio() for word in words), default=0)
+                if score >= FUZZY_CUTOFF:
+                    ranked.append((3, -score, name, test))
+        if query:
+            ranked.sort(key=lambda entry: entry[:3])
+        return [entry[3] for entry in ranked[:limit]]
+
+    def __iter__(self):
+        return iter(self.tests)
+
+    def __len__(self):
+        return len(self.tests)
+
+
+_lock = threading.Lock()
+_catalog = None
+
+
+def _insert_statement():
+    """INSERT ... ON CONFLICT (name) DO NOTHING for the current database"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(version_table)
+
+
+def cache_versions():
+    """Every cache's version on the primary, read in one query and kept for the request"""
+    if has_request_context() and 'cache_versions' in g:
+        return g.cache_versions
+    # A lagging replica would report an old version and reload old data
+    with read_replica.primary():
+        versions = dict(db.session.execute(select(version_table.c.name, version_table.c.version)).all())
+    if has_request_context():
+        g.cache_versions = versions
+    return versions
+
+
+def current_version(name=CATALOG):
+    """The version of cache `name` (0 before its first change)"""
+    return cache_versions().get(name, 0)
+
+
+def get_catalog():
+    """The test catalog, reloaded only when its version has changed"""
+    global _catalog
+    version = current_version()
+    catalog = _catalog
+    if catalog is not None and catalog.version == version:
+        return catalog
+
+    with _lock:
+        if _catalog is not None and _catalog.version == version:
+            return _catalog
+        # Read after the version: the data is at least as new as the tag
+        with read_replica.primary():
+            rows = db.session.execute(select(Test.__table__).order_by(Test.id)).all()
+        _catalog = TestCatalog(version, [CatalogTest(row) for row in rows])
+        return _catalog
+
+
+def bump(connection, name=CATALOG):
+    """Advance the version of cache `name` within the transaction of `connection`
+
+    For writes made with SQL statements, which the flush hook cannot see.
+    """
+    now = datetime.utcnow()
+    c = version_table.c
+    updated = connection.execute(
+        update(version_table).where(c.name == name).values(version=c.version + 1, updated_at=now)
+    ).rowcount
+    if not updated:
+        connection.execute(
+            _insert_statement().values(name=name, version=1, updated_at=now)
+            .on_conflict_do_nothing(index_elements=['name'])
+        )
+    db.session.info['cache_changed'] = True
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_catalog_changes(session, flush_context):
+    """Bump the version for tests added, edited or deleted in this flush"""
+    if any(isinstance(obj, Test) for obj in list(session.new) + list(session.deleted)) or any(
+            isinstance(obj, Test) and session.is_modified(obj) for obj in session.dirty):
+        bump(session.connection())
+
+
+@event.listens_for(db.session, 'after_commit')
+def _forget_request_version(session):
+    # This request's later reads must see its own cache changes
+    if session.info.pop('cache_changed', False) and has_request_context():
+        g.pop('cache_versions', None)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_catalog_change(session):
+    session.info.pop('cache_changed', None)
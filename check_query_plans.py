@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Query plan check for the hot query paths
+Runs EXPLAIN on the queries behind the busiest pages and exits non-zero when
+any of them falls back to a full table scan (e.g. a missing index migration)
+"""
+
+import sys
+from datetime import datetime, timedelta
+from models import db, Patient, PatientTest, PatientBill, Payment, DoctorCommission
+
+
+def hot_queries():
+    """(description, query) pairs for the filters used by the list and detail pages"""
+    since = datetime.utcnow() - timedelta(days=30)
+    return [
+        ("Patient by phone", Patient.query.filter_by(phone='9800000000')),
+        ("Patients of a doctor", Patient.query.filter_by(referring_doctor_id=1)),
+        ("Patients page", Patient.query.order_by(Patient.date_registered.desc(), Patient.id.desc()).limit(51)),
+        ("Tests of a patient", PatientTest.query.filter_by(patient_id=1)
+            .order_by(PatientTest.date_ordered.desc())),
+        ("Pending tests of a patient", PatientTest.query.filter_by(patient_id=1, status='Pending')),
+        ("Pending tests", PatientTest.query.filter(PatientTest.status == 'Pending')
+            .order_by(PatientTest.date_ordered.desc()).limit(10)),
+        ("Completed tests", PatientTest.query.filter(PatientTest.status == 'Completed')
+            .order_by(PatientTest.date_completed.desc()).limit(10)),
+        ("Tests ordered in a date range", PatientTest.query.filter(PatientTest.date_ordered >= since)),
+        ("Patient tests page", PatientTest.query.order_by(PatientTest.date_ordered.desc(),
+                                                          PatientTest.id.desc()).limit(51)),
+        ("Bill of a patient", PatientBill.query.filter_by(patient_id=1)),
+        ("Outstanding bills", PatientBill.query.filter(PatientBill.remaining_amount > 0)),
+        ("Payments of a patient", Payment.query.filter_by(patient_id=1)
+            .order_by(Payment.payment_date.desc())),
+        ("Payments page", Payment.query.order_by(Payment.payment_date.desc(), Payment.id.desc()).limit(51)),
+        ("Pending commissions of a doctor", DoctorCommission.query.filter_by(doctor_id=1, status='pending')),
+    ]
+
+
+def _compile(query):
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    if compiled.positiontup is not None:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    return compiled.string, params
+
+
+def explain(connection, query):
+    """Return (plan lines, full scan lines) for a query on the current database"""
+    sql, params = _compile(query)
+    if db.engine.dialect.name == 'sqlite':
+        plan = [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params)]
+        # "SCAN table" without "USING ... INDEX" reads every row
+        scans = [line for line in plan if line.startswith('SCAN ') and 'INDEX' not in line]
+    else:
+        plan = [row[0] for row in connection.exec_driver_sql(f"EXPLAIN {sql}", params)]
+        scans = [line for line in plan if 'Seq Scan' in line]
+    return plan, scans
+
+
+def check_query_plans(verbose=False):
+    """Explain every hot query; returns the list of queries that do a full scan"""
+    failures = []
+    with db.engine.connect() as connection:
+        if db.engine.dialect.name == 'postgresql':
+            # Small tables make a sequential scan the cheapest plan - only report
+            # the scans that are left when the planner has no other choice
+            connection.exec_driver_sql("SET enable_seqscan = off")
+
+        for description, query in hot_queries():
+            plan, scans = explain(connection, query)
+            if scans:
+                failures.append((description, scans))
+                print(f"❌ {description}: full scan")
+            else:
+                print(f"✅ {description}")
+            if verbose or scans:
+                for line in plan:
+                    print(f"     {line}")
+    return failures
+
+
+def main():
+    from app import app
+
+    verbose = '-v' in sys.argv[1:]
+    with app.app_context():
+        failures = check_query_plans(verbose)
+
+    if failures:
+        print(f"\n💥 {len(failures)} hot queries do a full table scan")
+        print("💡 Run 'python migrate_add_indexes.py' to create the missing indexes")
+        sys.exit(1)
+    print("\n🎉 All hot queries use an index")
+
+
+if __name__ == '__main__':
+    main()
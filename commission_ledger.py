@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Doctor Commission Ledger
+Keeps the doctor_commission table in step with test assignments so that
+commission reports read pre-summed rows instead of recomputing from history
+"""
+
+from datetime import datetime
+from sqlalchemy import event, select, update, insert, and_, or_, func
+from sqlalchemy.orm.attributes import get_history
+from models import db, Patient, Test, PatientTest, Doctor, DoctorCommission
+
+pt_table = PatientTest.__table__
+patient_table = Patient.__table__
+test_table = Test.__table__
+doctor_table = Doctor.__table__
+commission_table = DoctorCommission.__table__
+
+
+def expected_commission(commission_type, percentage, amount, test_amount):
+    """Commission for one test, mirroring Doctor.calculate_commission"""
+    if commission_type == 'percentage':
+        return (test_amount * (percentage or 0)) / 100
+    else:  # fixed amount
+        return amount or 0.0
+
+
+def _scope_filters(patient_test_ids, patient_ids, test_ids, doctor_ids, ledger=False):
+    """Build OR-ed scope filters for either the patient_test side or the ledger side"""
+    filters = []
+    if patient_test_ids:
+        column = commission_table.c.patient_test_id if ledger else pt_table.c.id
+        filters.append(column.in_(patient_test_ids))
+    if patient_ids:
+        column = commission_table.c.patient_id if ledger else pt_table.c.patient_id
+        filters.append(column.in_(patient_ids))
+    if test_ids:
+        filters.append(pt_table.c.test_id.in_(test_ids))
+    if doctor_ids:
+        column = commission_table.c.doctor_id if ledger else patient_table.c.referring_doctor_id
+        filters.append(column.in_(doctor_ids))
+    return filters
+
+
+def _plan(connection, patient_test_ids=None, patient_ids=None, test_ids=None, doctor_ids=None):
+    """Compare the ledger with test history for the given scope (everything when no scope)"""
+    scoped = any([patient_test_ids, patient_ids, test_ids, doctor_ids])
+
+    # Tests that should carry a commission: not cancelled, referred by an active doctor
+    wanted_query = select(
+        pt_table.c.id, pt_table.c.patient_id, patient_table.c.referring_doctor_id,
+        test_table.c.cost, doctor_table.c.commission_type,
+        doctor_table.c.commission_percentage, doctor_table.c.commission_amount
+    ).select_from(
+        pt_table.join(patient_table, pt_table.c.patient_id == patient_table.c.id)
+        .join(test_table, pt_table.c.test_id == test_table.c.id)
+        .join(doctor_table, patient_table.c.referring_doctor_id == doctor_table.c.id)
+    ).where(
+        or_(pt_table.c.status.is_(None), pt_table.c.status != 'Cancelled'),
+        doctor_table.c.is_active == True
+    )
+    if scoped:
+        wanted_query = wanted_query.where(or_(*_scope_filters(patient_test_ids, patient_ids, test_ids, doctor_ids)))
+
+    wanted = {}
+    for row in connection.execute(wanted_query):
+        rate = row.commission_percentage if row.commission_type == 'percentage' else row.commission_amount
+        wanted[row.id] = {
+            'doctor_id': row.referring_doctor_id,
+            'patient_id': row.patient_id,
+            'patient_test_id': row.id,
+            'test_amount': row.cost,
+            'commission_amount': expected_commission(row.commission_type, row.commission_percentage,
+                                                     row.commission_amount, row.cost),
+            'commission_type': row.commission_type,
+            'commission_rate': rate or 0.0
+        }
+
+    # Existing live ledger rows in the same scope
+    existing_query = select(commission_table).select_from(
+        commission_table.join(pt_table, commission_table.c.patient_test_id == pt_table.c.id, isouter=True)
+    ).where(commission_table.c.status != 'cancelled')
+    if scoped:
+        existing_query = existing_query.where(or_(*_scope_filters(patient_test_ids, patient_ids, test_ids, doctor_ids, ledger=True)))
+
+    to_cancel = []
+    to_update = []
+    covered = set()
+    for row in connection.execute(existing_query):
+        target = wanted.get(row.patient_test_id)
+        if row.status == 'paid':
+            # Paid commissions are history - never rewrite them
+            if target and target['doctor_id'] == row.doctor_id:
+                covered.add(row.patient_test_id)
+            continue
+
+        if not target or target['doctor_id'] != row.doctor_id or row.patient_test_id in covered:
+            to_cancel.append(row.id)
+            continue
+
+        covered.add(row.patient_test_id)
+        if (row.test_amount != target['test_amount'] or
+                row.commission_amount != target['commission_amount'] or
+                row.commission_type != target['commission_type'] or
+                row.commission_rate != target['commission_rate']):
+            to_update.append(dict(target, ledger_id=row.id))
+
+    to_insert = [entry for pt_id, entry in wanted.items() if pt_id not in covered]
+    return to_insert, to_update, to_cancel
+
+
+def _apply(connection, to_insert, to_update, to_cancel):
+    """Write a ledger plan with one statement per kind of change"""
+    if to_cancel:
+        connection.execute(
+            update(commission_table)
+            .where(commission_table.c.id.in_(to_cancel))
+            .values(status='cancelled')
+        )
+    for entry in to_update:
+        connection.execute(
+            update(commission_table)
+            .where(commission_table.c.id == entry['ledger_id'])
+            .values(test_amount=entry['test_amount'],
+                    commission_amount=entry['commission_amount'],
+                    commission_type=entry['commission_type'],
+                    commission_rate=entry['commission_rate'])
+        )
+    if to_insert:
+        now = datetime.utcnow()
+        connection.execute(
+            insert(commission_table),
+            [dict(entry, status='pending', date_created=now) for entry in to_insert]
+        )
+
+
+def sync(connection, patient_test_ids=None, patient_ids=None, test_ids=None, doctor_ids=None):
+    """Bring pending ledger rows in the given scope up to date"""
+    plan = _plan(connection, patient_test_ids, patient_ids, test_ids, doctor_ids)
+    _apply(connection, *plan)
+    return plan
+
+
+def _changed(obj, *attributes):
+    return any(get_history(obj, attribute).has_changes() for attribute in attributes)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_commission_changes(session, flush_context):
+    """Update the ledger for tests assigned, cancelled or repriced in this flush"""
+    patient_test_ids, patient_ids, test_ids, doctor_ids = set(), set(), set(), set()
+
+    for obj in session.new:
+        if isinstance(obj, PatientTest):
+            patient_test_ids.add(obj.id)
+
+    for obj in session.dirty:
+        if isinstance(obj, PatientTest) and _changed(obj, 'status', 'test_id', 'patient_id'):
+            patient_test_ids.add(obj.id)
+            patient_ids.update(get_history(obj, 'patient_id').deleted or [])
+        elif isinstance(obj, Patient) and _changed(obj, 'referring_doctor_id'):
+            patient_ids.add(obj.id)
+        elif isinstance(obj, Test) and _changed(obj, 'cost'):
+            test_ids.add(obj.id)
+        elif isinstance(obj, Doctor) and _changed(obj, 'commission_type', 'commission_percentage',
+                                                  'commission_amount', 'is_active'):
+            doctor_ids.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, PatientTest):
+            patient_test_ids.add(obj.id)
+
+    if patient_test_ids or patient_ids or test_ids or doctor_ids:
+        sync(session.connection(), patient_test_ids, patient_ids, test_ids, doctor_ids)
+
+
+def rebuild():
+    """Rebuild every pending ledger row from test history (paid rows are kept)"""
+    to_insert, to_update, to_cancel = sync(db.session.connection())
+    db.session.commit()
+    return {'inserted': len(to_insert), 'updated': len(to_update), 'cancelled': len(to_cancel)}
+
+
+def verify():
+    """Report ledger rows that disagree with test history without changing anything"""
+    to_insert, to_update, to_cancel = _plan(db.session.connection())
+    return {
+        'missing': [entry['patient_test_id'] for entry in to_insert],
+        'stale': [entry['ledger_id'] for entry in to_update],
+        'orphaned': to_cancel,
+        'ok': not (to_insert or to_update or to_cancel)
+    }
+
+
+def mark_paid(doctor_id, notes=None):
+    """Mark all pending commissions of a doctor as paid, returning the amount settled"""
+    pending = and_(commission_table.c.doctor_id == doctor_id, commission_table.c.status == 'pending')
+    amount = db.session.execute(
+        select(func.coalesce(func.sum(commission_table.c.commission_amount), 0.0)).where(pending)
+    ).scalar()
+    db.session.execute(
+        update(commission_table).where(pending)
+        .values(status='paid', date_paid=datetime.utcnow(), payment_notes=notes)
+    )
+    return amount
+
+
+def doctor_totals():
+    """Per-doctor commission totals by status: {doctor_id: {'pending':, 'paid':, 'tests':}}"""
+    totals = {}
+    rows = db.session.query(
+        DoctorCommission.doctor_id,
+        DoctorCommission.status,
+        func.count(DoctorCommission.id),
+        func.sum(DoctorCommission.commission_amount)
+    ).filter(DoctorCommission.status != 'cancelled').group_by(
+        DoctorCommission.doctor_id, DoctorCommission.status
+    )
+    for doctor_id, status, count, amount in rows:
+        entry = totals.setdefault(doctor_id, {'pending': 0.0, 'paid': 0.0, 'tests': 0})
+        entry[status] = amount or 0.0
+        entry['tests'] += count
+    return totals
+
+
+def patient_totals():
+    """Per-patient live commission totals: {patient_id: amount}"""
+    rows = db.session.query(
+        DoctorCommission.patient_id,
+        func.sum(DoctorCommission.commission_amount)
+    ).filter(DoctorCommission.status != 'cancelled').group_by(DoctorCommission.patient_id)
+    return dict((patient_id, amount or 0.0) for patient_id, amount in rows)
+
+
+def main():
+    """Command line interface for the commission ledger"""
+    import sys
+    from app import app
+
+    if len(sys.argv) < 2:
+        print("🔧 Doctor Commission Ledger")
+        print("\nUsage:")
+        print("  python commission_ledger.py rebuild   - Rebuild pending rows from test history")
+        print("  python commission_ledger.py verify    - Check the ledger against test history")
+        return
+
+    command = sys.argv[1].lower()
+
+    with app.app_context():
+        if command == 'rebuild':
+            result = rebuild()
+            print(f"✅ Ledger rebuilt: {result['inserted']} added, {result['updated']} repriced, {result['cancelled']} cancelled")
+        elif command == 'verify':
+            result = verify()
+            if result['ok']:
+                print("✅ Commission ledger matches test history")
+            else:
+                print(f"❌ Missing entries for {len(result['missing'])} tests: {result['missing'][:20]}")
+                print(f"❌ Stale amounts on {len(result['stale'])} ledger rows: {result['stale'][:20]}")
+                print(f"❌ Orphaned pending rows: {len(result['orphaned'])}: {result['orphaned'][:20]}")
+                print("💡 Run 'python commission_ledger.py rebuild' to repair")
+                sys.exit(1)
+        else:
+            print("❌ Invalid command")
+
+
+if __name__ == '__main__':
+    main()
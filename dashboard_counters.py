@@ -0,0 +1,354 @@
+"""
+Dashboard counter cache
+Keeps the dashboard totals (patients, tests, pending/completed tests, revenue,
+pending payments) in memory - or in Redis when REDIS_URL is set, so that every
+worker shares them - and updates them from the write paths as transactions
+commit. Every value also expires after a TTL so writes made outside the ORM
+(raw SQL, other tools) are picked up eventually.
+
+A recompute can race a commit: it may already count a transaction whose
+increment is still to come, or store a total read before a transaction that
+has since been applied. Each counter therefore carries two stamps - bumped
+whenever it is loaded and whenever it is written - and an increment for a
+counter loaded since the transaction began invalidates it instead, while a
+recompute overlapped by a write is returned without being cached.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, func
+from sqlalchemy.orm.attributes import get_history
+from models import db, Patient, Test, PatientTest, Payment, PatientBill
+import read_replica
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 300))  # seconds
+
+STATUS_COUNTERS = {'Pending': 'pending_tests', 'Completed': 'completed_tests'}
+
+
+def _week_ago():
+    return datetime.utcnow() - timedelta(days=7)
+
+
+# How to compute each counter from scratch (only on a cache miss)
+COUNTERS = {
+    'total_patients': lambda: Patient.query.count(),
+    # Incremented on registration; registrations ageing out are dropped by the TTL
+    'new_patients_week': lambda: Patient.query.filter(Patient.date_registered >= _week_ago()).count(),
+    'total_tests': lambda: Test.query.count(),
+    'total_patient_tests': lambda: PatientTest.query.count(),
+    'pending_tests': lambda: PatientTest.query.filter_by(status='Pending').count(),
+    'completed_tests': lambda: PatientTest.query.filter_by(status='Completed').count(),
+    'total_revenue': lambda: db.session.query(func.coalesce(func.sum(Payment.amount), 0.0)).scalar(),
+    'pending_payments': lambda: db.session.query(
+        func.coalesce(func.sum(PatientBill.remaining_amount), 0.0)
+    ).filter(PatientBill.remaining_amount > 0).scalar(),
+}
+
+
+class LocalCounterStore:
+    """Per-process counters with a load time for the TTL"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._loaded_at = {}
+        self._loads = {}
+        self._writes = {}
+
+    def get(self, ttl):
+        now = time.monotonic()
+        with self._lock:
+            return {name: value for name, value in self._values.items()
+                    if now - self._loaded_at[name] < ttl}
+
+    def load_stamps(self):
+        with self._lock:
+            return {name: self._loads.get(name, 0) for name in COUNTERS}
+
+    def write_stamps(self):
+        with self._lock:
+            return {name: self._writes.get(name, 0) for name in COUNTERS}
+
+    def set_many(self, values, ttl, write_stamps):
+        now = time.monotonic()
+        with self._lock:
+            for name, value in values.items():
+                if self._writes.get(name, 0) != write_stamps[name]:
+                    continue
+                self._values[name] = value
+                self._loaded_at[name] = now
+                self._loads[name] = self._loads.get(name, 0) + 1
+
+    def increment(self, deltas, load_stamps):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._writes[name] = self._writes.get(name, 0) + 1
+                if self._loads.get(name, 0) != load_stamps[name]:
+                    self._drop(name)
+                # Only adjust loaded values - a missing one is computed fresh later
+                elif name in self._values:
+                    self._values[name] += delta
+
+    def invalidate(self, names=None):
+        with self._lock:
+            for name in list(names if names is not None else COUNTERS):
+                self._writes[name] = self._writes.get(name, 0) + 1
+                self._drop(name)
+
+    def _drop(self, name):
+        self._values.pop(name, None)
+        self._loaded_at.pop(name, None)
+
+
+class RedisCounterStore:
+    """Counters shared by all workers, one Redis key per counter"""
+
+    prefix = 'pathology:dashboard:'
+
+    # KEYS: value, load stamp, write stamp. INCRBYFLOAT on a missing key would
+    # start from zero - only adjust live keys loaded before the transaction began
+    INCREMENT = """
+        redis.call('INCR', KEYS[3])
+        if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then
+            redis.call('DEL', KEYS[1])
+            return false
+        end
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            return redis.call('INCRBYFLOAT', KEYS[1], ARGV[1])
+        end
+        return false
+    """
+
+    # KEYS: value, load stamp, write stamp - store a recompute no write has overlapped
+    SET_IF_UNWRITTEN = """
+        if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[3] then
+            return false
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+        redis.call('INCR', KEYS[2])
+        return true
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self._increment = self.client.register_script(self.INCREMENT)
+        self._set = self.client.register_script(self.SET_IF_UNWRITTEN)
+
+    def _keys(self, name):
+        return [self.prefix + name, self.prefix + 'loads:' + name, self.prefix + 'writes:' + name]
+
+    def _stamps(self, kind):
+        names = list(COUNTERS)
+        stamps = self.client.mget([f'{self.prefix}{kind}:{name}' for name in names])
+        return {name: (stamp or b'0').decode() for name, stamp in zip(names, stamps)}
+
+    def get(self, ttl):
+        names = list(COUNTERS)
+        values = self.client.mget([self.prefix + name for name in names])
+        return {name: float(value) for name, value in zip(names, values) if value is not None}
+
+    def load_stamps(self):
+        return self._stamps('loads')
+
+    def write_stamps(self):
+        return self._stamps('writes')
+
+    def set_many(self, values, ttl, write_stamps):
+        for name, value in values.items():
+            self._set(keys=self._keys(name), args=[value, ttl, write_stamps[name]])
+
+    def increment(self, deltas, load_stamps):
+        for name, delta in deltas.items():
+            self._increment(keys=self._keys(name), args=[delta, load_stamps[name]])
+
+    def invalidate(self, names=None):
+        pipe = self.client.pipeline()
+        for name in (names or COUNTERS):
+            pipe.incr(self.prefix + 'writes:' + name)
+            pipe.delete(self.prefix + name)
+        pipe.execute()
+
+
+def _create_store():
+    redis_url = os.environ.get('REDIS_URL')
+    if redis_url and REDIS_AVAILABLE:
+        try:
+            store = RedisCounterStore(redis_url)
+            store.client.ping()
+            return store
+        except Exception as e:
+            print(f"⚠️ Redis unavailable for dashboard counters, using in-process cache: {e}")
+    return LocalCounterStore()
+
+
+store = _create_store()
+
+
+def get_counters():
+    """All dashboard counters - computed only for values missing from the cache"""
+    try:
+        values = store.get(CACHE_TTL)
+    except Exception:
+        values = {}
+    missing = [name for name in COUNTERS if name not in values]
+    if missing:
+        try:
+            write_stamps = store.write_stamps()
+        except Exception:
+            write_stamps = None
+        # The cache is shared and updated by later writes - count on the primary
+        with read_replica.primary():
+            fresh = {name: COUNTERS[name]() for name in missing}
+        try:
+            if write_stamps is not None:
+                store.set_many(fresh, CACHE_TTL, write_stamps)
+        except Exception:
+            pass
+        values.update(fresh)
+    for name in ('total_patients', 'new_patients_week', 'total_tests', 'total_patient_tests',
+                 'pending_tests', 'completed_tests'):
+        values[name] = int(values[name])
+    return values
+
+
+def _mark_stale(session, *names):
+    session.info.setdefault('counters_stale', set()).update(names)
+
+
+def mark_stale(*names):
+    """Recompute these counters once the current transaction commits
+
+    For writes made with SQL statements, which the flush hook cannot see.
+    """
+    _mark_stale(db.session, *names)
+
+
+def _add(session, name, delta):
+    if 'counter_load_stamps' not in session.info:
+        # Taken before this transaction commits: a counter loaded after it may already include it
+        try:
+            session.info['counter_load_stamps'] = store.load_stamps()
+        except Exception:
+            session.info['counter_load_stamps'] = None
+    deltas = session.info.setdefault('counter_deltas', {})
+    deltas[name] = deltas.get(name, 0) + delta
+
+
+def pending_payments_changed(delta):
+    """Adjust the outstanding balance by `delta` once the transaction commits
+
+    Called by billing with the change in remaining_amount of the bills it wrote.
+    """
+    if delta:
+        _add(db.session, 'pending_payments', delta)
+
+
+def status_changed(old_status, new_status, count=1):
+    """Move `count` tests between the status counters once the transaction commits
+
+    For status changes written with SQL statements, which the flush hook cannot see.
+    """
+    if old_status == new_status:
+        return
+    if old_status in STATUS_COUNTERS:
+        _add(db.session, STATUS_COUNTERS[old_status], -count)
+    if new_status in STATUS_COUNTERS:
+        _add(db.session, STATUS_COUNTERS[new_status], count)
+
+
+def tests_assigned(count, status='Pending'):
+    """Count `count` new patient tests once the transaction commits
+
+    For tests inserted with SQL statements, which the flush hook cannot see.
+    """
+    _add(db.session, 'total_patient_tests', count)
+    if status in STATUS_COUNTERS:
+        _add(db.session, STATUS_COUNTERS[status], count)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_counter_changes(session, flush_context):
+    """Turn the rows written in this flush into counter deltas
+
+    Bill balances (pending_payments) are written by billing, which reports
+    their changes through pending_payments_changed().
+    """
+    for obj in session.new:
+        if isinstance(obj, Patient):
+            _add(session, 'total_patients', 1)
+            if obj.date_registered is None or obj.date_registered >= _week_ago():
+                _add(session, 'new_patients_week', 1)
+        elif isinstance(obj, Test):
+            _add(session, 'total_tests', 1)
+        elif isinstance(obj, PatientTest):
+            _add(session, 'total_patient_tests', 1)
+            if obj.status in STATUS_COUNTERS:
+                _add(session, STATUS_COUNTERS[obj.status], 1)
+        elif isinstance(obj, Payment):
+            _add(session, 'total_revenue', obj.amount or 0)
+
+    for obj in session.dirty:
+        if isinstance(obj, PatientTest):
+            history = get_history(obj, 'status')
+            for status in history.deleted or []:
+                if status in STATUS_COUNTERS:
+                    _add(session, STATUS_COUNTERS[status], -1)
+            for status in history.added or []:
+                if status in STATUS_COUNTERS:
+                    _add(session, STATUS_COUNTERS[status], 1)
+        elif isinstance(obj, Payment):
+            history = get_history(obj, 'amount')
+            if history.has_changes():
+                _add(session, 'total_revenue', sum(history.added or []) - sum(history.deleted or []))
+
+    for obj in session.deleted:
+        if isinstance(obj, Patient):
+            _add(session, 'total_patients', -1)
+            _mark_stale(session, 'new_patients_week')
+        elif isinstance(obj, Test):
+            _add(session, 'total_tests', -1)
+        elif isinstance(obj, PatientTest):
+            _add(session, 'total_patient_tests', -1)
+            if obj.status in STATUS_COUNTERS:
+                _add(session, STATUS_COUNTERS[obj.status], -1)
+        elif isinstance(obj, Payment):
+            _add(session, 'total_revenue', -(obj.amount or 0))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_counter_changes(session):
+    deltas = {name: delta for name, delta in session.info.pop('counter_deltas', {}).items() if delta}
+    stale = session.info.pop('counters_stale', None)
+    load_stamps = session.info.pop('counter_load_stamps', None)
+    try:
+        if deltas:
+            if load_stamps is None:
+                store.invalidate(deltas)
+            else:
+                store.increment(deltas, load_stamps)
+        if stale:
+            store.invalidate(stale)
+    except Exception:
+        # A cache that cannot be updated must not fail the commit - drop it instead
+        try:
+            store.invalidate()
+        except Exception:
+            pass
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_counter_changes(session, transaction):
+    # after_commit has already applied them; anything left was rolled back
+    if transaction.parent is None:
+        session.info.pop('counter_deltas', None)
+        session.info.pop('counters_stale', None)
+        session.info.pop('counter_load_stamps', None)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Pooled SQLite connections for the raw SQL paths
+The database viewers and other raw sqlite3 code share one connection per
+thread and database file instead of opening a new one per request. The
+performance pragmas (WAL, synchronous, page cache, mmap, busy timeout) are
+applied once when a connection is opened, and a checked-out connection always
+goes back to the pool: close() releases it, and so does dropping it on an
+early return. Any transaction left open is rolled back on release.
+
+On PostgreSQL the raw SQL paths check connections out of the SQLAlchemy
+engine pool instead (sized by POOL_SETTINGS), and the dialect helpers below
+give them the same table listing, schema and placeholder handling.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Applied to every new connection (raw and SQLAlchemy); the environment overrides the defaults
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    # Negative cache_size is in KiB
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_SIZE_KB', 20000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE_MB', 256)) * 1024 * 1024,
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 30000)),
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
+# Seconds between PRAGMA optimize runs on the application engine (0 disables)
+OPTIMIZE_INTERVAL = int(os.environ.get('SQLITE_OPTIMIZE_INTERVAL', 3600))
+# Rows sampled per index by optimize/ANALYZE, keeping each run short on big tables
+ANALYSIS_LIMIT = int(os.environ.get('SQLITE_ANALYSIS_LIMIT', 1000))
+
+# Connection pool of the SQLAlchemy engine on server databases (PostgreSQL)
+POOL_SETTINGS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+    # Test connections on checkout so a restarted server or a dropped
+    # connection costs a reconnect instead of a failed request
+    'pool_pre_ping': True,
+    # Below typical server/load balancer idle timeouts
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+}
+
+
+def apply_pragmas(conn, pragmas=None):
+    """Set the connection pragmas, skipping any the database refuses"""
+    for name, value in (pragmas or SQLITE_PRAGMAS).items():
+        try:
+            conn.execute(f"PRAGMA {name}={value};")
+        except sqlite3.Error as e:
+            # e.g. journal_mode on a read-only file
+            print(f"⚠️ PRAGMA {name}={value} not applied: {e}")
+
+
+class PooledConnection:
+    """A checked-out connection; close() hands it back to the pool instead of closing it"""
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_released', False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def raw(self):
+        """The underlying sqlite3.Connection, for APIs that type-check it (e.g. pandas)"""
+        return self._conn
+
+    def __setattr__(self, name, value):
+        # e.g. conn.row_factory = sqlite3.Row
+        setattr(self._conn, name, value)
+
+    def close(self):
+        if not self._released:
+            object.__setattr__(self, '_released', True)
+            self._pool._release(self._conn)
+
+    def __del__(self):
+        # Callers that return early without close() still give the connection back
+        self.close()
+
+
+class SQLitePool:
+    """One connection per thread for a database file"""
+
+    def __init__(self, db_path, pragmas=None, timeout=30.0):
+        self.db_path = db_path
+        self.pragmas = pragmas or SQLITE_PRAGMAS
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}  # thread id -> connection
+
+    def _open(self):
+        # Only ever used by the opening thread; check_same_thread=False just lets
+        # the pool close connections left behind by threads that have finished
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        apply_pragmas(conn, self.pragmas)
+        with self._lock:
+            alive = {thread.ident for thread in threading.enumerate()}
+            current = threading.get_ident()
+            for ident in list(self._connections):
+                # Finished threads, or a new thread that was given a reused id
+                if ident not in alive or ident == current:
+                    self._connections.pop(ident).close()
+            self._connections[current] = conn
+        return conn
+
+    def acquire(self, row_factory=None):
+        """This thread's connection (opened on first use), wrapped for release"""
+        state = self._local
+        conn = getattr(state, 'conn', None)
+        if conn is None:
+            conn = state.conn = self._open()
+            state.depth = 0
+        if state.depth == 0 and conn.in_transaction:
+            conn.rollback()
+        state.depth += 1
+        conn.row_factory = row_factory
+        return PooledConnection(self, conn)
+
+    def _release(self, conn):
+        state = self._local
+        if getattr(state, 'conn', None) is not conn:
+            return  # released from another thread - the owner cleans up on its next acquire
+        state.depth = max(0, state.depth - 1)
+        if state.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+    def close_all(self):
+        """Close every connection of this pool (e.g. before replacing the database file)"""
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+            self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """The shared pool of a database file"""
+    db_path = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = SQLitePool(db_path)
+        return pool
+
+
+def connect(db_path, row_factory=None):
+    """A pooled connection to an existing database file, or None if the file is missing"""
+    if not os.path.exists(db_path):
+        return None
+    return get_pool(db_path).acquire(row_factory)
+
+
+@contextmanager
+def connection(db_path, row_factory=None):
+    """`with connection(path) as conn:` - released when the block ends"""
+    conn = connect(db_path, row_factory)
+    if conn is None:
+        raise FileNotFoundError(f"Database file not found: {db_path}")
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def close_all():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+
+
+# ================================
+# RAW SQL ON SQLITE AND POSTGRESQL
+# ================================
+# The viewer, export, search and statistics code runs raw SQL on either a
+# pooled sqlite3 connection or a PostgreSQL connection checked out of the
+# SQLAlchemy engine pool; these helpers hide the differences.
+
+def dialect_of(conn):
+    """'sqlite' or 'postgresql' for a raw DB-API connection"""
+    raw = getattr(conn, 'raw', conn)
+    # SQLAlchemy pool proxies wrap the driver connection
+    raw = getattr(raw, 'dbapi_connection', raw)
+    return 'sqlite' if isinstance(raw, sqlite3.Connection) else 'postgresql'
+
+
+def sql(conn, statement):
+    """Adapt a statement written with ? placeholders to the connection's driver"""
+    if dialect_of(conn) == 'sqlite':
+        return statement
+    return statement.replace('?', '%s')
+
+
+def list_tables(conn):
+    """Application tables, leaving out sqlite internals and FTS virtual/shadow tables"""
+    cursor = conn.cursor()
+    if dialect_of(conn) == 'postgresql':
+        cursor.execute(
+            "SELECT table_name FROM information_schema.tables "
+            "WHERE table_schema = current_schema() AND table_type = 'BASE TABLE' ORDER BY table_name"
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table' ORDER BY name;")
+    tables = cursor.fetchall()
+    virtual = [name for name, ddl in tables if (ddl or '').upper().startswith('CREATE VIRTUAL TABLE')]
+    return [name for name, ddl in tables
+            if name not in virtual
+            and not name.startswith('sqlite_')
+            and not any(name.startswith(v + '_') for v in virtual)]
+
+
+def table_exists(conn, table_name):
+    cursor = conn.cursor()
+    if dialect_of(conn) == 'postgresql':
+        cursor.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = current_schema() AND table_name = %s",
+            (table_name,)
+        )
+    else:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;", (table_name,))
+    return cursor.fetchone() is not None
+
+
+def table_info(conn, table_name):
+    """(column name, declared type, is primary key) for each column of a table"""
+    cursor = conn.cursor()
+    if dialect_of(conn) == 'postgresql':
+        cursor.execute("""
+            SELECT c.column_name, c.data_type, k.column_name IS NOT NULL
+            FROM information_schema.columns c
+            LEFT JOIN information_schema.table_constraints tc
+                ON tc.table_schema = c.table_schema AND tc.table_name = c.table_name
+                AND tc.constraint_type = 'PRIMARY KEY'
+            LEFT JOIN information_schema.key_column_usage k
+                ON k.constraint_name = tc.constraint_name AND k.table_schema = tc.table_schema
+                AND k.column_name = c.column_name
+            WHERE c.table_schema = current_schema() AND c.table_name = %s
+            ORDER BY c.ordinal_position
+        """, (table_name,))
+        return [(name, data_type, bool(is_key)) for name, data_type, is_key in cursor.fetchall()]
+
+    cursor.execute(f"PRAGMA table_info({table_name});")
+    return [(col[1], col[2], bool(col[5])) for col in cursor.fetchall()]
+
+
+def primary_key_column(conn, table_name):
+    """The single integer primary key column of a table, or None"""
+    keys = [(name, (declared_type or '').upper()) for name, declared_type, is_key in table_info(conn, table_name)
+            if is_key]
+    if len(keys) != 1:
+        return None
+    name, declared_type = keys[0]
+    if dialect_of(conn) == 'sqlite':
+        # Only INTEGER PRIMARY KEY is an alias of the rowid
+        return name if declared_type == 'INTEGER' else None
+    return name if 'INT' in declared_type else None
+
+
+def row_key(conn, table_name):
+    """Column that orders a table's rows for keyset paging"""
+    key = primary_key_column(conn, table_name)
+    if key:
+        return key
+    # Every SQLite table without WITHOUT ROWID has one
+    if dialect_of(conn) == 'sqlite':
+        return 'rowid'
+    # PostgreSQL: a single-column key of another type (e.g. text), else the first column
+    columns = table_info(conn, table_name)
+    keys = [name for name, declared_type, is_key in columns if is_key]
+    return keys[0] if len(keys) == 1 else columns[0][0]
+
+
+def server_cursor(conn, name='stream'):
+    """A cursor that streams large results: server-side on PostgreSQL"""
+    if dialect_of(conn) == 'postgresql':
+        return conn.cursor(name=name)
+    return conn.cursor()
+
+
+# ================================
+# SQLALCHEMY ENGINE PROFILE
+# ================================
+
+def normalize_url(database_url):
+    """postgres:// (DigitalOcean, Heroku) to postgresql://, with the psycopg2 driver named
+
+    requirements-postgres.txt installs psycopg2, while newer SQLAlchemy
+    releases default plain postgresql:// URLs to psycopg 3.
+    """
+    if database_url.startswith('postgres://'):
+        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+    if database_url.startswith('postgresql://'):
+        database_url = database_url.replace('postgresql://', 'postgresql+psycopg2://', 1)
+    return database_url
+
+
+def sqlite_path(database_url):
+    """File path of a sqlite:/// URL, or None for other databases"""
+    from sqlalchemy.engine import make_url
+    url = make_url(database_url)
+    if url.get_backend_name() != 'sqlite':
+        return None
+    return url.database
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URL: a tuned pool on server databases"""
+    from sqlalchemy.engine import make_url
+    if make_url(database_url).get_backend_name() == 'sqlite':
+        return {}
+    return dict(POOL_SETTINGS)
+
+
+_engine_state = {'pragmas': None, 'last_optimize': None, 'optimizer': None}
+
+
+def configure_engine(engine, pragmas=None):
+    """Apply the SQLite pragmas to every connection the engine opens
+
+    Must run before the engine's first connection. Returns False for other databases.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    from sqlalchemy import event
+
+    pragmas = pragmas or SQLITE_PRAGMAS
+    _engine_state['pragmas'] = pragmas
+
+    @event.listens_for(engine, 'connect')
+    def _apply_engine_pragmas(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+    return True
+
+
+def optimize(engine, full=False):
+    """PRAGMA optimize (or a full ANALYZE) so the planner statistics follow the data"""
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        conn.exec_driver_sql("ANALYZE" if full else "PRAGMA optimize")
+        conn.commit()
+    _engine_state['last_optimize'] = datetime.now()
+
+
+def start_optimizer(engine, interval=OPTIMIZE_INTERVAL):
+    """Run optimize() every `interval` seconds in a background thread"""
+    if engine.dialect.name != 'sqlite' or interval <= 0 or _engine_state['optimizer']:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                optimize(engine)
+            except Exception as e:
+                print(f"⚠️ PRAGMA optimize failed: {e}")
+
+    _engine_state['optimizer'] = threading.Thread(target=run, name='sqlite-optimize', daemon=True)
+    _engine_state['optimizer'].start()
+
+
+def engine_settings(engine):
+    """The profile the engine was configured with next to the values a live connection reports"""
+    settings = {
+        'dialect': engine.dialect.name,
+        'pool': type(engine.pool).__name__,
+    }
+    if engine.dialect.name != 'sqlite':
+        pool = engine.pool
+        settings.update({
+            'configured': POOL_SETTINGS,
+            'active': {
+                'size': pool.size() if hasattr(pool, 'size') else None,
+                'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+                'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+            },
+        })
+        return settings
+
+    configured = _engine_state['pragmas'] or {}
+    with engine.connect() as conn:
+        active = {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in SQLITE_PRAGMAS}
+    last_optimize = _engine_state['last_optimize']
+    settings.update({
+        'configured': configured,
+        'active': active,
+        'optimize_interval': OPTIMIZE_INTERVAL,
+        'analysis_limit': ANALYSIS_LIMIT,
+        'last_optimize': last_optimize.strftime('%Y-%m-%d %H:%M:%S') if last_optimize else None,
+    })
+    return settings
+
+
+def main():
+    """Command line interface for the database profile"""
+    import sys
+    from app import app
+    from models import db
+    # The module app.py configured (this file runs as __main__)
+    import db_connections
+
+    command = sys.argv[1].lower() if len(sys.argv) > 1 else ''
+    with app.app_context():
+        if command == 'show':
+            for name, value in db_connections.engine_settings(db.engine).items():
+                print(f"  {name}: {value}")
+        elif command in ('optimize', 'analyze'):
+            if db.engine.dialect.name != 'sqlite':
+                print("❌ Only needed for SQLite databases")
+                return
+            db_connections.optimize(db.engine, full=command == 'analyze')
+            print(f"✅ {'ANALYZE' if command == 'analyze' else 'PRAGMA optimize'} completed")
+        else:
+            print("🔧 Database Profile")
+            print("\nUsage:")
+            print("  python db_connections.py show       - Show configured and active settings")
+            print("  python db_connections.py optimize   - Run PRAGMA optimize now")
+            print("  python db_connections.py analyze    - Rebuild all planner statistics (ANALYZE)")
+
+
+if __name__ == '__main__':
+    main()
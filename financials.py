@@ -0,0 +1,118 @@
+"""
+Financial aggregation for the overview dashboards
+Computes per-patient totals with grouped queries and reads doctor commissions
+from the commission ledger
+"""
+
+from sqlalchemy import func, or_
+from models import db, Patient, Test, PatientTest, PatientBill, Doctor
+import commission_ledger
+
+
+class FinancialOverview:
+    """Per-patient totals, collections and doctor commissions for the whole lab"""
+
+    def __init__(self):
+        self.patients = []
+        self.bills = []
+        self.patient_financial_data = []
+        self.doctor_commission_summary = {}
+        self.summary_stats = {}
+
+    def _doctor_summary(self, doctor, doctor_totals):
+        """Summary entry for a doctor, seeded from the ledger totals"""
+        if doctor.name not in self.doctor_commission_summary:
+            totals = doctor_totals.get(doctor.id, {'pending': 0.0, 'paid': 0.0})
+            self.doctor_commission_summary[doctor.name] = {
+                'doctor': doctor,
+                'total_commission': totals['pending'] + totals['paid'],
+                'pending_commission': totals['pending'],
+                'paid_commission': totals['paid'],
+                'patient_count': 0
+            }
+        return self.doctor_commission_summary[doctor.name]
+
+    def load(self):
+        """Run the grouped queries and build the summary (a constant number of queries)"""
+        self.patients = Patient.query.order_by(Patient.id).all()
+        doctors = {d.id: d for d in Doctor.query.all()}
+
+        # One bill per patient - keep the oldest one, matching filter_by(...).first()
+        self.bills = PatientBill.query.order_by(PatientBill.id).all()
+        bills_by_patient = {}
+        for bill in self.bills:
+            bills_by_patient.setdefault(bill.patient_id, bill)
+
+        # Test count and total cost per patient in a single grouped query;
+        # cancelled tests are not billed (see billing.billable_total)
+        test_totals = dict(
+            (row.patient_id, (row.test_count, row.test_total or 0.0))
+            for row in db.session.query(
+                PatientTest.patient_id,
+                func.count(PatientTest.id).label('test_count'),
+                func.sum(Test.cost).label('test_total')
+            ).join(Test, PatientTest.test_id == Test.id).filter(
+                or_(PatientTest.status.is_(None), PatientTest.status != 'Cancelled')
+            ).group_by(PatientTest.patient_id)
+        )
+
+        # Pre-summed commissions from the ledger
+        doctor_totals = commission_ledger.doctor_totals()
+        patient_commissions = commission_ledger.patient_totals()
+        for doctor_id in doctor_totals:
+            doctor = doctors.get(doctor_id)
+            if doctor and doctor.is_active:
+                self._doctor_summary(doctor, doctor_totals)
+
+        total_revenue = 0
+        total_collected = 0
+        total_pending = 0
+        total_doctor_commissions = 0
+
+        for patient in self.patients:
+            test_count, patient_total = test_totals.get(patient.id, (0, 0.0))
+            patient_bill = bills_by_patient.get(patient.id)
+            patient_paid = patient_bill.paid_amount if patient_bill else 0
+            patient_pending = patient_total - patient_paid
+
+            patient_doctor_commission = patient_commissions.get(patient.id, 0.0)
+            doctor = doctors.get(patient.referring_doctor_id)
+            if doctor and doctor.is_active:
+                self._doctor_summary(doctor, doctor_totals)['patient_count'] += 1
+
+            self.patient_financial_data.append({
+                'patient': patient,
+                'total_amount': patient_total,
+                'paid_amount': patient_paid,
+                'pending_amount': patient_pending,
+                'doctor_commission': patient_doctor_commission,
+                'test_count': test_count,
+                'bill': patient_bill
+            })
+
+            total_revenue += patient_total
+            total_collected += patient_paid
+            total_pending += patient_pending
+            total_doctor_commissions += patient_doctor_commission
+
+        # Net revenue after doctor commissions
+        net_revenue = total_revenue - total_doctor_commissions
+        net_collected = total_collected - total_doctor_commissions  # Assuming commissions paid when collected
+
+        self.summary_stats = {
+            'total_revenue': total_revenue,
+            'total_collected': total_collected,
+            'total_pending': total_pending,
+            'total_doctor_commissions': total_doctor_commissions,
+            'net_revenue': net_revenue,
+            'net_collected': net_collected,
+            'collection_percentage': (total_collected / total_revenue * 100) if total_revenue > 0 else 0,
+            'total_patients': len(self.patients),
+            'patients_with_pending': len([p for p in self.patient_financial_data if p['pending_amount'] > 0])
+        }
+        return self
+
+
+def build_financial_overview():
+    """Build the financial overview shared by /financial_overview and /payment_overview"""
+    return FinancialOverview().load()
@@ -2,6 +2,42 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, IntegerField, SelectField, TextAreaField, DateField, FloatField, SubmitField, BooleanField, DecimalField
 from wtforms.validators import DataRequired, Email, Optional, NumberRange, Length, Regexp, ValidationError
 import re
+from models import db, Patient
+
+class PatientField(SelectField):
+    """Patient select filled by the type-ahead picker (/api/patients/picker)
+
+    Only the chosen patient is rendered as an option, and validation looks up
+    that one id instead of loading every patient into the choices.
+    """
+
+    def __init__(self, label=None, validators=None, placeholder='Search patient by name, phone or ID', **kwargs):
+        kwargs.setdefault('coerce', int)
+        render_kw = dict(kwargs.pop('render_kw', None) or {})
+        render_kw.setdefault('data-patient-picker', '')
+        super().__init__(label, validators, render_kw=render_kw, **kwargs)
+        self.placeholder = placeholder
+        self._patient = None
+
+    @property
+    def patient(self):
+        """The chosen patient, or None"""
+        if not self.data:
+            return None
+        if self._patient is None or self._patient.id != self.data:
+            self._patient = db.session.get(Patient, self.data)
+        return self._patient
+
+    def iter_choices(self):
+        patient = self.patient
+        self.choices = [(0, self.placeholder)]
+        if patient:
+            self.choices.append((patient.id, f"{patient.full_name} (ID: {patient.id})"))
+        return super().iter_choices()
+
+    def pre_validate(self, form):
+        if self.data and self.patient is None:
+            raise ValidationError('Patient not found')
 
 class PatientForm(FlaskForm):
     title = SelectField('Title', choices=[
@@ -67,7 +103,7 @@ class TestForm(FlaskForm):
             raise ValidationError('Cost seems unusually high. Please verify.')
 
 class PatientTestForm(FlaskForm):
-    patient_id = SelectField('Patient', coerce=int, validators=[DataRequired()])
+    patient_id = PatientField('Patient', validators=[DataRequired()])
     test_id = SelectField('Test', coerce=int, validators=[DataRequired()])
     date_ordered = DateField('Date Ordered', validators=[Optional()])
     results = TextAreaField('Results', validators=[Optional()])
@@ -81,14 +117,14 @@ class PatientTestForm(FlaskForm):
     submit = SubmitField('Assign Test')
 
 class MultipleTestAssignmentForm(FlaskForm):
-    patient_id = SelectField('Patient', coerce=int, validators=[DataRequired()])
+    patient_id = PatientField('Patient', validators=[DataRequired()])
     date_ordered = DateField('Date Ordered', validators=[Optional()])
     sample_collector = SelectField('Sample Collector', choices=[], validators=[Optional()])
     notes = TextAreaField('General Notes', validators=[Optional()])
     submit = SubmitField('Assign All Tests')
 
 class PaymentForm(FlaskForm):
-    patient_id = SelectField('Patient', coerce=int, validators=[DataRequired()])
+    patient_id = PatientField('Patient', validators=[DataRequired()])
     amount = FloatField('Payment Amount', validators=[DataRequired(), NumberRange(min=0.01)])
     payment_type = SelectField('Payment Type', choices=[
         ('advance', 'Advance Payment'),
@@ -108,7 +144,7 @@ class PaymentForm(FlaskForm):
     submit = SubmitField('Record Payment')
 
 class BillForm(FlaskForm):
-    patient_id = SelectField('Patient', coerce=int, validators=[DataRequired()])
+    patient_id = PatientField('Patient', validators=[DataRequired()])
     discount_percentage = FloatField('Discount %', validators=[Optional(), NumberRange(min=0, max=100)], default=0)
     discount_amount = FloatField('Discount Amount', validators=[Optional(), NumberRange(min=0)], default=0)
     due_date = DateField('Due Date', validators=[Optional()])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Database migration script to add the sample barcode column to patient_test
+Works against the configured database (SQLite or PostgreSQL via DATABASE_URL)
+"""
+
+from sqlalchemy import inspect, text
+
+def add_barcode_column(engine):
+    """Add the barcode column and its index to an existing patient_test table
+
+    Also run by init_database() on startup, since every patient_test query
+    selects the column. Returns False when there is no patient_test table.
+    """
+    from models import PatientTest
+
+    inspector = inspect(engine)
+    if 'patient_test' not in inspector.get_table_names():
+        print("❌ Patient test table not found!")
+        return False
+
+    # Check if barcode column already exists
+    columns = [column['name'] for column in inspector.get_columns('patient_test')]
+
+    if 'barcode' in columns:
+        print("✅ Barcode column already exists!")
+    else:
+        print("🔄 Adding barcode column to patient_test table...")
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE patient_test ADD COLUMN barcode VARCHAR(50)"))
+        print("✅ Successfully added barcode column to patient_test table!")
+
+    # Analyzer uploads look results up by barcode
+    indexes = {index['name'] for index in inspector.get_indexes('patient_test')}
+    if 'ix_patient_test_barcode' not in indexes:
+        print("🔄 Creating ix_patient_test_barcode...")
+        barcode_index = next(i for i in PatientTest.__table__.indexes if i.name == 'ix_patient_test_barcode')
+        barcode_index.create(bind=engine)
+        print("✅ Barcode index created!")
+
+    return True
+
+def migrate_database():
+    """Add barcode column and its index to patient_test table"""
+    try:
+        from app import app
+        from models import db
+
+        with app.app_context():
+            return add_barcode_column(db.engine)
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🚀 Starting database migration...")
+    success = migrate_database()
+    if success:
+        print("🎉 Migration completed successfully!")
+    else:
+        print("💥 Migration failed!")
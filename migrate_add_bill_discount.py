@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Database migration script to add the discount type and value columns to patient_bill
+Works against the configured database (SQLite or PostgreSQL via DATABASE_URL)
+"""
+
+from sqlalchemy import inspect, text
+
+def add_discount_columns(engine):
+    """Add discount_type and discount_value to an existing patient_bill table
+
+    Also run by init_database() on startup, since every bill query selects
+    the columns. Bills from before them keep their discount amount.
+    Returns False when there is no patient_bill table.
+    """
+    inspector = inspect(engine)
+    if 'patient_bill' not in inspector.get_table_names():
+        print("❌ Patient bill table not found!")
+        return False
+
+    columns = [column['name'] for column in inspector.get_columns('patient_bill')]
+    missing = [(name, ddl) for name, ddl in (('discount_type', 'VARCHAR(20)'), ('discount_value', 'FLOAT'))
+               if name not in columns]
+
+    if not missing:
+        print("✅ Discount columns already exist!")
+        return True
+
+    with engine.begin() as conn:
+        for name, ddl in missing:
+            print(f"🔄 Adding {name} column to patient_bill table...")
+            conn.execute(text(f"ALTER TABLE patient_bill ADD COLUMN {name} {ddl}"))
+    print("✅ Successfully added discount columns to patient_bill table!")
+    return True
+
+def migrate_database():
+    """Add discount type and value columns to patient_bill table"""
+    try:
+        from app import app
+        from models import db
+
+        with app.app_context():
+            return add_discount_columns(db.engine)
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🚀 Starting database migration...")
+    success = migrate_database()
+    if success:
+        print("🎉 Migration completed successfully!")
+    else:
+        print("💥 Migration failed!")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Database migration script to add the hot-path indexes declared in models.py
+Works against the configured database (SQLite or PostgreSQL via DATABASE_URL)
+"""
+
+from sqlalchemy import inspect
+
+def migrate_database():
+    """Create every index declared on the models that the database is missing"""
+    try:
+        from app import app
+        from models import db
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+            existing_tables = set(inspector.get_table_names())
+
+            created = 0
+            for table in db.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    print(f"⚠️ Table {table.name} not found, skipping")
+                    continue
+
+                existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in sorted(table.indexes, key=lambda i: i.name):
+                    if index.name in existing:
+                        continue
+                    if index.unique:
+                        # Existing rows may violate it - needs its own data migration
+                        print(f"⚠️ Skipping unique index {index.name} (see migrate_unique_patient_bill.py)")
+                        continue
+                    columns = ', '.join(column.name for column in index.columns)
+                    print(f"🔄 Creating {index.name} on {table.name} ({columns})...")
+                    index.create(bind=db.engine)
+                    created += 1
+
+            if created == 0:
+                print("✅ All indexes already exist!")
+            else:
+                print(f"✅ Successfully created {created} indexes!")
+
+            # Refresh planner statistics so the new indexes get used
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql("ANALYZE")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🚀 Starting database migration...")
+    success = migrate_database()
+    if success:
+        print("🎉 Migration completed successfully!")
+    else:
+        print("💥 Migration failed!")
@@ -1,45 +1,39 @@
 #!/usr/bin/env python3
 """
 Database migration script to add unit column to test table
+Works against the configured database (SQLite or PostgreSQL via DATABASE_URL)
 """
 
-import sqlite3
-import os
+from sqlalchemy import inspect, text
 
 def migrate_database():
     """Add unit column to test table"""
-    db_path = 'data/pathology.db'
-    
-    if not os.path.exists(db_path):
-        print("❌ Database file not found!")
-        return False
-    
     try:
-        # Connect to database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Check if unit column already exists
-        cursor.execute("PRAGMA table_info(test)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'unit' in columns:
-            print("✅ Unit column already exists!")
-            conn.close()
-            return True
-        
-        print("🔄 Adding unit column to test table...")
-        
-        # Add unit column
-        cursor.execute("ALTER TABLE test ADD COLUMN unit VARCHAR(50)")
-        
-        # Commit changes
-        conn.commit()
-        conn.close()
-        
+        from app import app
+        from models import db
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+            if 'test' not in inspector.get_table_names():
+                print("❌ Test table not found!")
+                return False
+
+            # Check if unit column already exists
+            columns = [column['name'] for column in inspector.get_columns('test')]
+
+            if 'unit' in columns:
+                print("✅ Unit column already exists!")
+                return True
+
+            print("🔄 Adding unit column to test table...")
+
+            # Add unit column
+            with db.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE test ADD COLUMN unit VARCHAR(50)"))
+
         print("✅ Successfully added unit column to test table!")
         return True
-        
+
     except Exception as e:
         print(f"❌ Error during migration: {e}")
         return False
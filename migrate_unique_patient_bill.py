@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Database migration script to enforce one bill per patient
+Merges duplicate patient_bill rows and adds the unique index on patient_id
+Works against the configured database (SQLite or PostgreSQL via DATABASE_URL)
+"""
+
+from sqlalchemy import inspect, select, update, delete, func
+
+def merge_duplicate_bills(db):
+    """Collapse each patient's duplicate bills into the oldest one"""
+    from models import Payment, PatientBill
+    import billing
+
+    bills = PatientBill.__table__
+    duplicates = db.session.execute(
+        select(bills.c.patient_id).group_by(bills.c.patient_id).having(func.count(bills.c.id) > 1)
+    ).scalars().all()
+
+    for patient_id in duplicates:
+        rows = db.session.execute(
+            select(bills).where(bills.c.patient_id == patient_id).order_by(bills.c.id)
+        ).all()
+        keep = rows[0]
+
+        # Duplicates come from racing requests, so their own totals overlap -
+        # rebuild the surviving bill from the tests and payments on record
+        total_amount = billing.billable_total(patient_id)
+        paid_amount = db.session.query(func.coalesce(func.sum(Payment.amount), 0.0)).filter(
+            Payment.patient_id == patient_id
+        ).scalar()
+        discount_amount = min(max(row.discount_amount for row in rows), total_amount)
+        final_amount = total_amount - discount_amount
+        remaining_amount = max(0, final_amount - paid_amount)
+
+        if paid_amount >= final_amount and (final_amount > 0 or paid_amount > 0):
+            bill_status = 'paid'
+        elif paid_amount > 0:
+            bill_status = 'partial'
+        else:
+            bill_status = 'pending'
+
+        db.session.execute(
+            update(bills).where(bills.c.id == keep.id).values(
+                total_amount=total_amount,
+                paid_amount=paid_amount,
+                remaining_amount=remaining_amount,
+                discount_amount=discount_amount,
+                discount_percentage=(discount_amount / total_amount * 100) if total_amount > 0 else 0,
+                bill_status=bill_status
+            )
+        )
+        db.session.execute(delete(bills).where(bills.c.patient_id == patient_id, bills.c.id != keep.id))
+        print(f"🔄 Merged {len(rows)} bills for patient {patient_id} into bill #{keep.id}")
+
+    db.session.commit()
+    return len(duplicates)
+
+def migrate_database():
+    """Merge duplicate bills and add the unique patient_id index"""
+    try:
+        from app import app
+        from models import db, PatientBill
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+            if 'patient_bill' not in inspector.get_table_names():
+                print("❌ patient_bill table not found!")
+                return False
+
+            existing = {index['name']: index for index in inspector.get_indexes('patient_bill')}
+            if 'uq_patient_bill_patient_id' in existing:
+                print("✅ Unique patient bill index already exists!")
+                return True
+
+            merged = merge_duplicate_bills(db)
+            if merged == 0:
+                print("✅ No duplicate bills found")
+
+            print("🔄 Adding unique index on patient_bill.patient_id...")
+            with db.engine.begin() as conn:
+                # Replaced by the unique index
+                if 'ix_patient_bill_patient_id' in existing:
+                    conn.exec_driver_sql("DROP INDEX ix_patient_bill_patient_id")
+            for index in PatientBill.__table__.indexes:
+                if index.name == 'uq_patient_bill_patient_id':
+                    index.create(bind=db.engine)
+
+            print("✅ Successfully added unique index on patient_bill.patient_id!")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🚀 Starting database migration...")
+    success = migrate_database()
+    if success:
+        print("🎉 Migration completed successfully!")
+    else:
+        print("💥 Migration failed!")
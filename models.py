@@ -1,7 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from datetime import datetime
+from read_replica import RoutingSession
 
-db = SQLAlchemy()
+# Reads of @use_replica routes may go to the read replica (see read_replica.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -19,6 +22,12 @@ class Patient(db.Model):
     collected_by = db.Column(db.String(100), nullable=True)
     referring_doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=True)  # New foreign key
     date_registered = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_patient_phone', 'phone'),
+        db.Index('ix_patient_referring_doctor_id', 'referring_doctor_id'),
+        db.Index('ix_patient_date_registered', 'date_registered', 'id'),  # Keyset pagination
+    )
     
     # Relationships
     patient_tests = db.relationship('PatientTest', backref='patient', lazy=True)
@@ -59,6 +68,16 @@ class PatientTest(db.Model):
     status = db.Column(db.String(20), default='Pending')  # Pending, Completed, Cancelled
     notes = db.Column(db.Text, nullable=True)
     sample_collector = db.Column(db.String(100), nullable=True)
+    barcode = db.Column(db.String(50), nullable=True)  # Sample barcode scanned at registration
+
+    __table_args__ = (
+        db.Index('ix_patient_test_patient_status', 'patient_id', 'status'),
+        db.Index('ix_patient_test_test_id', 'test_id'),
+        db.Index('ix_patient_test_status_date_ordered', 'status', 'date_ordered'),
+        db.Index('ix_patient_test_status_date_completed', 'status', 'date_completed'),
+        db.Index('ix_patient_test_date_ordered', 'date_ordered', 'id'),  # Keyset pagination
+        db.Index('ix_patient_test_barcode', 'barcode'),  # Analyzer result uploads
+    )
     
     def __repr__(self):
         return f'<PatientTest {self.patient.full_name} - {self.test.name}>'
@@ -128,6 +147,12 @@ class DoctorCommission(db.Model):
     date_paid = db.Column(db.DateTime, nullable=True)
     payment_notes = db.Column(db.Text, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_doctor_commission_doctor_status', 'doctor_id', 'status'),
+        db.Index('ix_doctor_commission_patient_id', 'patient_id'),
+        db.Index('ix_doctor_commission_patient_test_id', 'patient_test_id'),
+    )
+
     # Relationships
     doctor = db.relationship('Doctor', backref='commissions')
     patient = db.relationship('Patient', backref='doctor_commissions')
@@ -147,6 +172,11 @@ class Payment(db.Model):
     notes = db.Column(db.Text, nullable=True)
     created_by = db.Column(db.String(100), nullable=True)  # Staff member who recorded payment
 
+    __table_args__ = (
+        db.Index('ix_payment_patient_date', 'patient_id', 'payment_date'),
+        db.Index('ix_payment_payment_date', 'payment_date', 'id'),  # Keyset pagination
+    )
+
     # Relationship
     patient = db.relationship('Patient', backref=db.backref('payments', lazy=True))
 
@@ -161,10 +191,18 @@ class PatientBill(db.Model):
     remaining_amount = db.Column(db.Float, nullable=False, default=0.0)
     discount_amount = db.Column(db.Float, nullable=False, default=0.0)
     discount_percentage = db.Column(db.Float, nullable=False, default=0.0)
+    # The discount as entered, re-applied when the bill is repriced; None on older bills
+    discount_type = db.Column(db.String(20), nullable=True)  # 'percentage', 'amount'
+    discount_value = db.Column(db.Float, nullable=True)
     bill_date = db.Column(db.DateTime, default=datetime.utcnow)
     bill_status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'partial', 'paid', 'overdue'
     due_date = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (
+        db.Index('uq_patient_bill_patient_id', 'patient_id', unique=True),  # One bill per patient
+        db.Index('ix_patient_bill_remaining_amount', 'remaining_amount'),
+    )
+
     # Relationship
     patient = db.relationship('Patient', backref=db.backref('bills', lazy=True))
 
@@ -183,3 +221,21 @@ class PatientBill(db.Model):
 
     def __repr__(self):
         return f'<PatientBill {self.total_amount} for Patient {self.patient_id}>'
+
+class CacheVersion(db.Model):
+    """Version counter of a per-process cache, bumped whenever the cached data changes"""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name} v{self.version}>'
+
+# The session hooks (bills, commission ledger, dashboard counters) compare old
+# and new values. Setting one of these on an object expired by a commit would
+# record no old value, so load it first.
+def _load_old_value(target, value, oldvalue, initiator):
+    pass
+
+for _attribute in (PatientTest.status, PatientTest.patient_id, Payment.amount):
+    event.listen(_attribute, 'set', _load_old_value, active_history=True)
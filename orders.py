@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test order service
+Assigns a set of tests to a patient in a fixed number of statements however
+many tests the order has: the requested tests are resolved from the cached
+catalog, the patient_test rows are written with one bulk INSERT, and the bill,
+the commission ledger and the dashboard counters are brought up to date once
+for the whole order.
+"""
+
+from datetime import datetime
+from sqlalchemy import insert
+from models import db, PatientTest
+import billing
+import catalog_cache
+import commission_ledger
+import dashboard_counters
+
+
+class OrderError(Exception):
+    """An order that cannot be placed as requested"""
+
+
+class OrderResult:
+    """What an order created: the new patient_test ids and the cost of the tests"""
+
+    def __init__(self, patient_test_ids, tests):
+        self.patient_test_ids = patient_test_ids
+        self.tests = tests
+
+    @property
+    def total_cost(self):
+        return sum(test.cost or 0 for test in self.tests)
+
+    def __len__(self):
+        return len(self.patient_test_ids)
+
+
+def _parse_ids(test_ids):
+    ids = []
+    for test_id in test_ids:
+        try:
+            ids.append(int(test_id))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+def resolve_tests(test_ids):
+    """The catalog entries for `test_ids`, in request order, unknown ids left out"""
+    catalog = catalog_cache.get_catalog()
+    return [catalog.by_id[test_id] for test_id in _parse_ids(test_ids) if test_id in catalog.by_id]
+
+
+def resolve_selection(selected):
+    """Catalog tests for the registration form's [{'id':...}] (or {'name':...}) selection
+
+    Prices always come from the catalog. Raises OrderError for a test that is
+    not in it.
+    """
+    catalog = catalog_cache.get_catalog()
+    tests = []
+    for entry in selected:
+        test = catalog.get(entry.get('id')) if entry.get('id') is not None else catalog.find(entry.get('name'))
+        if test is None:
+            raise OrderError(f"Unknown test: {entry.get('name') or entry.get('id')}")
+        tests.append(test)
+    return tests
+
+
+def create_order(patient_id, test_ids, date_ordered=None, sample_collector=None, notes=None, barcode=None):
+    """Assign the tests `test_ids` to the patient; the caller commits
+
+    Returns an OrderResult. Unknown test ids are skipped. The rows are
+    inserted in one statement, which bypasses the session's flush hooks, so
+    the bill, ledger and counter updates they would make are made here.
+    """
+    tests = resolve_tests(test_ids)
+    if not tests:
+        return OrderResult([], [])
+
+    date_ordered = date_ordered or datetime.utcnow()
+    rows = [{
+        'patient_id': patient_id,
+        'test_id': test.id,
+        'date_ordered': date_ordered,
+        'status': 'Pending',
+        'notes': notes,
+        'sample_collector': sample_collector or None,
+        'barcode': barcode or None,
+    } for test in tests]
+    patient_test_ids = list(db.session.scalars(insert(PatientTest).returning(PatientTest.id), rows))
+
+    connection = db.session.connection()
+    billing.refresh_totals(connection, [patient_id])
+    commission_ledger.sync(connection, patient_test_ids=patient_test_ids)
+    dashboard_counters.tests_assigned(len(patient_test_ids))
+    return OrderResult(patient_test_ids, tests)
@@ -0,0 +1,180 @@
+"""
+Keyset (seek) pagination for list pages
+Pages through ordered queries with opaque cursors on (sort column, id) so that
+every page costs the same index seek no matter how deep it is
+"""
+
+import base64
+import json
+from datetime import datetime, date
+from flask import request, url_for
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+def _typed_payload(value):
+    # JSON has no dates - tag them so they decode to the type they were
+    if isinstance(value, datetime):
+        return {'t': 'dt', 'v': value.isoformat()}
+    if isinstance(value, date):
+        return {'t': 'd', 'v': value.isoformat()}
+    return {'t': 'raw', 'v': value}
+
+
+def _typed_value(payload):
+    value = payload.get('v')
+    if payload.get('t') == 'dt':
+        return datetime.fromisoformat(value)
+    if payload.get('t') == 'd':
+        return date.fromisoformat(value)
+    return value
+
+
+def _encode(payload):
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode(token):
+    padded = token + '=' * (-len(token) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+
+
+def encode_cursor(sort_value, row_id):
+    """Encode a (sort value, id) position as a URL-safe token"""
+    return _encode({**_typed_payload(sort_value), 'id': row_id})
+
+
+def decode_cursor(token):
+    """Decode a cursor token back into (sort value, id), or None if it is invalid"""
+    if not token:
+        return None
+    try:
+        payload = _decode(token)
+        return _typed_value(payload), int(payload['id'])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+def encode_key_cursor(key):
+    """Encode a position on a unique key alone (any JSON type or date) as a URL-safe token"""
+    return _encode(_typed_payload(key))
+
+
+def decode_key_cursor(token):
+    """Decode a key cursor back into the key with its original type, or None if it is invalid"""
+    if not token:
+        return None
+    try:
+        payload = _decode(token)
+        if 'id' in payload:
+            return None
+        return _typed_value(payload)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+def get_per_page(default=DEFAULT_PER_PAGE):
+    """Page size from the request, clamped to the allowed range"""
+    try:
+        per_page = int(request.args.get('per_page', default))
+    except (TypeError, ValueError):
+        per_page = default
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+class KeysetPage:
+    """One page of results with cursors to its neighbours"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def _url(self, **cursor):
+        # Keep every existing filter, swap only the cursor arguments
+        args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+        args.update(cursor)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.has_next else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_cursor) if self.has_prev else None
+
+    @property
+    def first_url(self):
+        return self._url()
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate_keyset(query, sort_column, id_column, after=None, before=None,
+                    per_page=DEFAULT_PER_PAGE, descending=True):
+    """Return a KeysetPage of `query` ordered by (sort_column, id_column)
+
+    `after` / `before` are cursor tokens from a previous page. Rows with a NULL
+    sort value are not supported - the paged columns all have defaults.
+    """
+    def sort_key(item):
+        return getattr(item, sort_column.key), getattr(item, id_column.key)
+
+    def seek(position, forward):
+        value, row_id = position
+        # "forward" means further along the display order
+        if forward == descending:
+            return or_(sort_column < value, and_(sort_column == value, id_column < row_id))
+        return or_(sort_column > value, and_(sort_column == value, id_column > row_id))
+
+    def ordering(forward):
+        if forward == descending:
+            return sort_column.desc(), id_column.desc()
+        return sort_column.asc(), id_column.asc()
+
+    after_position = decode_cursor(after)
+    before_position = decode_cursor(before) if not after_position else None
+
+    if before_position:
+        # Walk backwards from the cursor, then flip back into display order
+        rows = query.filter(seek(before_position, False)).order_by(*ordering(False)).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        next_cursor = encode_cursor(*sort_key(items[-1])) if items else None
+        prev_cursor = encode_cursor(*sort_key(items[0])) if items and has_more else None
+        return KeysetPage(items, per_page, next_cursor, prev_cursor)
+
+    if after_position:
+        query = query.filter(seek(after_position, True))
+    rows = query.order_by(*ordering(True)).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    next_cursor = encode_cursor(*sort_key(items[-1])) if items and has_more else None
+    prev_cursor = encode_cursor(*sort_key(items[0])) if items and after_position else None
+    return KeysetPage(items, per_page, next_cursor, prev_cursor)
+
+
+def paginate_request(query, sort_column, id_column, descending=True, default_per_page=DEFAULT_PER_PAGE):
+    """Paginate `query` using the after/before/per_page arguments of the current request"""
+    return paginate_keyset(query, sort_column, id_column,
+                           after=request.args.get('after'),
+                           before=request.args.get('before'),
+                           per_page=get_per_page(default_per_page),
+                           descending=descending)
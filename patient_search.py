@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Indexed Patient Search
+Trigram search over patient names and phone numbers - an FTS5 table kept in
+sync by triggers on SQLite, pg_trgm GIN indexes on PostgreSQL - plus exact
+phone, phone suffix and patient id lookups for the type-ahead API
+"""
+
+import re
+from sqlalchemy import text, column, func, Integer, String, or_
+from models import db, Patient
+
+FTS_TABLE = 'patient_fts'
+MIN_TRIGRAM_LENGTH = 3
+MAX_RESULTS = 50
+# Longest digit string looked up as a patient id (fits a 64-bit INTEGER)
+MAX_ID_DIGITS = 18
+# Formatting the registration form allows in phone numbers besides digits
+PHONE_SEPARATORS = (' ', '-', '+', '(', ')')
+
+# Set by ensure_search_index(); None means "not checked yet"
+_index_available = None
+
+SQLITE_INDEX_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        first_name, last_name, phone,
+        content='patient', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_insert AFTER INSERT ON patient BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, first_name, last_name, phone)
+        VALUES (new.id, new.first_name, new.last_name, new.phone);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_delete AFTER DELETE ON patient BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, first_name, last_name, phone)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.phone);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_update AFTER UPDATE OF first_name, last_name, phone ON patient BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, first_name, last_name, phone)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.phone);
+        INSERT INTO {FTS_TABLE}(rowid, first_name, last_name, phone)
+        VALUES (new.id, new.first_name, new.last_name, new.phone);
+    END""",
+]
+
+POSTGRES_INDEX_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # One index per column, matching the per-column LIKE filters of _like_condition
+    "CREATE INDEX IF NOT EXISTS ix_patient_first_name_trgm ON patient USING gin (first_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_patient_last_name_trgm ON patient USING gin (last_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_patient_phone_trgm ON patient USING gin (phone gin_trgm_ops)",
+]
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def ensure_search_index(rebuild=False):
+    """Create the search index if needed; returns True when indexed search is available"""
+    global _index_available
+    try:
+        with db.engine.begin() as conn:
+            if _dialect() == 'sqlite':
+                # Triggers disappear with the patient table (e.g. drop_all), so their
+                # absence means the index content can no longer be trusted
+                in_sync = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='patient_fts_update'")
+                ).first()
+                for statement in SQLITE_INDEX_DDL:
+                    conn.execute(text(statement))
+                if rebuild or not in_sync:
+                    # Populate from the existing patient rows
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+            elif _dialect() == 'postgresql':
+                for statement in POSTGRES_INDEX_DDL:
+                    conn.execute(text(statement))
+            else:
+                _index_available = False
+                return False
+        _index_available = True
+    except Exception as e:
+        # e.g. SQLite built without FTS5/trigram or no permission for CREATE EXTENSION
+        print(f"⚠️ Patient search index unavailable, using LIKE search: {e}")
+        _index_available = False
+    return _index_available
+
+
+def index_available():
+    if _index_available is None:
+        ensure_search_index()
+    return _index_available
+
+
+def _terms(search):
+    return [term for term in re.split(r'\s+', search.strip()) if term]
+
+
+def _fts_query(terms):
+    """FTS5 query matching every term as a substring (terms shorter than a trigram are skipped)"""
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms if len(term) >= MIN_TRIGRAM_LENGTH]
+    return ' '.join(quoted)
+
+
+def _like_condition(term):
+    return or_(
+        Patient.first_name.contains(term),
+        Patient.last_name.contains(term),
+        Patient.phone.contains(term)
+    )
+
+
+def filter_query(query, search):
+    """Restrict a Patient query to rows matching `search` in name or phone"""
+    terms = _terms(search)
+    if not terms:
+        return query
+
+    if index_available() and _dialect() == 'sqlite':
+        fts = _fts_query(terms)
+        if fts:
+            matches = text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query") \
+                .bindparams(fts_query=fts).columns(column('rowid', Integer))
+            query = query.filter(Patient.id.in_(matches))
+        # Short terms are not covered by trigrams - check them on the narrowed set
+        for term in terms:
+            if len(term) < MIN_TRIGRAM_LENGTH:
+                query = query.filter(_like_condition(term))
+        return query
+
+    # PostgreSQL: the pg_trgm GIN indexes serve these LIKE '%term%' filters directly
+    for term in terms:
+        query = query.filter(_like_condition(term))
+    return query
+
+
+def _phone_digits():
+    """Patient.phone without its formatting, to compare with the digits of a search"""
+    digits = Patient.phone
+    for separator in PHONE_SEPARATORS:
+        digits = func.replace(digits, separator, '', type_=String)
+    return digits
+
+
+def patient_by_id(search):
+    """The patient whose id is exactly `search` (a plain digit string), or None"""
+    if not (search.isascii() and search.isdigit()) or len(search) > MAX_ID_DIGITS:
+        return None
+    return db.session.get(Patient, int(search))
+
+
+def search_patients(search, limit=10):
+    """Top matches for a type-ahead box as a list of (patient, match_type)
+
+    Ranking: patient id, exact phone, phone suffix, then name/phone substring
+    matches ordered by relevance.
+    """
+    limit = max(1, min(limit, MAX_RESULTS))
+    search = (search or '').strip()
+    if not search:
+        return []
+
+    results = []
+    seen = set()
+
+    def add(patients, match_type):
+        for patient in patients:
+            if patient.id not in seen and len(results) < limit:
+                seen.add(patient.id)
+                results.append((patient, match_type))
+
+    digits = re.sub(r'\D', '', search)
+    is_number = digits and re.fullmatch(r'[\d\s\-\+\(\)]+', search)
+
+    if is_number:
+        add(filter(None, [patient_by_id(search)]), 'id')
+        # Stored phones keep the formatting they were typed with ("98765 43210"),
+        # so both sides are compared as digits. The trigram index cannot narrow
+        # these matches (the digits need not be adjacent in the stored text),
+        # which costs a scan of the patient phones for numeric searches only.
+        add(Patient.query.filter(or_(Patient.phone == search, _phone_digits() == digits))
+            .limit(limit).all(), 'phone')
+        if len(digits) >= MIN_TRIGRAM_LENGTH:
+            add(Patient.query.filter(_phone_digits().endswith(digits))
+                .order_by(Patient.date_registered.desc()).limit(limit).all(), 'phone_suffix')
+
+    if len(results) < limit:
+        add(_ranked_matches(search, limit), 'name')
+    return results
+
+
+def picker_query(search):
+    """Patients for the paged patient picker as (exact id match or None, name/phone matches)
+
+    The matches are meant for keyset paging by registration date, so they are
+    not ranked; a patient whose id was typed is returned separately to be
+    listed first, and left out of the matches.
+    """
+    search = (search or '').strip()
+    if not search:
+        return None, Patient.query
+    query = filter_query(Patient.query, search)
+    exact = patient_by_id(search)
+    if exact is not None:
+        query = query.filter(Patient.id != exact.id)
+    return exact, query
+
+
+def _ranked_matches(search, limit):
+    """Substring matches on name and phone ordered by index relevance"""
+    terms = _terms(search)
+    dialect = _dialect()
+
+    if index_available() and dialect == 'sqlite':
+        fts = _fts_query(terms)
+        if fts:
+            rows = db.session.execute(
+                text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query "
+                     f"ORDER BY bm25({FTS_TABLE}) LIMIT :limit"),
+                {'fts_query': fts, 'limit': limit * 4}
+            ).fetchall()
+            ranked_ids = [row[0] for row in rows]
+            if not ranked_ids:
+                return []
+            query = Patient.query.filter(Patient.id.in_(ranked_ids))
+            for term in terms:
+                if len(term) < MIN_TRIGRAM_LENGTH:
+                    query = query.filter(_like_condition(term))
+            by_id = {patient.id: patient for patient in query.all()}
+            return [by_id[pid] for pid in ranked_ids if pid in by_id][:limit]
+
+    if index_available() and dialect == 'postgresql':
+        similarity = text("similarity(first_name || ' ' || last_name, :search_text) DESC") \
+            .bindparams(search_text=search)
+        return filter_query(Patient.query, search).order_by(similarity, Patient.id.desc()).limit(limit).all()
+
+    return filter_query(Patient.query, search).order_by(Patient.date_registered.desc()).limit(limit).all()
+
+
+def main():
+    """Command line interface for the patient search index"""
+    import sys
+    from app import app
+
+    command = sys.argv[1].lower() if len(sys.argv) > 1 else ''
+    with app.app_context():
+        if command == 'rebuild':
+            if ensure_search_index(rebuild=True):
+                print("✅ Patient search index rebuilt")
+        elif command == 'search' and len(sys.argv) > 2:
+            for patient, match_type in search_patients(' '.join(sys.argv[2:])):
+                print(f"  {patient.id:6d}  {patient.full_name:40s} {patient.phone:15s} ({match_type})")
+        else:
+            print("🔧 Patient Search Index")
+            print("\nUsage:")
+            print("  python patient_search.py rebuild         - Create/rebuild the search index")
+            print("  python patient_search.py search <text>   - Try a search from the command line")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,10 @@ Optimized for server deployment with proper security
 """
 
 from flask import Flask, render_template, jsonify, request, send_file, session, redirect, url_for, flash
-import sqlite3
+import db_connections
 import os
-import json
 from datetime import datetime
 import io
-import csv
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -47,12 +45,8 @@ class ProductionWebDatabaseViewer:
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
     
     def get_connection(self):
-        """Get database connection with timeout"""
-        if os.path.exists(self.db_path):
-            conn = sqlite3.connect(self.db_path, timeout=30.0)
-            conn.execute('PRAGMA journal_mode=WAL;')  # Better for concurrent access
-            return conn
-        return None
+        """Get a pooled database connection (close() releases it)"""
+        return db_connections.connect(self.db_path)
     
     def get_database_info(self):
         """Get database information"""
@@ -341,7 +335,7 @@ def api_export_table(table_name):
             return jsonify({"error": "Table not found"})
         
         # Get data
-        df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
+        df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn.raw)
         conn.close()
         
         # Create CSV
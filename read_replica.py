@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Read replica routing for reports and dashboards
+Routes marked with @use_replica send their SELECTs to REPLICA_DATABASE_URL -
+a PostgreSQL streaming replica or a SQLite snapshot of the primary file that
+is refreshed periodically (`python read_replica.py snapshot` from cron) - so
+month-end reports do not compete with registration and billing writes.
+
+The replica is only used while it is fresh: no more than REPLICA_MAX_LAG
+seconds behind the primary, and not older than the last write made from the
+same browser session (so a bill printed right after a payment shows it).
+Otherwise, or when the replica cannot be reached, everything reads from the
+primary. Writes (flushes, INSERT/UPDATE/DELETE, session.connection()) always
+go to the primary.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_request_context, session as browser_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+import db_connections
+
+# Replicas further behind the primary than this (seconds) are not used
+REPLICA_MAX_LAG = int(os.environ.get('REPLICA_MAX_LAG', 300))
+# How often the replica's lag is measured (seconds)
+REPLICA_CHECK_INTERVAL = int(os.environ.get('REPLICA_CHECK_INTERVAL', 10))
+# Refresh a SQLite snapshot replica from this process every N seconds (0: cron does it)
+REPLICA_SNAPSHOT_INTERVAL = int(os.environ.get('REPLICA_SNAPSHOT_INTERVAL', 0))
+
+# Read-only connections to a snapshot keep the read pragmas only
+SNAPSHOT_PRAGMAS = {name: db_connections.SQLITE_PRAGMAS[name] for name in ('cache_size', 'mmap_size', 'temp_store')}
+
+
+class ReplicaRouter:
+    """The replica engine of the application and whether it may be read right now"""
+
+    def __init__(self):
+        self.url = None
+        self.engine = None
+        self.max_lag = REPLICA_MAX_LAG
+        self._lock = threading.Lock()
+        self._checked_at = 0
+        self._as_of = None
+        self._error = None
+        self._snapshot_mtime = None
+
+    @property
+    def snapshot_path(self):
+        """File of a SQLite snapshot replica, or None"""
+        return db_connections.sqlite_path(self.url) if self.url else None
+
+    def init_app(self, app):
+        url = app.config.get('REPLICA_DATABASE_URL', os.environ.get('REPLICA_DATABASE_URL'))
+        self.max_lag = int(app.config.get('REPLICA_MAX_LAG', REPLICA_MAX_LAG))
+        if not url:
+            return
+        self.url = db_connections.normalize_url(url)
+
+        if self.snapshot_path:
+            path = self.snapshot_path
+            # Read-only: the snapshot is replaced as a whole, never written in place.
+            # A QueuePool (not the in-memory SingletonThreadPool 'sqlite://' would get)
+            # so that dispose() on a new snapshot closes only idle connections.
+            self.engine = create_engine(
+                'sqlite://',
+                creator=lambda: sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False),
+                poolclass=QueuePool,
+                **db_connections.POOL_SETTINGS
+            )
+
+            @event.listens_for(self.engine, 'connect')
+            def _apply_snapshot_pragmas(dbapi_connection, connection_record):
+                db_connections.apply_pragmas(dbapi_connection, SNAPSHOT_PRAGMAS)
+
+            primary = db_connections.sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+            if REPLICA_SNAPSHOT_INTERVAL > 0 and primary:
+                start_snapshots(primary, path, REPLICA_SNAPSHOT_INTERVAL)
+        else:
+            self.engine = create_engine(self.url, **db_connections.engine_options(self.url))
+        app.logger.info(f"Read replica configured: {self.url.split('@')[-1]} (max lag {self.max_lag}s)")
+
+    def _measure(self):
+        """Time (epoch seconds) up to which the replica has the primary's data"""
+        if self.snapshot_path:
+            mtime = os.path.getmtime(self.snapshot_path)
+            if self._snapshot_mtime is not None and mtime != self._snapshot_mtime:
+                # A new snapshot replaced the file - connections still read the old one
+                self.engine.dispose()
+            self._snapshot_mtime = mtime
+            return mtime
+
+        with self.engine.connect() as conn:
+            lag = conn.exec_driver_sql("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                END
+            """).scalar()
+        return time.time() - float(lag or 0)
+
+    def as_of(self):
+        """Cached replica position, or None when it cannot be read"""
+        now = time.time()
+        with self._lock:
+            if now - self._checked_at < REPLICA_CHECK_INTERVAL:
+                return self._as_of
+            self._checked_at = now
+            try:
+                self._as_of = self._measure()
+                if self._error:
+                    print("✅ Read replica reachable again")
+                self._error = None
+            except Exception as e:
+                if not self._error:
+                    print(f"⚠️ Read replica unavailable, reading from the primary: {e}")
+                self._as_of = None
+                self._error = str(e)
+            return self._as_of
+
+    def read_engine(self):
+        """The replica engine if this request may read from it, else None (use the primary)"""
+        if self.engine is None or not has_request_context() or not g.get('use_replica'):
+            return None
+        as_of = self.as_of()
+        if as_of is None or time.time() - as_of > self.max_lag:
+            return None
+        # Read your own writes: the replica must include this browser's last write
+        if as_of < browser_session.get('last_write_at', 0):
+            return None
+        return self.engine
+
+    def status(self):
+        """Replica configuration and freshness for the admin pages"""
+        if self.engine is None:
+            return {'configured': False}
+        as_of = self.as_of()
+        return {
+            'configured': True,
+            'url': self.url.split('@')[-1],
+            'max_lag': self.max_lag,
+            'lag': round(time.time() - as_of, 1) if as_of is not None else None,
+            'fresh': as_of is not None and time.time() - as_of <= self.max_lag,
+            'error': self._error,
+        }
+
+
+router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """Session that sends the SELECTs of @use_replica routes to the read replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and getattr(clause, 'is_select', False):
+            engine = router.read_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_replica(f):
+    """Route decorator: the request's reads may be served by the read replica"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.use_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside a replica-routed request (e.g. to fill a shared cache)"""
+    previous = g.get('use_replica') if has_request_context() else None
+    if has_request_context():
+        g.use_replica = False
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.use_replica = previous
+
+
+def track_writes(db):
+    """Remember when this browser session last wrote, for read-your-writes"""
+
+    @event.listens_for(db.session, 'after_flush')
+    def _note_write(session, flush_context):
+        session.info['wrote'] = True
+
+    @event.listens_for(db.session, 'do_orm_execute')
+    def _note_statement_write(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            orm_execute_state.session.info['wrote'] = True
+
+    @event.listens_for(db.session, 'after_commit')
+    def _record_write(session):
+        if session.info.pop('wrote', False) and router.engine is not None and has_request_context():
+            browser_session['last_write_at'] = time.time()
+
+    @event.listens_for(db.session, 'after_rollback')
+    def _discard_write(session):
+        session.info.pop('wrote', None)
+
+
+# ================================
+# SQLITE SNAPSHOTS
+# ================================
+
+def refresh_snapshot(primary_path, snapshot_path):
+    """Copy the primary database into the snapshot file atomically
+
+    The copy is made with the SQLite backup API (a consistent state even
+    while the application writes) into a temporary file that then replaces
+    the snapshot. The snapshot's mtime is set to when the copy started, which
+    is how fresh its data is.
+    """
+    started = time.time()
+    temp_path = f"{snapshot_path}.tmp"
+    source = sqlite3.connect(primary_path, timeout=30.0)
+    target = sqlite3.connect(temp_path)
+    try:
+        source.backup(target)
+        # A rollback journal only - readers open the file read-only, without a -wal
+        target.execute("PRAGMA journal_mode=DELETE;")
+        target.commit()
+    finally:
+        source.close()
+        target.close()
+    os.utime(temp_path, (started, started))
+    os.replace(temp_path, snapshot_path)
+    return started
+
+
+_snapshot_thread = None
+
+
+def start_snapshots(primary_path, snapshot_path, interval):
+    """Refresh the snapshot every `interval` seconds in a background thread"""
+    global _snapshot_thread
+    if _snapshot_thread:
+        return
+
+    def run():
+        while True:
+            try:
+                refresh_snapshot(primary_path, snapshot_path)
+            except Exception as e:
+                print(f"⚠️ Replica snapshot failed: {e}")
+            time.sleep(interval)
+
+    _snapshot_thread = threading.Thread(target=run, name='replica-snapshot', daemon=True)
+    _snapshot_thread.start()
+
+
+def main():
+    """Command line interface for the read replica"""
+    import sys
+    from app import app, database_path, sqlite_database
+    # The module app.py configured (this file runs as __main__)
+    import read_replica
+
+    if len(sys.argv) < 2:
+        print("🔧 Read Replica")
+        print("\nUsage:")
+        print("  python read_replica.py snapshot   - Refresh the SQLite snapshot replica (run from cron)")
+        print("  python read_replica.py status     - Show the replica's lag and whether it is used")
+        return
+
+    command = sys.argv[1].lower()
+    replica = read_replica.router
+
+    with app.app_context():
+        if command == 'snapshot':
+            if not replica.snapshot_path or not sqlite_database:
+                print("❌ Snapshots need a SQLite database and a sqlite:/// REPLICA_DATABASE_URL")
+                sys.exit(1)
+            started = refresh_snapshot(database_path, replica.snapshot_path)
+            print(f"✅ Snapshot written to {replica.snapshot_path} in {time.time() - started:.1f}s")
+        elif command == 'status':
+            for name, value in replica.status().items():
+                print(f"  {name}: {value}")
+        else:
+            print("❌ Invalid command")
+
+
+if __name__ == '__main__':
+    main()
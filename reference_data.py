@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Reference-data cache
+The hospital, sample collector and referring doctor lists fill the dropdowns
+of the registration and test assignment forms. Each process keeps them in
+memory with their choice lists already built, versioned in the cache_version
+table like the test catalog (see catalog_cache.py): adding or editing a
+hospital, collector or doctor bumps its list's version in the same
+transaction, and every worker reloads only that list on its next request.
+"""
+
+import threading
+from sqlalchemy import event, select
+from models import db, Hospital, SampleCollector, Doctor
+import catalog_cache
+import read_replica
+
+HOSPITALS = 'hospitals'
+SAMPLE_COLLECTORS = 'sample_collectors'
+DOCTORS = 'doctors'
+
+# Which list each model belongs to
+LIST_MODELS = ((Hospital, HOSPITALS), (SampleCollector, SAMPLE_COLLECTORS), (Doctor, DOCTORS))
+
+
+def _doctor_label(doctor):
+    return f"{doctor.name} - {doctor.specialization or 'General'}"
+
+
+# How to load each list and build its (value, label) choices
+LISTS = {
+    HOSPITALS: (
+        lambda: select(Hospital.__table__).order_by(Hospital.id),
+        lambda row: (row.name, row.name),
+    ),
+    SAMPLE_COLLECTORS: (
+        lambda: select(SampleCollector.__table__).order_by(SampleCollector.id),
+        lambda row: (row.name, row.name),
+    ),
+    # Only active doctors can be chosen as referring doctors
+    DOCTORS: (
+        lambda: select(Doctor.__table__).where(Doctor.is_active.is_(True)).order_by(Doctor.id),
+        lambda row: (str(row.id), _doctor_label(row)),
+    ),
+}
+
+
+class ReferenceList:
+    """One version of a list: its rows (read-only, attribute access) and choices"""
+
+    def __init__(self, version, rows, choices):
+        self.version = version
+        self.rows = rows
+        self.choices = choices
+
+
+_lock = threading.Lock()
+_lists = {}
+
+
+def get_list(name):
+    """The cached list `name`, reloaded only when its version has changed"""
+    version = catalog_cache.current_version(name)
+    cached = _lists.get(name)
+    if cached is not None and cached.version == version:
+        return cached
+
+    with _lock:
+        cached = _lists.get(name)
+        if cached is not None and cached.version == version:
+            return cached
+        query, choice = LISTS[name]
+        # Read after the version: the data is at least as new as the tag
+        with read_replica.primary():
+            rows = db.session.execute(query()).all()
+        cached = _lists[name] = ReferenceList(version, rows, [choice(row) for row in rows])
+        return cached
+
+
+def hospitals():
+    return get_list(HOSPITALS).rows
+
+
+def sample_collectors():
+    return get_list(SAMPLE_COLLECTORS).rows
+
+
+def active_doctors():
+    return get_list(DOCTORS).rows
+
+
+def _choices(name, placeholder):
+    # A new list each time - forms may change their choices
+    return [('', placeholder)] + get_list(name).choices
+
+
+def hospital_choices(placeholder='Select Hospital'):
+    return _choices(HOSPITALS, placeholder)
+
+
+def collector_choices(placeholder='Select Collector'):
+    return _choices(SAMPLE_COLLECTORS, placeholder)
+
+
+def doctor_choices(placeholder='Select Referring Doctor'):
+    return _choices(DOCTORS, placeholder)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_reference_changes(session, flush_context):
+    """Bump the version of each list with rows added, edited or deleted in this flush"""
+    modified = [obj for obj in session.dirty if session.is_modified(obj)]
+    changed = set()
+    for obj in list(session.new) + modified + list(session.deleted):
+        changed.update(name for model, name in LIST_MODELS if isinstance(obj, model))
+    for name in sorted(changed):
+        catalog_cache.bump(session.connection(), name)
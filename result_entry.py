@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Result entry service
+The result entry worklist - patient tests filtered by status, order date,
+patient and test, read as plain columns and paged by keyset on
+(date_ordered, id) - and single-row result updates. An update is one UPDATE
+statement guarded by the status it was read with, so two technicians saving
+the same test cannot both move the dashboard counters.
+
+Analyzer batches (JSON or CSV, thousands of rows keyed by patient test id or
+sample barcode) are resolved with a few IN queries, validated row by row and
+written with one executemany UPDATE per target status in a single
+transaction; every row gets an outcome in the returned report.
+
+Form edits of many tests at once (bulk update, the patient's test list) load
+the affected rows with one IN query and write them with an ORM bulk UPDATE
+by primary key (apply_changes).
+"""
+
+import csv
+import io
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, bindparam
+from models import db, Patient, Test, PatientTest
+import billing
+import commission_ledger
+import dashboard_counters
+import patient_search
+
+pt_table = PatientTest.__table__
+test_table = Test.__table__
+
+# Statuses a result can be saved with; cancelling a test stays on the patient's page
+RESULT_STATUSES = ('Pending', 'In Progress', 'Completed')
+
+# Largest analyzer batch accepted in one request
+BATCH_MAX_ROWS = 10000
+# Ids / barcodes per IN (...) lookup
+LOOKUP_CHUNK_SIZE = 500
+
+
+class ResultError(Exception):
+    """A result update that cannot be applied; http_status says why (400, 404, 409)"""
+
+    def __init__(self, message, http_status=400):
+        super().__init__(message)
+        self.http_status = http_status
+
+
+def parse_date(value):
+    """YYYY-MM-DD from a filter argument, or None"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+
+def worklist_query(status=None, patient_id=None, test_id=None, date_from=None, date_to=None, search=None):
+    """Columns the result screen shows, filtered; page it on PatientTest.date_ordered / id
+
+    Filters are served by the patient_test indexes on (status, date_ordered),
+    (patient_id, status), test_id and (date_ordered, id).
+    """
+    query = db.session.query(
+        PatientTest.id,
+        PatientTest.patient_id,
+        Patient.first_name,
+        Patient.last_name,
+        Patient.phone,
+        Test.name.label('test_name'),
+        Test.normal_range_min,
+        Test.normal_range_max,
+        Test.unit,
+        PatientTest.results,
+        PatientTest.status,
+        PatientTest.date_ordered,
+        PatientTest.date_completed,
+        PatientTest.notes,
+    ).join(Patient, PatientTest.patient_id == Patient.id).join(Test, PatientTest.test_id == Test.id)
+
+    if status:
+        query = query.filter(PatientTest.status == status)
+    if patient_id:
+        query = query.filter(PatientTest.patient_id == patient_id)
+    if test_id:
+        query = query.filter(PatientTest.test_id == test_id)
+    if date_from:
+        query = query.filter(PatientTest.date_ordered >= date_from)
+    if date_to:
+        # Up to the end of that day
+        query = query.filter(PatientTest.date_ordered < date_to + timedelta(days=1))
+    if search:
+        query = patient_search.filter_query(query, search)
+    return query
+
+
+def range_flag(value, normal_min, normal_max):
+    """'low', 'high' or 'normal' for a numeric result; None when it is not a number"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if normal_min is not None and number < normal_min:
+        return 'low'
+    if normal_max is not None and number > normal_max:
+        return 'high'
+    return 'normal'
+
+
+def to_dict(row):
+    """A worklist row as the template and the JSON API use it"""
+    return {
+        'patient_test_id': row.id,
+        'patient_id': row.patient_id,
+        'patient_name': f"{row.first_name} {row.last_name}",
+        'phone': row.phone,
+        'test_name': row.test_name,
+        'normal_range_min': row.normal_range_min if row.normal_range_min is not None else 0,
+        'normal_range_max': row.normal_range_max if row.normal_range_max is not None else 100,
+        'unit': row.unit or '',
+        'results': row.results or '',
+        'flag': range_flag(row.results, row.normal_range_min, row.normal_range_max),
+        'status': row.status,
+        'date_ordered': row.date_ordered.strftime('%Y-%m-%d %H:%M') if row.date_ordered else '',
+        'date_completed': row.date_completed.strftime('%Y-%m-%d %H:%M') if row.date_completed else '',
+        'notes': row.notes or '',
+    }
+
+
+def update_result(patient_test_id, results, status='Completed', notes=None):
+    """Save a result and status with one guarded UPDATE; the caller commits
+
+    The row is only written if its status is still the one read just before,
+    so the counter move recorded with it is exact. A test changed by someone
+    else in between is retried once, then reported as a conflict.
+    """
+    if status not in RESULT_STATUSES:
+        raise ResultError(f'Invalid status: {status}')
+    c = pt_table.c
+    results = results.strip() if isinstance(results, str) else results
+    values = {
+        'results': results or None,
+        'status': status,
+        # Keep the first completion time when a completed result is corrected
+        'date_completed': func.coalesce(c.date_completed, datetime.utcnow()) if status == 'Completed' else None,
+    }
+    if notes is not None:
+        values['notes'] = notes
+
+    for attempt in range(2):
+        current = db.session.execute(select(c.status).where(c.id == patient_test_id)).first()
+        if current is None:
+            raise ResultError('Test not found', 404)
+        old_status = current.status
+        if old_status == 'Cancelled':
+            raise ResultError('Test has been cancelled', 409)
+
+        guard = c.status.is_(None) if old_status is None else c.status == old_status
+        updated = db.session.execute(
+            update(pt_table).where(c.id == patient_test_id, guard).values(**values)
+        ).rowcount
+        if updated:
+            dashboard_counters.status_changed(old_status, status)
+            return old_status
+    raise ResultError('Test was updated by someone else, reload and try again', 409)
+
+
+def load_for_update(ids, patient_id=None):
+    """{id: (id, patient_id, status, notes)} of the patient tests `ids`, one IN query per chunk"""
+    c = pt_table.c
+    ids = list(ids)
+    current = {}
+    for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        query = select(c.id, c.patient_id, c.status, c.notes).where(c.id.in_(ids[start:start + LOOKUP_CHUNK_SIZE]))
+        if patient_id is not None:
+            query = query.where(c.patient_id == patient_id)
+        current.update((row.id, row) for row in db.session.execute(query))
+    return current
+
+
+def apply_changes(current, changes):
+    """Write per-test changes ({'id': ..., column: new value}) with one bulk UPDATE; the caller commits
+
+    `current` is what load_for_update returned for them. A bulk UPDATE does not
+    pass through the flush hooks, so what they would do is done here: move the
+    status counters and, for tests cancelled or restored, reprice the bills
+    and update the commission ledger.
+    """
+    if not changes:
+        return
+    # Rows setting the same columns are sent together as one executemany
+    db.session.execute(update(PatientTest), sorted(changes, key=lambda change: sorted(change)))
+
+    moves = Counter()
+    cancel_changed, patient_ids = set(), set()
+    for change in changes:
+        old_status, new_status = current[change['id']].status, change.get('status')
+        if 'status' not in change or old_status == new_status:
+            continue
+        moves[(old_status, new_status)] += 1
+        if 'Cancelled' in (old_status, new_status):
+            cancel_changed.add(change['id'])
+            patient_ids.add(current[change['id']].patient_id)
+
+    for (old_status, new_status), count in moves.items():
+        dashboard_counters.status_changed(old_status, new_status, count)
+    if cancel_changed:
+        connection = db.session.connection()
+        commission_ledger.sync(connection, patient_test_ids=cancel_changed)
+        billing.refresh_totals(connection, patient_ids)
+
+
+# ================================
+# ANALYZER BATCHES
+# ================================
+
+# Accepted spellings of the batch columns
+FIELD_ALIASES = {
+    'patient_test_id': ('patient_test_id',),
+    'barcode': ('barcode', 'sample_id'),
+    'test': ('test', 'test_name', 'test_id'),
+    'value': ('value', 'result', 'results', 'result_value'),
+    'unit': ('unit',),
+    'status': ('status',),
+    'notes': ('notes',),
+}
+
+
+def parse_batch(data=None, csv_text=None):
+    """Rows of an analyzer batch: a JSON list (or {"results": [...]}) or CSV text with a header"""
+    if csv_text is not None:
+        rows = list(csv.DictReader(io.StringIO(csv_text.lstrip('\ufeff'))))
+    elif isinstance(data, dict):
+        rows = data.get('results')
+    else:
+        rows = data
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ResultError('Expected a list of result rows')
+    if len(rows) > BATCH_MAX_ROWS:
+        raise ResultError(f'Too many rows: {len(rows)} (at most {BATCH_MAX_ROWS} per batch)', 413)
+    return rows
+
+
+def _field(fields, name):
+    for alias in FIELD_ALIASES[name]:
+        value = fields.get(alias)
+        if isinstance(value, str):
+            value = value.strip()
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _normalize(raw):
+    """One batch row as {patient_test_id, barcode, test, value, unit, status, notes}"""
+    fields = {str(key).strip().lower(): value for key, value in raw.items() if key is not None}
+    row = {name: _field(fields, name) for name in FIELD_ALIASES}
+    if row['patient_test_id'] is not None:
+        try:
+            row['patient_test_id'] = int(row['patient_test_id'])
+        except (TypeError, ValueError):
+            raise ResultError(f"Invalid patient_test_id: {row['patient_test_id']}")
+    elif row['barcode'] is None:
+        raise ResultError('Row needs a patient_test_id or a barcode')
+    else:
+        row['barcode'] = str(row['barcode'])
+    if row['value'] is None:
+        raise ResultError('Missing result value')
+    row['value'] = str(row['value'])
+    row['status'] = row['status'] or 'Completed'
+    if row['status'] not in RESULT_STATUSES:
+        raise ResultError(f"Invalid status: {row['status']}")
+    return row
+
+
+def _lookup(column, keys):
+    """Patient tests (with their test's range and unit) whose `column` is in `keys`, row locked"""
+    found = []
+    keys = list(keys)
+    for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        found.extend(db.session.execute(
+            select(pt_table.c.id, pt_table.c.status, pt_table.c.barcode, pt_table.c.test_id,
+                   test_table.c.name.label('test_name'), test_table.c.normal_range_min,
+                   test_table.c.normal_range_max, test_table.c.unit)
+            .select_from(pt_table.join(test_table, pt_table.c.test_id == test_table.c.id))
+            .where(column.in_(keys[start:start + LOOKUP_CHUNK_SIZE]))
+            # Status transitions are counted from these reads - keep them current
+            .with_for_update(of=pt_table)
+        ).all())
+    return found
+
+
+def _match_barcode(candidates, test):
+    """The test a barcode row means: the only one on the sample, or the one named in `test`"""
+    if test is not None:
+        test = str(test).lower()
+        candidates = [c for c in candidates if test in (str(c.test_id), c.test_name.lower())]
+    else:
+        # A sample carrying several tests: only the ones still awaiting a result
+        open_tests = [c for c in candidates if c.status not in ('Completed', 'Cancelled')]
+        candidates = open_tests if len(open_tests) == 1 else candidates
+    if not candidates:
+        raise ResultError('No matching test for this barcode', 404)
+    if len(candidates) > 1:
+        raise ResultError('Barcode has several tests, give the test name or id')
+    return candidates[0]
+
+
+def apply_batch(raw_rows, dry_run=False):
+    """Validate and save an analyzer batch; the caller commits
+
+    Rows that fail validation are reported and skipped, the rest are written
+    with one UPDATE per target status. Returns the report:
+    {'applied': n, 'failed': n, 'rows': [{'row', 'patient_test_id', 'outcome', ...}]}
+    """
+    report = [{'row': number, 'outcome': 'error'} for number in range(1, len(raw_rows) + 1)]
+    rows = {}
+    for entry, raw in zip(report, raw_rows):
+        try:
+            rows[entry['row']] = _normalize(raw)
+        except ResultError as e:
+            entry['message'] = str(e)
+
+    ids = {row['patient_test_id'] for row in rows.values() if row['patient_test_id'] is not None}
+    barcodes = {row['barcode'] for row in rows.values() if row['patient_test_id'] is None}
+    by_id = {found.id: found for found in _lookup(pt_table.c.id, ids)} if ids else {}
+    by_barcode = {}
+    for found in (_lookup(pt_table.c.barcode, barcodes) if barcodes else []):
+        by_barcode.setdefault(found.barcode, []).append(found)
+
+    updates = {}
+    seen = set()
+    for number, row in rows.items():
+        entry = report[number - 1]
+        try:
+            if row['patient_test_id'] is not None:
+                target = by_id.get(row['patient_test_id'])
+                if target is None:
+                    raise ResultError('Test not found', 404)
+            else:
+                target = _match_barcode(by_barcode.get(row['barcode'], []), row['test'])
+            entry['patient_test_id'] = target.id
+            if target.id in seen:
+                raise ResultError('Same test appears earlier in this batch', 409)
+            if target.status == 'Cancelled':
+                raise ResultError('Test has been cancelled', 409)
+            if row['unit'] and target.unit and row['unit'].lower() != target.unit.lower():
+                raise ResultError(f"Unit {row['unit']} does not match the test's unit {target.unit}")
+        except ResultError as e:
+            entry['message'] = str(e)
+            continue
+
+        seen.add(target.id)
+        entry.update(outcome='updated', test_name=target.test_name, status=row['status'],
+                     flag=range_flag(row['value'], target.normal_range_min, target.normal_range_max))
+        updates.setdefault(row['status'], []).append({
+            'b_id': target.id, 'b_results': row['value'], 'b_notes': row['notes'], 'b_old': target.status
+        })
+
+    if not dry_run:
+        _write_batch(updates)
+    applied = sum(len(params) for params in updates.values())
+    return {'applied': applied, 'failed': len(report) - applied, 'dry_run': dry_run, 'rows': report}
+
+
+def _write_batch(updates):
+    """One executemany UPDATE per target status, plus the counter moves"""
+    c = pt_table.c
+    for status, params in updates.items():
+        db.session.execute(
+            update(pt_table).where(c.id == bindparam('b_id')).values(
+                results=bindparam('b_results'),
+                status=status,
+                notes=func.coalesce(bindparam('b_notes'), c.notes),
+                date_completed=func.coalesce(c.date_completed, datetime.utcnow()) if status == 'Completed' else None,
+            ),
+            [{key: value for key, value in param.items() if key != 'b_old'} for param in params]
+        )
+        for old_status, count in Counter(param['b_old'] for param in params).items():
+            dashboard_counters.status_changed(old_status, status, count)
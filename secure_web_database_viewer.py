@@ -4,14 +4,10 @@ Secure Web-Based SQLite Database Viewer with Authentication
 Access SQLite database through web browser with login protection
 """
 
-from flask import Flask, render_template, jsonify, request, send_file, session, redirect, url_for, flash
-import sqlite3
+from flask import Flask, render_template, jsonify, request, session, redirect, url_for, flash
+import db_connections
 import os
-import json
 from datetime import datetime
-import pandas as pd
-import io
-import hashlib
 
 # Create secure Flask app for database viewer
 secure_db_viewer_app = Flask(__name__, template_folder='templates')
@@ -30,10 +26,8 @@ class SecureWebDatabaseViewer:
             self.db_path = db_path
     
     def get_connection(self):
-        """Get database connection"""
-        if os.path.exists(self.db_path):
-            return sqlite3.connect(self.db_path)
-        return None
+        """Get a pooled database connection (close() releases it)"""
+        return db_connections.connect(self.db_path)
     
     def get_database_info(self):
         """Get database information"""
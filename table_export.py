@@ -0,0 +1,317 @@
+"""
+Streaming table export for the database viewer
+Rows are read in fixed-size chunks from an open cursor and written out as they
+arrive, so exporting a table takes the same memory whatever its size. CSV is
+always available; JSON Lines keeps numbers and dates typed, and Parquet / Arrow
+IPC are offered when pyarrow is installed.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, date
+import db_connections
+
+# Optional pyarrow import for the columnar formats
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+CHUNK_SIZE = 1000
+PARQUET_ROW_GROUP_SIZE = 50000
+
+# Format SQLAlchemy stores DateTime columns in on SQLite
+STORED_DATETIME = '%Y-%m-%d %H:%M:%S.%f'
+
+# format: (mimetype, file extension, needs pyarrow)
+FORMATS = {
+    'csv': ('text/csv', 'csv', False),
+    'jsonl': ('application/x-ndjson', 'jsonl', False),
+    'parquet': ('application/vnd.apache.parquet', 'parquet', True),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows', True),
+}
+
+
+class ExportError(Exception):
+    """Invalid export request (unknown table, column or format)"""
+
+
+def table_schema(conn, table_name):
+    """(column name, value kind) pairs of a table, raising ExportError if it does not exist"""
+    if not db_connections.table_exists(conn, table_name):
+        raise ExportError("Table not found")
+    return [(name, _value_kind(declared_type))
+            for name, declared_type, is_key in db_connections.table_info(conn, table_name)]
+
+
+def table_columns(conn, table_name):
+    """Column names of a table, raising ExportError if the table does not exist"""
+    return [name for name, kind in table_schema(conn, table_name)]
+
+
+def _value_kind(declared_type):
+    """Map a declared SQLite (or PostgreSQL data_type) column type onto the kind of value it holds"""
+    declared_type = (declared_type or '').upper()
+    if declared_type == 'BOOLEAN':
+        return 'bool'
+    if 'INT' in declared_type:
+        return 'int'
+    if any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB', 'NUMERIC', 'DECIMAL')):
+        return 'float'
+    if 'DATETIME' in declared_type or 'TIMESTAMP' in declared_type:
+        return 'datetime'
+    if declared_type == 'DATE':
+        return 'date'
+    return 'string'
+
+
+def _parse_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def _parse_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(value[:10])
+
+
+CONVERTERS = {
+    'bool': bool,
+    'int': int,
+    'float': float,
+    'datetime': _parse_datetime,
+    'date': _parse_date,
+    'string': str,
+}
+
+
+def select_columns(available, requested):
+    """Validate a comma separated column list against the table's columns"""
+    if not requested:
+        return list(available)
+    columns = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in columns if name not in available]
+    if unknown:
+        raise ExportError(f"Unknown columns: {', '.join(unknown)}")
+    return columns
+
+
+def since_filter(conn, table_name, schema, since, since_column=None):
+    """WHERE clause for an incremental export plus the watermark for the next one
+
+    Rows count as changed when any of the table's date columns (or just
+    `since_column`) falls after `since` and no later than the watermark - the
+    newest date at the start of the export. Passing the watermark back as
+    `since` continues where this export stopped. DATE columns cannot tell
+    times within a day apart, so they include the rows of the day of `since`
+    again rather than miss the ones added later that day. Returns (where,
+    params, watermark).
+    """
+    kinds = {name: kind for name, kind in schema if kind in ('datetime', 'date')}
+    if since_column:
+        if since_column not in kinds:
+            raise ExportError(f"{since_column} is not a date column of {table_name}")
+        kinds = {since_column: kinds[since_column]}
+    if not kinds:
+        return '', (), None
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(f'MAX({name})' for name in kinds)} FROM {table_name};")
+    latest = [value for value in cursor.fetchone() if value is not None]
+    # PostgreSQL returns date and datetime objects, which only compare as ISO text
+    watermark = max(latest, key=str) if latest else None
+
+    if not since:
+        return '', (), watermark
+
+    try:
+        since_value = datetime.fromisoformat(since)
+    except ValueError:
+        raise ExportError("since must be an ISO date or datetime, e.g. 2024-01-31T18:00:00")
+    try:
+        until_value = datetime.fromisoformat(str(watermark)) if watermark is not None else since_value
+    except ValueError:
+        raise ExportError(f"{table_name} holds a date that is not in ISO format: {watermark}")
+
+    # Bounds in the text format each kind of column is stored in (ISO order),
+    # so the comparisons can use indexes
+    conditions, params = [], []
+    for name, kind in kinds.items():
+        if kind == 'date':
+            conditions.append(f"({name} >= ? AND {name} <= ?)")
+            params.extend([since_value.date().isoformat(), until_value.date().isoformat()])
+        else:
+            conditions.append(f"({name} > ? AND {name} <= ?)")
+            params.extend([since_value.strftime(STORED_DATETIME), until_value.strftime(STORED_DATETIME)])
+    return db_connections.sql(conn, f" WHERE {' OR '.join(conditions)}"), tuple(params), watermark
+
+
+def iter_row_chunks(get_connection, table_name, columns, where='', params=(), chunk_size=CHUNK_SIZE):
+    """Yield lists of row tuples from a cursor that stays open for the whole export"""
+    conn = get_connection()
+    try:
+        # Server-side on PostgreSQL, so only one chunk is held in memory
+        cursor = db_connections.server_cursor(conn, 'table_export')
+        column_list = ', '.join(f'"{name}"' for name in columns)
+        cursor.execute(f"SELECT {column_list} FROM {table_name}{where};", params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        # Also runs when the client disconnects and the response is closed early
+        conn.close()
+
+
+def typed_row_chunks(row_chunks, kinds):
+    """Convert stored values (dates are stored as text) to typed Python values"""
+    converters = [CONVERTERS[kind] for kind in kinds]
+    for rows in row_chunks:
+        yield [tuple(None if value is None else convert(value)
+                     for convert, value in zip(converters, row))
+               for row in rows]
+
+
+def csv_chunks(row_chunks, columns):
+    """Encode row chunks as CSV text, one output chunk per input chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in row_chunks:
+        for row in rows:
+            writer.writerow(['' if value is None else str(value) for value in row])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def jsonl_chunks(row_chunks, columns):
+    """Encode typed row chunks as JSON Lines, one object per row"""
+    for rows in row_chunks:
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=_json_default) + '\n'
+                      for row in rows).encode('utf-8')
+
+
+class _StreamSink:
+    """Write-only file object that hands the bytes written by pyarrow back to the generator"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def writable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema(columns, kinds):
+    types = {
+        'bool': pa.bool_(),
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'datetime': pa.timestamp('us'),
+        'date': pa.date32(),
+        'string': pa.string(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in zip(columns, kinds)])
+
+
+def _record_batch(rows, schema):
+    values = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column_values, type=field.type) for column_values, field in zip(values, schema)],
+        schema=schema
+    )
+
+
+def arrow_chunks(row_chunks, columns, kinds):
+    """Encode typed row chunks as an Arrow IPC stream, one record batch per chunk"""
+    schema = _arrow_schema(columns, kinds)
+    sink = _StreamSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    for rows in row_chunks:
+        writer.write_batch(_record_batch(rows, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def parquet_chunks(row_chunks, columns, kinds):
+    """Encode typed row chunks as Parquet, one row group per chunk"""
+    schema = _arrow_schema(columns, kinds)
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    for rows in row_chunks:
+        writer.write_batch(_record_batch(rows, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def check_format(export_format):
+    """Validate an export format name, returning (mimetype, extension)"""
+    if export_format not in FORMATS:
+        raise ExportError(f"Unknown format '{export_format}' - use one of {', '.join(FORMATS)}")
+    mimetype, extension, needs_pyarrow = FORMATS[export_format]
+    if needs_pyarrow and not PYARROW_AVAILABLE:
+        raise ExportError(f"{export_format} export needs pyarrow (pip install pyarrow)")
+    return mimetype, extension
+
+
+def export_chunks(export_format, get_connection, table_name, schema, columns, where='', params=()):
+    """Byte chunks of a table export in the requested format"""
+    kinds = dict(schema)
+    column_kinds = [kinds[name] for name in columns]
+    chunk_size = PARQUET_ROW_GROUP_SIZE if export_format == 'parquet' else CHUNK_SIZE
+    row_chunks = iter_row_chunks(get_connection, table_name, columns, where, params, chunk_size)
+
+    if export_format == 'csv':
+        return csv_chunks(row_chunks, columns)
+    typed = typed_row_chunks(row_chunks, column_kinds)
+    if export_format == 'jsonl':
+        return jsonl_chunks(typed, columns)
+    if export_format == 'arrow':
+        return arrow_chunks(typed, columns, column_kinds)
+    return parquet_chunks(typed, columns, column_kinds)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a byte stream into a gzip stream chunk by chunk"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
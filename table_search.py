@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Database viewer table search
+Free text search runs against an FTS5 trigram index per table (kept in sync by
+triggers) instead of LIKE '%term%' over every column - on PostgreSQL against
+pg_trgm GIN indexes on the text columns, which serve ILIKE '%term%' directly.
+Indexes are built on request for the tables and columns worth it
+(`python table_search.py build <table> [columns]`); other searches use LIKE.
+Searches can be narrowed with typed per-column filters:
+
+    q=anita                      text search over all text columns
+    search_columns=notes,results restrict the text search to these columns
+    status=Pending               equality (typed by the column)
+    amount.gte=500&amount.lt=1000
+    date_ordered.gte=2024-01-01  dates compare as ranges - a bare date on a
+                                 datetime column covers the whole day
+    notes.like=fasting           substring match on one text column
+    date_completed.null=true     IS NULL / IS NOT NULL
+
+Results are paginated (page, per_page) with a total count.
+"""
+
+import re
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import table_export
+import db_connections
+
+FTS_PREFIX = 'viewer_fts_'
+MIN_TRIGRAM_LENGTH = 3
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Counting stops here - larger totals are reported as "more than COUNT_LIMIT"
+COUNT_LIMIT = 10000
+
+# Never copied into a search index
+EXCLUDED_COLUMNS = {'password', 'password_hash'}
+
+OPERATORS = {'eq': '=', 'ne': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+RESERVED_ARGS = {'q', 'search_columns', 'page', 'per_page', 'limit', 'offset'}
+
+# Format SQLAlchemy stores DateTime columns in on SQLite
+STORED_DATETIME = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class SearchError(Exception):
+    """Invalid search request (unknown table, column, operator or value)"""
+
+
+# ================================
+# FTS INDEX MAINTENANCE
+# ================================
+
+def fts_table(table_name):
+    return FTS_PREFIX + table_name
+
+
+def trigram_index(table_name, column):
+    """Name of the pg_trgm index of one text column (PostgreSQL)"""
+    return f'ix_{table_name}_{column}_trgm'
+
+
+def indexed_columns(schema):
+    """Text columns of a table that go into its search index"""
+    return [name for name, kind in schema if kind == 'string' and name not in EXCLUDED_COLUMNS]
+
+
+def _index_ddl(table_name, primary_key, columns):
+    fts = fts_table(table_name)
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{name}' for name in columns)
+    old_values = ', '.join(f'old.{name}' for name in columns)
+    return [
+        f"""CREATE VIRTUAL TABLE {fts} USING fts5(
+            {column_list}, content='{table_name}', content_rowid='{primary_key}', tokenize='trigram'
+        )""",
+        f"""CREATE TRIGGER {fts}_insert AFTER INSERT ON {table_name} BEGIN
+            INSERT INTO {fts}(rowid, {column_list}) VALUES (new.{primary_key}, {new_values});
+        END""",
+        f"""CREATE TRIGGER {fts}_delete AFTER DELETE ON {table_name} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.{primary_key}, {old_values});
+        END""",
+        f"""CREATE TRIGGER {fts}_update AFTER UPDATE OF {column_list} ON {table_name} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.{primary_key}, {old_values});
+            INSERT INTO {fts}(rowid, {column_list}) VALUES (new.{primary_key}, {new_values});
+        END""",
+    ]
+
+
+def _postgres_index_columns(conn, table_name):
+    cursor = conn.cursor()
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index behind - it serves no queries
+    cursor.execute(
+        """SELECT index_class.relname
+           FROM pg_index
+           JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+           JOIN pg_class table_class ON table_class.oid = pg_index.indrelid
+           JOIN pg_namespace ON pg_namespace.oid = table_class.relnamespace
+           WHERE pg_namespace.nspname = current_schema() AND table_class.relname = %s
+             AND pg_index.indisvalid""",
+        (table_name,)
+    )
+    index_names = {row[0] for row in cursor.fetchall()}
+    schema = table_export.table_schema(conn, table_name)
+    return [name for name in indexed_columns(schema) if trigram_index(table_name, name) in index_names] or None
+
+
+def index_columns(conn, table_name):
+    """Columns of the table's search index, or None when it has no usable index"""
+    if db_connections.dialect_of(conn) == 'postgresql':
+        return _postgres_index_columns(conn, table_name)
+    cursor = conn.cursor()
+    fts = fts_table(table_name)
+    # Triggers disappear with the table (e.g. drop_all) - without them the index is stale
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?;", (f'{fts}_update',))
+    if not cursor.fetchone():
+        return None
+    cursor.execute(f"PRAGMA table_info({fts});")
+    return [col[1] for col in cursor.fetchall()] or None
+
+
+@contextmanager
+def _autocommit(conn):
+    """CREATE/DROP INDEX CONCURRENTLY refuse to run inside a transaction (PostgreSQL)"""
+    driver_connection = getattr(conn, 'dbapi_connection', conn)
+    conn.rollback()
+    driver_connection.autocommit = True
+    try:
+        yield conn.cursor()
+    finally:
+        driver_connection.autocommit = False
+
+
+def _drop_postgres_indexes(conn, table_name, columns):
+    with _autocommit(conn) as cursor:
+        for name in columns:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {trigram_index(table_name, name)};")
+
+
+def drop_index(conn, table_name):
+    if db_connections.dialect_of(conn) == 'postgresql':
+        schema = table_export.table_schema(conn, table_name)
+        _drop_postgres_indexes(conn, table_name, indexed_columns(schema))
+        return
+    cursor = conn.cursor()
+    fts = fts_table(table_name)
+    for suffix in ('insert', 'delete', 'update'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix};")
+    cursor.execute(f"DROP TABLE IF EXISTS {fts};")
+    conn.commit()
+
+
+def ensure_index(conn, table_name, columns=None, rebuild=False):
+    """Create (or rebuild when the chosen columns changed) a table's search index
+
+    Indexes are opt-in (`python table_search.py build <table> [columns]`) and
+    cover the given text columns, or all of them. Searches on columns outside
+    the index fall back to LIKE. Returns True when the table has an up to
+    date index.
+    """
+    schema = table_export.table_schema(conn, table_name)
+    text_columns = indexed_columns(schema)
+    if columns:
+        unknown = [name for name in columns if name not in text_columns]
+        if unknown:
+            raise SearchError(f"Not searchable text columns of {table_name}: {', '.join(unknown)}")
+        columns = [name for name in text_columns if name in columns]
+    else:
+        columns = text_columns
+    if db_connections.dialect_of(conn) == 'postgresql':
+        return _ensure_postgres_index(conn, table_name, columns, rebuild)
+
+    primary_key = db_connections.primary_key_column(conn, table_name)
+    if not columns or not primary_key:
+        return False
+
+    if not rebuild and index_columns(conn, table_name) == columns:
+        return True
+
+    drop_index(conn, table_name)
+    cursor = conn.cursor()
+    for statement in _index_ddl(table_name, primary_key, columns):
+        cursor.execute(statement)
+    fts = fts_table(table_name)
+    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild');")
+    conn.commit()
+    return True
+
+
+def _ensure_postgres_index(conn, table_name, columns, rebuild):
+    """One pg_trgm GIN index per chosen text column - the table's rows need no copy
+
+    Built CONCURRENTLY, so inserts and updates carry on during the build.
+    """
+    if not columns:
+        return False
+    if rebuild:
+        drop_index(conn, table_name)
+    existing = set(_postgres_index_columns(conn, table_name) or [])
+    with _autocommit(conn) as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        for name in columns:
+            if name in existing:
+                continue
+            index = trigram_index(table_name, name)
+            # Clears an invalid index left by an interrupted build
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index};")
+            cursor.execute(f"CREATE INDEX CONCURRENTLY {index} ON {table_name} USING gin ({name} gin_trgm_ops);")
+    return True
+
+
+# ================================
+# QUERY BUILDING
+# ================================
+
+def _parse_datetime(column, value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise SearchError(f"{column} expects a date, e.g. 2024-01-31 or 2024-01-31T18:00:00")
+
+
+def _typed_value(column, kind, value):
+    """Convert a filter value to what the column stores"""
+    if kind == 'int':
+        try:
+            return int(value)
+        except ValueError:
+            raise SearchError(f"{column} expects a whole number")
+    if kind == 'float':
+        try:
+            return float(value)
+        except ValueError:
+            raise SearchError(f"{column} expects a number")
+    if kind == 'bool':
+        return value.lower() in ('1', 'true', 'yes')
+    if kind == 'datetime':
+        return _parse_datetime(column, value).strftime(STORED_DATETIME)
+    if kind == 'date':
+        return _parse_datetime(column, value).date().isoformat()
+    return value
+
+
+def _day_range_condition(column, op, value):
+    """A bare date against a datetime column means the whole day"""
+    day = _parse_datetime(column, value)
+    start = day.strftime(STORED_DATETIME)
+    end = (day + timedelta(days=1)).strftime(STORED_DATETIME)
+    conditions = {
+        'eq': (f"({column} >= ? AND {column} < ?)", [start, end]),
+        'ne': (f"({column} < ? OR {column} >= ?)", [start, end]),
+        'gt': (f"{column} >= ?", [end]),
+        'gte': (f"{column} >= ?", [start]),
+        'lt': (f"{column} < ?", [start]),
+        'lte': (f"{column} < ?", [end]),
+    }
+    return conditions[op]
+
+
+def parse_filters(args, schema):
+    """(column, operator, value) filters from request arguments like `amount.gte=500`"""
+    kinds = dict(schema)
+    filters = []
+    for key, value in args:
+        if key in RESERVED_ARGS or value == '':
+            continue
+        column, _, op = key.partition('.')
+        op = op or 'eq'
+        if column not in kinds:
+            raise SearchError(f"Unknown column: {column}")
+        if op not in OPERATORS and op not in ('like', 'null'):
+            raise SearchError(f"Unknown operator '{op}' - use one of {', '.join(list(OPERATORS) + ['like', 'null'])}")
+        if op == 'like' and kinds[column] != 'string':
+            raise SearchError(f"like only applies to text columns, {column} is {kinds[column]}")
+        filters.append((column, op, value))
+    return filters
+
+
+def _fts_phrase(term, columns):
+    phrase = '"' + term.replace('"', '""') + '"'
+    return '{' + ' '.join(columns) + '} : ' + phrase
+
+
+def _text_condition(table_name, primary_key, fts_columns, matches, dialect='sqlite'):
+    """(term, columns) substring matches AND-ed into one condition
+
+    Terms long enough for trigrams on indexed columns go into a single FTS
+    MATCH; short terms and unindexed columns fall back to LIKE. PostgreSQL
+    uses ILIKE throughout, which the trigram indexes serve.
+    """
+    phrases, sql, params = [], [], []
+    if dialect == 'postgresql':
+        for term, columns in matches:
+            sql.append('(' + ' OR '.join(f"{name} ILIKE ?" for name in columns) + ')')
+            params.extend([f"%{term}%"] * len(columns))
+        used_index = bool(fts_columns) and all(set(columns) <= set(fts_columns) for term, columns in matches)
+        return ' AND '.join(sql), params, used_index
+
+    for term, columns in matches:
+        if fts_columns and len(term) >= MIN_TRIGRAM_LENGTH and set(columns) <= set(fts_columns):
+            phrases.append(_fts_phrase(term, columns))
+        else:
+            sql.append('(' + ' OR '.join(f"{name} LIKE ?" for name in columns) + ')')
+            params.extend([f"%{term}%"] * len(columns))
+    if phrases:
+        fts = fts_table(table_name)
+        sql.insert(0, f"{primary_key} IN (SELECT rowid FROM {fts} WHERE {fts} MATCH ?)")
+        params.insert(0, ' '.join(phrases))
+    return ' AND '.join(sql), params, bool(phrases)
+
+
+def build_query(conn, table_name, q='', filters=(), search_columns=None):
+    """WHERE clause and parameters for a search
+
+    Returns (where, params, primary key, whether the search index was used).
+    """
+    schema = table_export.table_schema(conn, table_name)
+    kinds = dict(schema)
+    dialect = db_connections.dialect_of(conn)
+    primary_key = db_connections.row_key(conn, table_name)
+    fts_columns = index_columns(conn, table_name)
+    conditions, params, used_index = [], [], False
+
+    # Free text over the text columns (or the requested ones)
+    terms = [term for term in re.split(r'\s+', (q or '').strip()) if term]
+    if terms:
+        targets = table_export.select_columns([name for name, kind in schema], search_columns)
+        text_targets = [name for name in targets if kinds[name] == 'string' and name not in EXCLUDED_COLUMNS]
+        number_targets = [name for name in targets if kinds[name] == 'int']
+        alternatives, alternative_params = [], []
+        if text_targets:
+            sql, sql_params, used_index = _text_condition(
+                table_name, primary_key, fts_columns, [(term, text_targets) for term in terms], dialect)
+            alternatives.append(f"({sql})")
+            alternative_params.extend(sql_params)
+        if len(terms) == 1 and terms[0].isdigit() and number_targets:
+            # A number also finds rows by id / foreign key
+            alternatives.extend(f"{name} = ?" for name in number_targets)
+            alternative_params.extend([int(terms[0])] * len(number_targets))
+        if not alternatives:
+            raise SearchError("None of the search columns hold text")
+        conditions.append('(' + ' OR '.join(alternatives) + ')')
+        params.extend(alternative_params)
+
+    likes = []
+    for column, op, value in filters:
+        kind = kinds[column]
+        if op == 'null':
+            is_null = value.lower() in ('1', 'true', 'yes')
+            conditions.append(f"{column} IS {'' if is_null else 'NOT '}NULL")
+        elif op == 'like':
+            likes.append((value, [column]))
+        elif kind == 'datetime' and re.fullmatch(r'\d{4}-\d{2}-\d{2}', value):
+            sql, sql_params = _day_range_condition(column, op, value)
+            conditions.append(sql)
+            params.extend(sql_params)
+        else:
+            conditions.append(f"{column} {OPERATORS[op]} ?")
+            params.append(_typed_value(column, kind, value))
+
+    if likes:
+        sql, sql_params, used_like_index = _text_condition(table_name, primary_key, fts_columns, likes, dialect)
+        conditions.append(sql)
+        params.extend(sql_params)
+        used_index = used_index or used_like_index
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return db_connections.sql(conn, where), params, primary_key, used_index
+
+
+def _format_value(value):
+    return "" if value is None else str(value)
+
+
+def search_table(conn, table_name, q='', filters=(), search_columns=None, page=1, per_page=DEFAULT_PAGE_SIZE):
+    """Run a search and return one page of rows with the total count"""
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+    page = max(1, page)
+    columns = table_export.table_columns(conn, table_name)
+    where, params, primary_key, used_index = build_query(conn, table_name, q, filters, search_columns)
+
+    cursor = conn.cursor()
+    cursor.execute(
+        db_connections.sql(conn, f"SELECT COUNT(*) FROM (SELECT 1 FROM {table_name}{where} LIMIT ?) AS matches;"),
+        params + [COUNT_LIMIT + 1]
+    )
+    counted = cursor.fetchone()[0]
+    total_count = min(counted, COUNT_LIMIT)
+
+    column_list = ', '.join(f'"{name}"' for name in columns)
+    cursor.execute(
+        db_connections.sql(conn, f"SELECT {column_list} FROM {table_name}{where} ORDER BY {primary_key} LIMIT ? OFFSET ?;"),
+        params + [per_page, (page - 1) * per_page]
+    )
+    rows = [{name: _format_value(value) for name, value in zip(columns, row)} for row in cursor.fetchall()]
+
+    return {
+        "table_name": table_name,
+        "columns": columns,
+        "data": rows,
+        "search_term": q,
+        "filters": [{"column": column, "op": op, "value": value} for column, op, value in filters],
+        "result_count": len(rows),
+        "total_count": total_count,
+        "total_exact": counted <= COUNT_LIMIT,
+        "current_page": page,
+        "per_page": per_page,
+        "total_pages": (total_count + per_page - 1) // per_page,
+        "indexed": used_index,
+    }
+
+
+def main():
+    """Command line interface for the database viewer search indexes"""
+    import sys
+    import os
+
+    if len(sys.argv) < 2:
+        print("🔧 Database Viewer Search Indexes")
+        print("\nUsage:")
+        print("  python table_search.py build <table> [col1,col2]    - Index a table's text columns (default: all)")
+        print("  python table_search.py rebuild <table> [col1,col2]  - Rebuild a table's search index from scratch")
+        print("  python table_search.py drop <table>                 - Remove a table's search index")
+        print("  python table_search.py status                       - Show which tables are indexed")
+        return
+
+    database_url = os.environ.get('DATABASE_URL', '')
+    if database_url and db_connections.sqlite_path(database_url) is None:
+        # PostgreSQL - a connection from the application's engine
+        from app import app
+        from models import db
+        with app.app_context():
+            conn = db.engine.raw_connection()
+    else:
+        db_path = (os.environ.get('VIEWER_DB_PATH') or (database_url and db_connections.sqlite_path(database_url))
+                   or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pathology.db'))
+        if not os.path.exists(db_path):
+            print(f"❌ Database file not found: {db_path}")
+            sys.exit(1)
+        conn = db_connections.connect(db_path)
+
+    command = sys.argv[1].lower()
+    table_name = sys.argv[2] if len(sys.argv) > 2 else None
+    columns = [name.strip() for name in sys.argv[3].split(',') if name.strip()] if len(sys.argv) > 3 else None
+    try:
+        if command in ('build', 'rebuild') and table_name:
+            if ensure_index(conn, table_name, columns, rebuild=command == 'rebuild'):
+                print(f"✅ Search index ready for {table_name}: {', '.join(index_columns(conn, table_name))}")
+            else:
+                print(f"⚠️ {table_name} has no text columns to index")
+        elif command == 'drop' and table_name:
+            drop_index(conn, table_name)
+            print(f"✅ Dropped search index for {table_name}")
+        elif command == 'status':
+            for name in db_connections.list_tables(conn):
+                columns = index_columns(conn, name)
+                if columns:
+                    print(f"  ✅ {name:20s} {', '.join(columns)}")
+                else:
+                    print(f"  ⚠️ {name:20s} not indexed")
+        else:
+            print("❌ Invalid command")
+    except (table_export.ExportError, SearchError) as e:
+        print(f"❌ {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
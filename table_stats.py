@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Table statistics cache for the database viewer
+Row counts per table without a full COUNT(*) on every page load: small tables
+are counted exactly, large ones are estimated from the planner statistics
+(sqlite_stat1 after ANALYZE, pg_class.reltuples on PostgreSQL) or from the
+highest rowid. Counts are refreshed in a background thread once the database
+has changed, and every snapshot says how old it is ("stale since").
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import db_connections
+
+# Tables up to this size are counted exactly on the request path
+EXACT_COUNT_LIMIT = int(os.environ.get('TABLE_STATS_EXACT_LIMIT', 50000))
+# Without a file to watch (PostgreSQL), counts are refreshed after this many seconds
+CACHE_TTL = int(os.environ.get('TABLE_STATS_TTL', 300))
+# A busy database is recounted at most this often
+MIN_REFRESH_INTERVAL = int(os.environ.get('TABLE_STATS_MIN_INTERVAL', 60))
+
+
+def _exact_count(cursor, table_name):
+    cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
+    return cursor.fetchone()[0]
+
+
+def _sqlite_estimates(cursor, tables):
+    """{table: (estimated rows, source)} from sqlite_stat1, else the highest rowid"""
+    estimates = {}
+    try:
+        # The first number of each stat row is the row count seen by the last ANALYZE
+        cursor.execute("SELECT tbl, MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 GROUP BY tbl;")
+        estimates = {table: (rows, 'sqlite_stat1') for table, rows in cursor.fetchall()}
+    except sqlite3.OperationalError:
+        pass  # never analyzed
+
+    for table_name in tables:
+        if table_name in estimates:
+            continue
+        try:
+            # An index lookup - an upper bound that is exact until rows get deleted
+            cursor.execute(f"SELECT MAX(rowid) FROM {table_name};")
+            estimates[table_name] = (cursor.fetchone()[0] or 0, 'max_rowid')
+        except sqlite3.OperationalError:
+            pass  # WITHOUT ROWID table - counted exactly
+    return estimates
+
+
+def _postgres_estimates(cursor, tables):
+    """{table: (estimated rows, source)} from pg_class, kept current by autovacuum"""
+    cursor.execute(
+        "SELECT c.relname, c.reltuples::bigint FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relkind = 'r'"
+    )
+    # reltuples is -1 (or 0 on old servers) before the first VACUUM/ANALYZE
+    return {table: (rows, 'reltuples') for table, rows in cursor.fetchall()
+            if table in tables and rows > 0}
+
+
+def collect_counts(conn, dialect='sqlite', exact_limit=EXACT_COUNT_LIMIT):
+    """{table: {'count', 'exact', 'source'}} - exact below `exact_limit` rows (None: always exact)"""
+    cursor = conn.cursor()
+    tables = db_connections.list_tables(conn)
+    if dialect == 'postgresql':
+        estimates = _postgres_estimates(cursor, tables)
+    else:
+        estimates = _sqlite_estimates(cursor, tables)
+
+    counts = {}
+    for table_name in tables:
+        estimate = estimates.get(table_name)
+        if estimate and exact_limit is not None and estimate[0] > exact_limit:
+            counts[table_name] = {'count': int(estimate[0]), 'exact': False, 'source': estimate[1]}
+        else:
+            counts[table_name] = {'count': _exact_count(cursor, table_name), 'exact': True, 'source': 'count'}
+    return counts
+
+
+class TableStats:
+    """Cached row counts of one database"""
+
+    def __init__(self, get_connection, db_path=None, dialect='sqlite', ttl=CACHE_TTL):
+        self.get_connection = get_connection
+        self.db_path = db_path
+        self.dialect = dialect
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counts = None
+        self._as_of = None
+        self._stale_since = None
+        self._refreshing = False
+
+    def _last_modified(self):
+        """Latest write to the database file or its WAL, or None if it cannot be watched"""
+        if not self.db_path:
+            return None
+        mtimes = [os.path.getmtime(path) for path in (self.db_path, self.db_path + '-wal')
+                  if os.path.exists(path)]
+        return datetime.fromtimestamp(max(mtimes)) if mtimes else None
+
+    def _check_stale(self):
+        """Record when the cached counts stopped matching the database"""
+        if self._stale_since or self._as_of is None:
+            return
+        modified = self._last_modified()
+        if modified is not None:
+            if modified > self._as_of:
+                self._stale_since = modified
+        elif (datetime.now() - self._as_of).total_seconds() > self.ttl:
+            self._stale_since = self._as_of
+
+    def _collect(self, exact_limit):
+        conn = self.get_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        try:
+            return collect_counts(conn, self.dialect, exact_limit)
+        finally:
+            conn.close()
+
+    def refresh(self, exact_limit=EXACT_COUNT_LIMIT):
+        """Recount now, on the calling thread"""
+        as_of = datetime.now()
+        counts = self._collect(exact_limit)
+        with self._lock:
+            self._counts = counts
+            self._as_of = as_of
+            self._stale_since = None
+        return counts
+
+    def _background_refresh(self):
+        try:
+            # Off the request path SQLite counts every table exactly; PostgreSQL
+            # keeps the estimates for big tables since its COUNT(*) always scans
+            self.refresh(None if self.dialect == 'sqlite' else EXACT_COUNT_LIMIT)
+        except Exception as e:
+            print(f"⚠️ Table statistics refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name='table-stats-refresh', daemon=True).start()
+
+    def snapshot(self):
+        """Cached counts plus their age; stale counts are returned and refreshed in the background"""
+        if self._counts is None:
+            self.refresh()
+            if any(not entry['exact'] for entry in self._counts.values()):
+                self._refresh_in_background()
+        else:
+            with self._lock:
+                self._check_stale()
+                due = (self._stale_since is not None and
+                       (datetime.now() - self._as_of).total_seconds() >= MIN_REFRESH_INTERVAL)
+            if due:
+                self._refresh_in_background()
+
+        with self._lock:
+            return {
+                'tables': dict(self._counts),
+                'as_of': self._as_of,
+                'stale_since': self._stale_since,
+                'refreshing': self._refreshing,
+            }
+
+    def count(self, table_name):
+        """(row count, exact) of one table"""
+        entry = self.snapshot()['tables'].get(table_name)
+        if entry is None:
+            # A table created after the last refresh, or one the cache leaves out
+            entry = self.refresh().get(table_name)
+        if entry is None:
+            conn = self.get_connection()
+            try:
+                return _exact_count(conn.cursor(), table_name), True
+            finally:
+                conn.close()
+        return entry['count'], entry['exact']
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+            self._stale_since = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def for_database(get_connection, db_path=None, dialect='sqlite'):
+    """The shared statistics cache of a database (one per path)"""
+    key = (dialect, db_path)
+    with _caches_lock:
+        stats = _caches.get(key)
+        if stats is None:
+            stats = _caches[key] = TableStats(get_connection, db_path, dialect)
+        return stats
+
+
+def format_timestamp(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
@@ -0,0 +1,102 @@
+"""
+Test setup
+The app runs against a throwaway SQLite database that is rebuilt for every
+test. The write paths keep bills, the commission ledger and the dashboard
+counters up to date themselves, so tests check all three against the data
+with the `assert_consistent` fixture.
+"""
+
+import os
+import sys
+import tempfile
+
+_database_dir = tempfile.mkdtemp(prefix='pathology-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_database_dir, 'pathology.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from app import app as flask_app
+from models import db, Patient, Test, Doctor
+import billing
+import catalog_cache
+import commission_ledger
+import dashboard_counters
+import patient_search
+import reference_data
+
+
+@pytest.fixture
+def app():
+    """The app on an empty database; use `with app.app_context():` for direct calls"""
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        patient_search.ensure_search_index(rebuild=True)
+    # Per-process caches would otherwise keep the previous test's data
+    catalog_cache._catalog = None
+    reference_data._lists.clear()
+    dashboard_counters.store.invalidate()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as browser_session:
+        browser_session['logged_in'] = True
+    return client
+
+
+@pytest.fixture
+def lab(app):
+    """A referring doctor (10%), a referred and a walk-in patient and three tests
+
+    The dashboard counters are loaded afterwards, so later writes must adjust them.
+    """
+    with app.app_context():
+        doctor = Doctor(name='Dr Rao', commission_type='percentage', commission_percentage=10.0, is_active=True)
+        db.session.add(doctor)
+        db.session.flush()
+        referred = Patient(first_name='Asha', last_name='Verma', age=40, gender='Female', phone='9876543210',
+                           address='12 Park Street', referring_doctor_id=doctor.id)
+        walk_in = Patient(first_name='Ravi', last_name='Kumar', age=35, gender='Male', phone='9123456780',
+                          address='7 Lake Road')
+        tests = [Test(name='Hemoglobin', cost=100.0, category='Blood'),
+                 Test(name='Lipid Profile', cost=250.0, category='Blood'),
+                 Test(name='Thyroid Profile', cost=400.0, category='Blood')]
+        db.session.add_all([referred, walk_in] + tests)
+        db.session.commit()
+        dashboard_counters.get_counters()
+        return {
+            'doctor_id': doctor.id,
+            'patient_id': referred.id,
+            'walk_in_id': walk_in.id,
+            'test_ids': [test.id for test in tests],
+            'costs': {test.id: test.cost for test in tests},
+        }
+
+
+@pytest.fixture
+def assert_consistent(app):
+    """Check bills, the commission ledger and the dashboard counters against the data"""
+    def check():
+        with app.app_context():
+            assert billing.find_drifted_bills(db.session.connection()) == []
+            assert commission_ledger.verify()['ok']
+            counters = dashboard_counters.get_counters()
+            for name, compute in dashboard_counters.COUNTERS.items():
+                assert counters[name] == pytest.approx(compute()), name
+    return check
+
+
+@pytest.fixture
+def viewer(app, monkeypatch):
+    """The database viewer, reading the test database"""
+    import app as app_module
+    with app.app_context():
+        monkeypatch.setattr(app_module.db_viewer, 'db_path', db.engine.url.database)
+    return app_module.db_viewer
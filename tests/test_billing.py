@@ -0,0 +1,148 @@
+"""Patient bills: one per patient, payments and discounts applied atomically"""
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from models import db, PatientBill, PatientTest, Test as LabTest
+import billing
+
+
+def bill_of(patient_id):
+    return PatientBill.query.filter_by(patient_id=patient_id).one()
+
+
+def order(patient_id, test_id):
+    db.session.add(PatientTest(patient_id=patient_id, test_id=test_id, status='Pending'))
+    db.session.commit()
+    return billing.get_or_create_bill(patient_id)
+
+
+def test_one_bill_per_patient(app, lab):
+    with app.app_context():
+        first = billing.get_or_create_bill(lab['walk_in_id'])
+        second = billing.get_or_create_bill(lab['walk_in_id'])
+        db.session.commit()
+        assert first.id == second.id
+        assert PatientBill.query.filter_by(patient_id=lab['walk_in_id']).count() == 1
+
+        db.session.add(PatientBill(patient_id=lab['walk_in_id'], total_amount=0.0))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_payments_add_up(app, lab, assert_consistent):
+    patient_id = lab['patient_id']
+    with app.app_context():
+        order(patient_id, lab['test_ids'][1])
+        billing.record_payment(patient_id, 100.0)
+        billing.record_payment(patient_id, 50.0)
+        db.session.commit()
+
+        bill = bill_of(patient_id)
+        assert (bill.total_amount, bill.paid_amount, bill.remaining_amount) == (250.0, 150.0, 100.0)
+        assert bill.bill_status == 'partial'
+
+        billing.record_payment(patient_id, 100.0)
+        db.session.commit()
+        assert bill_of(patient_id).bill_status == 'paid'
+    assert_consistent()
+
+
+def test_discount_reduces_balance(app, lab, assert_consistent):
+    patient_id = lab['patient_id']
+    with app.app_context():
+        order(patient_id, lab['test_ids'][2])
+        billing.apply_discount(patient_id, discount_percentage=10.0)
+        billing.record_payment(patient_id, 60.0)
+        db.session.commit()
+
+        bill = bill_of(patient_id)
+        assert bill.discount_amount == 40.0
+        assert bill.remaining_amount == 300.0
+    assert_consistent()
+
+
+def test_discount_never_exceeds_the_total(app, lab, assert_consistent):
+    patient_id = lab['patient_id']
+    with app.app_context():
+        order(patient_id, lab['test_ids'][0])
+        bill = billing.apply_discount(patient_id, discount_amount=150.0)
+        assert (bill.discount_amount, bill.remaining_amount, bill.bill_status) == (100.0, 0.0, 'pending')
+
+        bill = billing.apply_discount(patient_id, discount_percentage=150.0)
+        assert (bill.discount_amount, bill.discount_percentage) == (100.0, 100.0)
+        db.session.commit()
+    assert_consistent()
+
+
+def test_discount_is_reapplied_when_the_bill_is_repriced(app, lab, assert_consistent):
+    referred, walk_in = lab['patient_id'], lab['walk_in_id']
+    hemoglobin, lipid, thyroid = lab['test_ids']
+    with app.app_context():
+        order(referred, lipid)
+        billing.apply_discount(referred, discount_percentage=10.0)
+        order(walk_in, hemoglobin)
+        billing.apply_discount(walk_in, discount_amount=300.0)
+        db.session.commit()
+        assert bill_of(walk_in).discount_amount == 100.0
+
+        order(referred, thyroid)
+        order(walk_in, thyroid)
+        assert (bill_of(referred).discount_amount, bill_of(referred).remaining_amount) == (65.0, 585.0)
+        # The fixed amount as entered, no longer capped by the smaller total
+        assert (bill_of(walk_in).discount_amount, bill_of(walk_in).remaining_amount) == (300.0, 200.0)
+
+        db.session.get(LabTest, lipid).cost = 300.0
+        db.session.commit()
+        assert bill_of(referred).discount_amount == 70.0
+    assert_consistent()
+
+
+def test_startup_adds_missing_discount_columns(app, lab):
+    import app as app_module
+    patient_id = lab['patient_id']
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE patient_bill DROP COLUMN discount_type"))
+            conn.execute(text("ALTER TABLE patient_bill DROP COLUMN discount_value"))
+        app_module.init_database()
+        order(patient_id, lab['test_ids'][1])
+        assert billing.apply_discount(patient_id, discount_percentage=20.0).discount_amount == 50.0
+
+
+def test_bill_follows_tests_assigned_and_cancelled(app, lab, assert_consistent):
+    patient_id = lab['patient_id']
+    hemoglobin, lipid, thyroid = lab['test_ids']
+    with app.app_context():
+        db.session.add_all([PatientTest(patient_id=patient_id, test_id=test_id, status='Pending')
+                            for test_id in (hemoglobin, lipid, thyroid)])
+        db.session.commit()
+        assert bill_of(patient_id).total_amount == 750.0
+
+        cancelled = PatientTest.query.filter_by(patient_id=patient_id, test_id=thyroid).one()
+        cancelled.status = 'Cancelled'
+        db.session.commit()
+        assert bill_of(patient_id).total_amount == 350.0
+    assert_consistent()
+
+
+def test_price_change_reprices_open_bills(app, lab, assert_consistent):
+    patient_id = lab['patient_id']
+    with app.app_context():
+        order(patient_id, lab['test_ids'][0])
+        db.session.get(LabTest, lab['test_ids'][0]).cost = 180.0
+        db.session.commit()
+        assert bill_of(patient_id).total_amount == 180.0
+    assert_consistent()
+
+
+def test_sample_data_seeds_consistent_bills(app, assert_consistent):
+    import sample_data
+    sample_data.create_sample_data()
+    # Seeding twice must not trip the one-bill-per-patient constraint
+    sample_data.create_sample_data()
+    with app.app_context():
+        assert PatientBill.query.count() == 5
+        assert bill_of(2).bill_status == 'paid'
+    assert_consistent()
@@ -0,0 +1,92 @@
+"""Test catalog: one cached copy per process, served to the registration page with an ETag"""
+
+import json
+from sqlalchemy import update
+from models import db, Patient, PatientBill, Test as LabTest
+import billing
+import catalog_cache
+
+
+def test_catalog_is_reused_until_a_test_changes(app, lab):
+    hemoglobin = lab['test_ids'][0]
+    with app.app_context():
+        catalog = catalog_cache.get_catalog()
+        assert catalog.cost(hemoglobin) == 100.0
+        assert catalog_cache.get_catalog() is catalog
+
+        db.session.get(LabTest, hemoglobin).cost = 180.0
+        db.session.commit()
+        reloaded = catalog_cache.get_catalog()
+        assert reloaded.version == catalog.version + 1
+        assert reloaded.cost(hemoglobin) == 180.0
+
+
+def test_sql_writes_bump_the_version(app, lab):
+    with app.app_context():
+        version = catalog_cache.get_catalog().version
+        connection = db.session.connection()
+        connection.execute(update(LabTest.__table__).values(cost=LabTest.__table__.c.cost * 2))
+        catalog_cache.bump(connection)
+        db.session.commit()
+        catalog = catalog_cache.get_catalog()
+        assert catalog.version == version + 1
+        assert catalog.cost(lab['test_ids'][2]) == 800.0
+
+
+def test_catalog_api_answers_304_while_unchanged(client, app, lab):
+    response = client.get('/api/tests/catalog')
+    assert response.status_code == 200
+    assert [test['name'] for test in response.get_json()['tests']] == ['Hemoglobin', 'Lipid Profile', 'Thyroid Profile']
+    etag = response.headers['ETag']
+
+    assert client.get('/api/tests/catalog', headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        db.session.get(LabTest, lab['test_ids'][0]).cost = 120.0
+        db.session.commit()
+    changed = client.get('/api/tests/catalog', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_catalog_search(client, lab):
+    def names(query):
+        return [test['name'] for test in client.get('/api/tests/catalog', query_string={'q': query}).get_json()['tests']]
+
+    assert names('lip') == ['Lipid Profile']
+    assert names('profile') == ['Lipid Profile', 'Thyroid Profile']
+    assert names('hemoglobn') == ['Hemoglobin']
+
+
+def register(client, selected_tests, **fields):
+    form = {'first_name': 'Meena', 'last_name': 'Iyer', 'age_years': '52', 'gender': 'Female',
+            'phone': '9000000001', 'address': '3 Hill Road', 'payment_option': 'half', 'payment_method': 'Cash',
+            'selected_tests': json.dumps(selected_tests)}
+    form.update(fields)
+    return client.post('/multi-step-registration', data=form).get_json()
+
+
+def test_registration_prices_tests_from_the_catalog(client, app, lab, assert_consistent):
+    hemoglobin, lipid, thyroid = lab['test_ids']
+    result = register(client, [{'id': hemoglobin, 'price': 1}, {'id': lipid, 'price': 1}],
+                      discount_type='percentage', discount_value='10')
+    assert result['success'], result
+    registration = result['registration_data']
+    assert (registration['total_amount'], registration['amount_paid']) == (315.0, 158.0)
+    with app.app_context():
+        bill = PatientBill.query.filter_by(patient_id=registration['patient_id']).one()
+        assert (bill.total_amount, bill.discount_amount, bill.remaining_amount) == (350.0, 35.0, 157.0)
+    assert_consistent()
+
+
+def test_registration_rejects_unknown_tests(client, app, lab):
+    result = register(client, [{'name': 'Brand New Test', 'price': 10}])
+    assert not result['success'] and 'Unknown test' in result['error']
+    with app.app_context():
+        assert Patient.query.count() == 2
+        assert LabTest.query.count() == 3
+
+
+def test_calculate_discount_is_capped():
+    assert billing.calculate_discount(500.0, 'percentage', 150) == 500.0
+    assert billing.calculate_discount(500.0, 'amount', 800) == 500.0
+    assert billing.calculate_discount(500.0, 'percentage', 10) == 50.0
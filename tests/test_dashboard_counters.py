@@ -0,0 +1,94 @@
+"""Dashboard counters: adjusted by the writes that commit, untouched by those rolled back"""
+
+from models import db, Patient, PatientTest, Payment
+import billing
+import dashboard_counters
+
+
+def new_patient():
+    return Patient(first_name='Meena', last_name='Iyer', age=52, gender='Female',
+                   phone='9000000001', address='3 Hill Road')
+
+
+def test_counters_follow_committed_writes(app, lab, assert_consistent):
+    with app.app_context():
+        db.session.add(new_patient())
+        patient_test = PatientTest(patient_id=lab['patient_id'], test_id=lab['test_ids'][0], status='Pending')
+        db.session.add(patient_test)
+        db.session.commit()
+
+        db.session.get(PatientTest, patient_test.id).status = 'Completed'
+        db.session.add(Payment(patient_id=lab['patient_id'], amount=100.0, payment_type='full',
+                               payment_method='cash'))
+        db.session.commit()
+
+        counters = dashboard_counters.get_counters()
+        assert counters['total_patients'] == 3
+        assert (counters['pending_tests'], counters['completed_tests']) == (0, 1)
+        assert counters['total_revenue'] == 100.0
+    assert_consistent()
+
+
+def test_rolled_back_writes_are_not_counted(app, lab, assert_consistent):
+    with app.app_context():
+        db.session.add(new_patient())
+        db.session.flush()
+        db.session.rollback()
+        assert dashboard_counters.get_counters()['total_patients'] == 2
+    assert_consistent()
+
+
+def test_changes_to_objects_expired_by_a_commit(app, lab, assert_consistent):
+    with app.app_context():
+        patient_test = PatientTest(patient_id=lab['patient_id'], test_id=lab['test_ids'][0], status='Pending')
+        payment = Payment(patient_id=lab['patient_id'], amount=50.0, payment_type='partial', payment_method='cash')
+        db.session.add_all([patient_test, payment])
+        db.session.commit()
+
+        patient_test.status = 'Completed'
+        payment.amount = 80.0
+        db.session.commit()
+
+        counters = dashboard_counters.get_counters()
+        assert (counters['pending_tests'], counters['completed_tests']) == (0, 1)
+        assert counters['total_revenue'] == 80.0
+    assert_consistent()
+
+
+def test_pending_payments_follow_bill_writes(app, lab, assert_consistent):
+    patient_id = lab['patient_id']
+    with app.app_context():
+        db.session.add(PatientTest(patient_id=patient_id, test_id=lab['test_ids'][1], status='Pending'))
+        db.session.commit()
+        billing.record_payment(patient_id, 100.0)
+        billing.apply_discount(patient_id, discount_amount=50.0)
+        db.session.commit()
+
+        # Adjusted in place, not dropped and recounted
+        cached = dashboard_counters.store.get(dashboard_counters.CACHE_TTL)
+        assert cached['pending_payments'] == 100.0
+    assert_consistent()
+
+
+def test_recount_before_the_increment_is_not_doubled(app, lab, assert_consistent):
+    with app.app_context():
+        db.session.add(new_patient())
+        db.session.flush()
+        # Another request recounts while this transaction's increment is still to come
+        dashboard_counters.store.invalidate(['total_patients'])
+        assert dashboard_counters.get_counters()['total_patients'] == 3
+        db.session.commit()
+        assert dashboard_counters.get_counters()['total_patients'] == 3
+    assert_consistent()
+
+
+def test_recount_overlapped_by_a_write_is_not_cached(app, lab, assert_consistent):
+    with app.app_context():
+        dashboard_counters.store.invalidate(['total_patients'])
+        write_stamps = dashboard_counters.store.write_stamps()
+        # Counted before this patient commits, stored after
+        db.session.add(new_patient())
+        db.session.commit()
+        dashboard_counters.store.set_many({'total_patients': 2}, dashboard_counters.CACHE_TTL, write_stamps)
+        assert dashboard_counters.get_counters()['total_patients'] == 3
+    assert_consistent()
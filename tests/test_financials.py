@@ -0,0 +1,20 @@
+"""Financial overview: per-patient totals agree with the bills"""
+
+from models import db, PatientTest
+from financials import build_financial_overview
+
+
+def test_cancelled_tests_are_not_revenue(app, lab):
+    patient_id = lab['patient_id']
+    with app.app_context():
+        db.session.add_all([PatientTest(patient_id=patient_id, test_id=test_id, status='Pending')
+                            for test_id in lab['test_ids']])
+        db.session.commit()
+        PatientTest.query.filter_by(patient_id=patient_id, test_id=lab['test_ids'][2]).one().status = 'Cancelled'
+        db.session.commit()
+
+        overview = build_financial_overview()
+        row = next(data for data in overview.patient_financial_data if data['patient'].id == patient_id)
+        assert (row['total_amount'], row['test_count']) == (350.0, 2)
+        assert row['total_amount'] == row['bill'].total_amount
+        assert overview.summary_stats['total_revenue'] == 350.0
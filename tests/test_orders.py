@@ -0,0 +1,54 @@
+"""Test orders: one bulk INSERT, then the bill, ledger and counter updates the flush hooks would make"""
+
+from models import db, PatientBill, PatientTest, DoctorCommission, Payment
+import orders
+
+
+def test_create_order_updates_bill_ledger_and_counters(app, lab, assert_consistent):
+    patient_id = lab['patient_id']
+    with app.app_context():
+        order = orders.create_order(patient_id, lab['test_ids'], sample_collector='Alice')
+        db.session.commit()
+
+        assert len(order) == 3
+        assert order.total_cost == 750.0
+        assert PatientBill.query.filter_by(patient_id=patient_id).one().total_amount == 750.0
+        commissions = DoctorCommission.query.filter_by(patient_id=patient_id).all()
+        assert sorted(entry.commission_amount for entry in commissions) == [10.0, 25.0, 40.0]
+    assert_consistent()
+
+
+def test_unknown_tests_are_skipped(app, lab, assert_consistent):
+    with app.app_context():
+        order = orders.create_order(lab['walk_in_id'], [lab['test_ids'][0], 999999, 'x'])
+        db.session.commit()
+        assert len(order) == 1
+        assert PatientTest.query.filter_by(patient_id=lab['walk_in_id']).count() == 1
+    assert_consistent()
+
+
+def test_empty_order_writes_nothing(app, lab, assert_consistent):
+    with app.app_context():
+        order = orders.create_order(lab['walk_in_id'], [])
+        db.session.commit()
+        assert len(order) == 0
+        assert PatientBill.query.filter_by(patient_id=lab['walk_in_id']).count() == 0
+    assert_consistent()
+
+
+def test_assign_multiple_tests_with_advance(client, app, lab, assert_consistent):
+    patient_id = lab['patient_id']
+    response = client.post('/assign_multiple_tests', data={
+        'patient_id': patient_id,
+        'test_ids[]': lab['test_ids'][:2],
+        'collect_payment': '1',
+        'advance_amount': '100',
+        'payment_method': 'cash',
+    })
+    assert response.status_code == 302
+    with app.app_context():
+        bill = PatientBill.query.filter_by(patient_id=patient_id).one()
+        assert (bill.total_amount, bill.paid_amount, bill.remaining_amount) == (350.0, 100.0, 250.0)
+        assert Payment.query.filter_by(patient_id=patient_id).count() == 1
+        assert DoctorCommission.query.filter_by(patient_id=patient_id).count() == 2
+    assert_consistent()
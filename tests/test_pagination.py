@@ -0,0 +1,62 @@
+"""Keyset pagination: cursors round trip and pages meet without gaps or repeats"""
+
+from datetime import datetime, date
+from models import db, Patient, Test as LabTest
+from pagination import encode_cursor, decode_cursor, paginate_keyset
+
+
+def test_cursor_round_trip():
+    registered = datetime(2024, 3, 1, 9, 30, 15, 250000)
+    assert decode_cursor(encode_cursor(registered, 7)) == (registered, 7)
+    assert decode_cursor(encode_cursor(date(2024, 3, 1), 8)) == (date(2024, 3, 1), 8)
+    assert decode_cursor(encode_cursor('Lipid Profile', 9)) == ('Lipid Profile', 9)
+
+
+def test_invalid_cursor_is_ignored():
+    assert decode_cursor('') is None
+    assert decode_cursor('not-a-cursor') is None
+
+
+def test_pages_walk_forward_and_back(app, lab):
+    with app.app_context():
+        query = LabTest.query
+        first = paginate_keyset(query, LabTest.name, LabTest.id, per_page=2, descending=False)
+        assert [test.name for test in first] == ['Hemoglobin', 'Lipid Profile']
+        assert first.has_next and not first.has_prev
+
+        last = paginate_keyset(query, LabTest.name, LabTest.id, after=first.next_cursor,
+                               per_page=2, descending=False)
+        assert [test.name for test in last] == ['Thyroid Profile']
+        assert last.has_prev and not last.has_next
+
+        back = paginate_keyset(query, LabTest.name, LabTest.id, before=last.prev_cursor,
+                               per_page=2, descending=False)
+        assert [test.id for test in back] == [test.id for test in first]
+        assert not back.has_prev
+
+
+def test_equal_sort_values_are_split_by_id(app):
+    registered = datetime(2024, 3, 1, 9, 0)
+    with app.app_context():
+        db.session.add_all([Patient(first_name=f'Patient{n}', last_name='Same', age=30, gender='Male',
+                                    phone=f'90000000{n:02d}', address='-', date_registered=registered)
+                            for n in range(5)])
+        db.session.commit()
+
+        seen = []
+        cursor = None
+        while True:
+            page = paginate_keyset(Patient.query, Patient.date_registered, Patient.id, after=cursor, per_page=2)
+            seen.extend(patient.id for patient in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        assert seen == sorted(seen, reverse=True)
+        assert len(seen) == 5
+
+
+def test_list_page_links_to_next_page(client, lab):
+    response = client.get('/tests?per_page=2')
+    assert response.status_code == 200
+    assert b'Hemoglobin' in response.data and b'Thyroid Profile' not in response.data
+    assert b'after=' in response.data
@@ -0,0 +1,55 @@
+"""Patient picker: paged type-ahead lookups and the PatientField that validates one id"""
+
+from datetime import datetime
+from models import db, Patient
+from forms import PaymentForm
+
+
+def pick(client, **args):
+    response = client.get('/api/patients/picker', query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_picker_pages_newest_first(client, app, lab):
+    with app.app_context():
+        db.session.get(Patient, lab['patient_id']).date_registered = datetime(2024, 1, 1)
+        db.session.get(Patient, lab['walk_in_id']).date_registered = datetime(2024, 2, 1)
+        db.session.commit()
+
+    first = pick(client, per_page=1)
+    assert [result['id'] for result in first['results']] == [lab['walk_in_id']]
+    second = pick(client, per_page=1, after=first['next_cursor'])
+    assert [result['id'] for result in second['results']] == [lab['patient_id']]
+    assert second['next_cursor'] is None
+
+
+def test_picker_searches_names_and_phones(client, lab):
+    assert [result['id'] for result in pick(client, q='Verma')['results']] == [lab['patient_id']]
+    assert [result['id'] for result in pick(client, q='91234')['results']] == [lab['walk_in_id']]
+
+
+def test_typed_id_is_listed_first_once(client, lab):
+    walk_in = lab['walk_in_id']
+    ids = [result['id'] for result in pick(client, q=str(walk_in))['results']]
+    assert ids[0] == walk_in
+    assert ids.count(walk_in) == 1
+
+
+def test_patient_field_validates_the_chosen_id(app, lab):
+    data = {'amount': '100', 'payment_type': 'advance', 'payment_method': 'cash'}
+    with app.test_request_context(method='POST', data=dict(data, patient_id='999999')):
+        form = PaymentForm()
+        assert not form.validate()
+        assert form.patient_id.errors == ['Patient not found']
+
+    with app.test_request_context(method='POST', data=dict(data, patient_id=str(lab['walk_in_id']))):
+        form = PaymentForm()
+        form.validate()
+        assert form.patient_id.errors == []
+        # Only the chosen patient is rendered, after the placeholder
+        assert [value for value, label, selected, render_kw in form.patient_id.iter_choices()] == [0, lab['walk_in_id']]
+
+
+def test_overlong_number_is_not_an_id(client, lab):
+    assert pick(client, q='9' * 30)['results'] == []
@@ -0,0 +1,58 @@
+"""Patient search: trigram name/phone matches and the type-ahead lookups by id and phone"""
+
+from models import db, Patient
+import patient_search
+
+
+def search(client, query):
+    response = client.get('/api/patients/search', query_string={'q': query})
+    assert response.status_code == 200
+    return [(result['id'], result['match']) for result in response.get_json()['results']]
+
+
+def test_name_search(client, lab):
+    asha = lab['patient_id']
+    assert search(client, 'Verma') == [(asha, 'name')]
+    assert search(client, 'asha verma') == [(asha, 'name')]
+    assert search(client, 'Nobody') == []
+
+
+def test_exact_phone_and_phone_suffix(client, lab):
+    assert search(client, '9876543210')[0] == (lab['patient_id'], 'phone')
+    assert search(client, '6780') == [(lab['walk_in_id'], 'phone_suffix')]
+
+
+def test_formatted_phones_match_by_digits(client, app, lab):
+    with app.app_context():
+        patient = Patient(first_name='Meena', last_name='Iyer', age=52, gender='Female',
+                          phone='+91 91234-55555', address='3 Hill View')
+        db.session.add(patient)
+        db.session.commit()
+        meena = patient.id
+    assert search(client, '55555') == [(meena, 'phone_suffix')]
+    assert search(client, '234 55555') == [(meena, 'phone_suffix')]
+    assert search(client, '919123455555') == [(meena, 'phone')]
+
+
+def test_patient_id_is_listed_first(client, lab):
+    assert search(client, str(lab['walk_in_id']))[0] == (lab['walk_in_id'], 'id')
+
+
+def test_overlong_number_is_not_an_id(client, lab):
+    assert search(client, '9' * 30) == []
+    assert patient_search.patient_by_id('٣') is None
+
+
+def test_index_follows_patient_updates(app, lab):
+    with app.app_context():
+        patient = db.session.get(Patient, lab['walk_in_id'])
+        patient.last_name = 'Sharma'
+        db.session.commit()
+        matches = patient_search.filter_query(Patient.query, 'Sharma').all()
+        assert [match.id for match in matches] == [lab['walk_in_id']]
+        assert patient_search.filter_query(Patient.query, 'Kumar').count() == 0
+
+
+def test_patients_page_filters_by_search(client, lab):
+    response = client.get('/patients?search=Kumar')
+    assert b'Ravi' in response.data and b'Asha' not in response.data
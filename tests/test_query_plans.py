@@ -0,0 +1,9 @@
+"""The hot query paths must be served by indexes (see check_query_plans.py)"""
+
+from check_query_plans import check_query_plans
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        failures = check_query_plans()
+    assert failures == [], f"full table scans: {failures}"
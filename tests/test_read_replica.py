@@ -0,0 +1,67 @@
+"""Read replica routing: fresh replicas serve @use_replica reads, otherwise the primary does"""
+
+import os
+import time
+import pytest
+from flask import session as browser_session
+from models import db, Patient
+import read_replica
+
+
+@pytest.fixture
+def replica(app, lab, tmp_path, monkeypatch):
+    """A SQLite snapshot replica of the lab data, checked on every read"""
+    snapshot = str(tmp_path / 'replica.db')
+    with app.app_context():
+        read_replica.refresh_snapshot(db.engine.url.database, snapshot)
+    monkeypatch.setitem(app.config, 'REPLICA_DATABASE_URL', f'sqlite:///{snapshot}')
+    monkeypatch.setattr(read_replica, 'REPLICA_CHECK_INTERVAL', 0)
+    router = read_replica.ReplicaRouter()
+    router.init_app(app)
+    monkeypatch.setattr(read_replica, 'router', router)
+    yield snapshot
+    router.engine.dispose()
+
+
+def rename_on_primary(app, patient_id):
+    """A change the replica has not seen yet"""
+    with app.app_context():
+        db.session.get(Patient, patient_id).last_name = 'Sharma'
+        db.session.commit()
+
+
+def printed_name(client, patient_id):
+    response = client.get(f'/print_bill/{patient_id}')
+    assert response.status_code == 200
+    return 'Sharma' if b'Sharma' in response.data else 'Verma'
+
+
+def test_fresh_replica_serves_reads(client, app, lab, replica):
+    rename_on_primary(app, lab['patient_id'])
+    assert printed_name(client, lab['patient_id']) == 'Verma'
+
+
+def test_stale_replica_falls_back_to_primary(client, app, lab, replica):
+    rename_on_primary(app, lab['patient_id'])
+    an_hour_ago = time.time() - 3600
+    os.utime(replica, (an_hour_ago, an_hour_ago))
+    assert printed_name(client, lab['patient_id']) == 'Sharma'
+
+
+def test_unreachable_replica_falls_back_to_primary(client, app, lab, replica):
+    rename_on_primary(app, lab['patient_id'])
+    os.remove(replica)
+    assert printed_name(client, lab['patient_id']) == 'Sharma'
+    assert read_replica.router.status()['error']
+
+
+def test_browser_reads_its_own_writes(client, app, lab, replica):
+    with app.test_request_context():
+        db.session.get(Patient, lab['patient_id']).last_name = 'Sharma'
+        db.session.commit()
+        last_write_at = browser_session['last_write_at']
+    assert last_write_at >= os.path.getmtime(replica)
+
+    with client.session_transaction() as session:
+        session['last_write_at'] = last_write_at
+    assert printed_name(client, lab['patient_id']) == 'Sharma'
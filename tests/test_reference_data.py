@@ -0,0 +1,16 @@
+"""Dropdown lists: cached per process, reloaded when a hospital, collector or doctor changes"""
+
+from models import db, Doctor, SampleCollector
+import reference_data
+
+
+def test_lists_follow_changes(app, lab):
+    with app.app_context():
+        assert reference_data.collector_choices() == [('', 'Select Collector')]
+        assert reference_data.doctor_choices()[1:] == [(str(lab['doctor_id']), 'Dr Rao - General')]
+
+        db.session.add(SampleCollector(name='Alice'))
+        db.session.get(Doctor, lab['doctor_id']).is_active = False
+        db.session.commit()
+        assert reference_data.collector_choices()[1:] == [('Alice', 'Alice')]
+        assert reference_data.doctor_choices()[1:] == []
@@ -0,0 +1,125 @@
+"""Result entry and analyzer batches: bulk UPDATEs with the bill, ledger and counter updates made by hand"""
+
+from sqlalchemy import text
+from models import db, PatientBill, PatientTest, DoctorCommission
+import result_entry
+
+
+def order_all(app, lab, barcode=None):
+    """Assign every lab test to the referred patient; returns the patient test ids"""
+    with app.app_context():
+        patient_tests = [PatientTest(patient_id=lab['patient_id'], test_id=test_id, status='Pending', barcode=barcode)
+                         for test_id in lab['test_ids']]
+        db.session.add_all(patient_tests)
+        db.session.commit()
+        return [patient_test.id for patient_test in patient_tests]
+
+
+def bill_total(patient_id):
+    return PatientBill.query.filter_by(patient_id=patient_id).one().total_amount
+
+
+def test_bulk_completion_moves_counters(app, lab, assert_consistent):
+    ids = order_all(app, lab)
+    with app.app_context():
+        current = result_entry.load_for_update(ids)
+        result_entry.apply_changes(current, [
+            {'id': ids[0], 'status': 'Completed', 'results': '13.5'},
+            {'id': ids[1], 'status': 'Completed'},
+            {'id': ids[2], 'notes': 'Repeat sample'},
+        ])
+        db.session.commit()
+        assert PatientTest.query.filter_by(status='Completed').count() == 2
+        assert db.session.get(PatientTest, ids[2]).notes == 'Repeat sample'
+    assert_consistent()
+
+
+def test_cancel_and_restore_reprice_bill_and_ledger(app, lab, assert_consistent):
+    ids = order_all(app, lab)
+    patient_id = lab['patient_id']
+    with app.app_context():
+        # ids[2] is the 400.00 thyroid profile
+        result_entry.apply_changes(result_entry.load_for_update(ids), [{'id': ids[2], 'status': 'Cancelled'}])
+        db.session.commit()
+        assert bill_total(patient_id) == 350.0
+        entry = DoctorCommission.query.filter_by(patient_test_id=ids[2]).one()
+        assert entry.status == 'cancelled'
+    assert_consistent()
+
+    with app.app_context():
+        result_entry.apply_changes(result_entry.load_for_update(ids), [{'id': ids[2], 'status': 'Pending'}])
+        db.session.commit()
+        assert bill_total(patient_id) == 750.0
+    assert_consistent()
+
+
+def test_process_bulk_update_route(client, app, lab, assert_consistent):
+    ids = order_all(app, lab)
+    response = client.post('/process_bulk_update', data={
+        'selected_tests[]': ids,
+        'bulk_status': 'Cancelled',
+        'bulk_notes': 'Sample rejected',
+    })
+    assert response.status_code == 302
+    with app.app_context():
+        assert bill_total(lab['patient_id']) == 0.0
+        assert PatientTest.query.filter_by(status='Cancelled').count() == 3
+    assert_consistent()
+
+
+def test_update_result_moves_counters(app, lab, assert_consistent):
+    ids = order_all(app, lab)
+    with app.app_context():
+        result_entry.update_result(ids[0], '12.1', status='Completed')
+        db.session.commit()
+        assert db.session.get(PatientTest, ids[0]).date_completed is not None
+    assert_consistent()
+
+
+def test_batch_upload(client, app, lab, assert_consistent):
+    ids = order_all(app, lab)
+    response = client.post('/api/test-results/batch', json=[
+        {'patient_test_id': ids[0], 'result': '14.2'},
+        {'patient_test_id': ids[1], 'result': '180', 'status': 'In Progress'},
+        {'patient_test_id': 999999, 'result': '1'},
+    ])
+    assert response.status_code == 200
+    report = response.get_json()
+    assert (report['applied'], report['failed']) == (2, 1)
+    with app.app_context():
+        assert db.session.get(PatientTest, ids[0]).status == 'Completed'
+        assert db.session.get(PatientTest, ids[1]).status == 'In Progress'
+        assert bill_total(lab['patient_id']) == 750.0
+    assert_consistent()
+
+
+def test_csv_batch_by_barcode(client, app, lab, assert_consistent):
+    ids = order_all(app, lab, barcode='S-1001')
+    response = client.post('/api/test-results/batch', content_type='text/csv',
+                           data='sample_id,test_name,value\nS-1001,Hemoglobin,13.9\nS-1001,,5\n')
+    report = response.get_json()
+    assert (report['applied'], report['failed']) == (1, 1)
+    with app.app_context():
+        assert db.session.get(PatientTest, ids[0]).results == '13.9'
+    assert_consistent()
+
+
+def test_batch_dry_run_writes_nothing(client, app, lab, assert_consistent):
+    ids = order_all(app, lab)
+    response = client.post('/api/test-results/batch?dry_run=1', json=[{'patient_test_id': ids[0], 'result': '9'}])
+    assert response.get_json()['dry_run']
+    with app.app_context():
+        assert db.session.get(PatientTest, ids[0]).status == 'Pending'
+    assert_consistent()
+
+
+def test_startup_adds_missing_barcode_column(app, lab):
+    import app as app_module
+    with app.app_context():
+        # A patient_test table from before the barcode column existed
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_patient_test_barcode"))
+            conn.execute(text("ALTER TABLE patient_test DROP COLUMN barcode"))
+        app_module.init_database()
+        order_all(app, lab, barcode='S-2002')
+        assert PatientTest.query.filter_by(barcode='S-2002').count() == 3
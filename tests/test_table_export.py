@@ -0,0 +1,108 @@
+"""Database viewer exports: streamed CSV, typed formats, incremental since= exports and gzip"""
+
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+import pytest
+from models import db, Patient
+import db_connections
+import table_export
+
+
+def read_csv(data):
+    return list(csv.reader(io.StringIO(data.decode('utf-8'))))
+
+
+def test_csv_export_streams_every_row(client, lab, viewer):
+    response = client.get('/db-viewer/api/export/test')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    rows = read_csv(response.data)
+    assert rows[0][:3] == ['id', 'name', 'description']
+    assert sorted(row[1] for row in rows[1:]) == ['Hemoglobin', 'Lipid Profile', 'Thyroid Profile']
+
+
+def test_selected_columns_only(client, lab, viewer):
+    rows = read_csv(client.get('/db-viewer/api/export/test?columns=name,cost').data)
+    assert rows[0] == ['name', 'cost']
+    assert ['Lipid Profile', '250.0'] in rows
+
+
+def test_gzip_export(client, lab, viewer):
+    plain = client.get('/db-viewer/api/export/patient').data
+    response = client.get('/db-viewer/api/export/patient?gzip=1')
+    assert response.mimetype == 'application/gzip'
+    assert gzip.decompress(response.data) == plain
+
+
+def test_invalid_requests_are_rejected(client, lab, viewer):
+    assert client.get('/db-viewer/api/export/no_such_table').get_json()['error'] == 'Table not found'
+    assert 'Unknown columns' in client.get('/db-viewer/api/export/test?columns=name,price').get_json()['error']
+
+
+def set_registered(app, lab, dates):
+    with app.app_context():
+        for patient_id, registered in zip((lab['patient_id'], lab['walk_in_id']), dates):
+            db.session.get(Patient, patient_id).date_registered = registered
+        db.session.commit()
+
+
+def test_jsonl_export_keeps_types(client, lab, viewer):
+    response = client.get('/db-viewer/api/export/test?format=jsonl&columns=name,cost')
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert {'name': 'Lipid Profile', 'cost': 250.0} in rows
+
+
+def test_since_exports_only_newer_rows(client, app, lab, viewer):
+    set_registered(app, lab, [datetime(2024, 5, 1, 9, 0), datetime(2024, 5, 3, 17, 30)])
+    url = '/db-viewer/api/export/patient'
+    args = {'format': 'jsonl', 'columns': 'id', 'since_column': 'date_registered'}
+
+    full = client.get(url, query_string=args)
+    assert full.headers['X-Export-Watermark'] == '2024-05-03 17:30:00.000000'
+    assert len(full.data.splitlines()) == 2
+
+    newer = client.get(url, query_string={**args, 'since': '2024-05-02T00:00:00'})
+    assert [json.loads(line)['id'] for line in newer.data.splitlines()] == [lab['walk_in_id']]
+
+    caught_up = client.get(url, query_string={**args, 'since': full.headers['X-Export-Watermark']})
+    assert caught_up.data == b''
+
+
+def test_since_keeps_the_watermark_day_of_date_columns(app, viewer):
+    with db_connections.connection(viewer.db_path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS lab_visit (id INTEGER PRIMARY KEY, visit_date DATE);")
+        conn.execute("DELETE FROM lab_visit;")
+        conn.execute("INSERT INTO lab_visit (visit_date) VALUES ('2024-05-01'), ('2024-05-03');")
+        conn.commit()
+        schema = table_export.table_schema(conn, 'lab_visit')
+
+        def exported(since):
+            where, params, watermark = table_export.since_filter(conn, 'lab_visit', schema, since)
+            rows = conn.execute(f"SELECT visit_date FROM lab_visit{where} ORDER BY id;", params).fetchall()
+            return [row[0] for row in rows], watermark
+
+        assert exported('2024-05-02T08:00:00') == (['2024-05-03'], '2024-05-03')
+        # Another visit recorded on the watermark's day after the export ran
+        conn.execute("INSERT INTO lab_visit (visit_date) VALUES ('2024-05-03');")
+        conn.commit()
+        assert exported('2024-05-03')[0] == ['2024-05-03', '2024-05-03']
+        conn.execute("DROP TABLE lab_visit;")
+        conn.commit()
+
+
+def test_invalid_since_is_rejected(client, lab, viewer):
+    assert 'since must be' in client.get('/db-viewer/api/export/patient?since=yesterday').get_json()['error']
+    error = client.get('/db-viewer/api/export/patient?since=2024-01-01&since_column=phone').get_json()['error']
+    assert 'not a date column' in error
+
+
+def test_parquet_export(client, lab, viewer):
+    pq = pytest.importorskip('pyarrow.parquet')
+    response = client.get('/db-viewer/api/export/test?format=parquet&columns=name,cost')
+    table = pq.read_table(io.BytesIO(response.data))
+    assert sorted(table.column('cost').to_pylist()) == [100.0, 250.0, 400.0]
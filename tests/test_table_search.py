@@ -0,0 +1,66 @@
+"""Database viewer search: opt-in per-column indexes with a LIKE fallback"""
+
+import sys
+import pytest
+from models import db, PatientTest
+import db_connections
+import table_search
+
+
+def search(client, table, **args):
+    response = client.get(f'/db-viewer/api/search/{table}', query_string=args)
+    result = response.get_json()
+    assert 'error' not in result, result.get('error')
+    return result
+
+
+@pytest.fixture
+def ordered(app, lab):
+    with app.app_context():
+        db.session.add_all([
+            PatientTest(patient_id=lab['patient_id'], test_id=lab['test_ids'][0], status='Pending',
+                        notes='Fasting sample', results='Normal range'),
+            PatientTest(patient_id=lab['walk_in_id'], test_id=lab['test_ids'][1], status='Pending',
+                        notes='Repeat draw', results='Fasting glucose high'),
+        ])
+        db.session.commit()
+
+
+def test_startup_builds_no_viewer_indexes(app, viewer):
+    import app as app_module
+    with app.app_context():
+        app_module.init_database()
+    with db_connections.connection(viewer.db_path) as conn:
+        assert [name for name in db_connections.list_tables(conn)
+                if table_search.index_columns(conn, name)] == []
+
+
+def test_index_limited_to_chosen_columns(client, ordered, viewer):
+    with db_connections.connection(viewer.db_path) as conn:
+        assert table_search.ensure_index(conn, 'patient_test', ['notes'])
+        assert table_search.index_columns(conn, 'patient_test') == ['notes']
+
+    indexed = search(client, 'patient_test', q='fasting', search_columns='notes')
+    assert indexed['indexed'] and indexed['data'][0]['notes'] == 'Fasting sample'
+
+    # results has no index - LIKE still finds it
+    unindexed = search(client, 'patient_test', q='fasting', search_columns='results')
+    assert not unindexed['indexed'] and unindexed['data'][0]['results'] == 'Fasting glucose high'
+
+
+def test_only_text_columns_can_be_indexed(app, viewer):
+    with db_connections.connection(viewer.db_path) as conn:
+        with pytest.raises(table_search.SearchError):
+            table_search.ensure_index(conn, 'patient_test', ['notes', 'test_id'])
+        assert table_search.index_columns(conn, 'patient_test') is None
+
+
+def test_build_command(ordered, viewer, monkeypatch, capsys):
+    monkeypatch.setenv('VIEWER_DB_PATH', viewer.db_path)
+    monkeypatch.setattr(sys, 'argv', ['table_search.py', 'build', 'patient_test', 'notes,results'])
+    table_search.main()
+    assert 'Search index ready for patient_test: results, notes' in capsys.readouterr().out
+
+    monkeypatch.setattr(sys, 'argv', ['table_search.py', 'build'])
+    table_search.main()
+    assert 'Invalid command' in capsys.readouterr().out
@@ -5,12 +5,13 @@ Access SQLite database through web browser from anywhere
 """
 
 from flask import Flask, render_template, jsonify, request, send_file
-import sqlite3
+import db_connections
 import os
-import json
 from datetime import datetime
 import pandas as pd
 import io
+import table_export
+import table_search
 
 # Create separate Flask app for database viewer
 db_viewer_app = Flask(__name__, template_folder='templates')
@@ -25,10 +26,8 @@ class WebDatabaseViewer:
             self.db_path = db_path
     
     def get_connection(self):
-        """Get database connection"""
-        if os.path.exists(self.db_path):
-            return sqlite3.connect(self.db_path)
-        return None
+        """Get a pooled database connection (close() releases it)"""
+        return db_connections.connect(self.db_path)
     
     def get_database_info(self):
         """Get database information"""
@@ -115,52 +114,25 @@ class WebDatabaseViewer:
         except Exception as e:
             return {"error": str(e)}
     
-    def search_table(self, table_name, search_term, limit=100):
-        """Search data in table"""
+    def search_table(self, table_name, search_term, args=(), page=1, per_page=100):
+        """Search data in table (see table_search for the filter syntax)"""
         try:
             conn = self.get_connection()
             if not conn:
                 return {"error": "Database connection failed"}
-            
-            cursor = conn.cursor()
-            
-            # Get column info
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns_info = cursor.fetchall()
-            columns = [col[1] for col in columns_info]
-            
-            # Build search query
-            search_conditions = []
-            for col in columns:
-                search_conditions.append(f"{col} LIKE ?")
-            
-            search_query = f"SELECT * FROM {table_name} WHERE {' OR '.join(search_conditions)} LIMIT {limit};"
-            search_params = [f"%{search_term}%"] * len(columns)
-            
-            cursor.execute(search_query, search_params)
-            rows = cursor.fetchall()
-            
-            # Format data
-            formatted_rows = []
-            for row in rows:
-                formatted_row = {}
-                for i, col in enumerate(columns):
-                    value = row[i]
-                    if value is None:
-                        formatted_row[col] = ""
-                    else:
-                        formatted_row[col] = str(value)
-                formatted_rows.append(formatted_row)
-            
-            conn.close()
-            
-            return {
-                "table_name": table_name,
-                "columns": columns,
-                "data": formatted_rows,
-                "search_term": search_term,
-                "result_count": len(formatted_rows)
-            }
+
+            try:
+                schema = table_export.table_schema(conn, table_name)
+                return table_search.search_table(
+                    conn, table_name,
+                    q=search_term,
+                    filters=table_search.parse_filters(args, schema),
+                    search_columns=dict(args).get('search_columns'),
+                    page=page,
+                    per_page=per_page
+                )
+            finally:
+                conn.close()
         except Exception as e:
             return {"error": str(e)}
 
@@ -188,8 +160,10 @@ def api_table_data(table_name):
 def api_search_table(table_name):
     """API endpoint for searching table"""
     search_term = request.args.get('q', '')
-    limit = int(request.args.get('limit', 100))
-    return jsonify(viewer.search_table(table_name, search_term, limit))
+    page = int(request.args.get('page', 1))
+    per_page = int(request.args.get('per_page', request.args.get('limit', 100)))
+    return jsonify(viewer.search_table(table_name, search_term, list(request.args.items(multi=True)),
+                                       page, per_page))
 
 @db_viewer_app.route('/api/export/<table_name>')
 def api_export_table(table_name):
@@ -200,7 +174,7 @@ def api_export_table(table_name):
             return jsonify({"error": "Database connection failed"})
         
         # Get all data
-        df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
+        df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn.raw)
         conn.close()
         
         # Create CSV in memory